@@ -1,9 +1,22 @@
 import logging
-import asyncio
+import os
+import time
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, CallbackQueryHandler, filters, MessageHandler
-from config import ADMIN_BOT_TOKEN, ADMIN_ID
-from database import get_db_connection
+from config import ADMIN_BOT_TOKEN, ADMIN_ID, UPDATE_CONCURRENCY
+from update_processor import PerUserUpdateProcessor
+from metrics import timed_handler, InstrumentedRequest
+import outbound
+import archive
+import async_db as db
+import export
+import ledger
+import order_browser
+import order_queue
+import referrals
+from membership import invalidate_channels
+from broadcast import create_job, load_job, set_status_message, start_job, resume_jobs, audience_size
+import segments
 import traceback
 
 logging.basicConfig(
@@ -11,6 +24,21 @@ logging.basicConfig(
     level=logging.INFO
 )
 
+async def post_init(application: ApplicationBuilder):
+    # Pick up broadcasts interrupted by a restart
+    try:
+        await resume_jobs(application)
+    except Exception as e:
+        logging.error(f"Error resuming broadcasts: {e}")
+    order_queue.notifier.start(application.bot)
+    ledger.snapshotter.start()
+    archive.archiver.start()
+
+async def post_shutdown(application: ApplicationBuilder):
+    await order_queue.notifier.stop()
+    await ledger.snapshotter.stop()
+    await archive.archiver.stop()
+
 # Helper to check admin
 def is_admin(user_id):
     try:
@@ -18,6 +46,7 @@ def is_admin(user_id):
     except:
         return False
 
+@timed_handler
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
@@ -28,7 +57,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = [
         [InlineKeyboardButton("🛍️ Services", callback_data='btn_services'),
          InlineKeyboardButton("📦 Orders", callback_data='btn_orders')],
-        [InlineKeyboardButton("📢 Channels", callback_data='btn_channels')],
+        [InlineKeyboardButton("📢 Channels", callback_data='btn_channels'),
+         InlineKeyboardButton("🏆 Referrals", callback_data='btn_referrals')],
         [InlineKeyboardButton("🔄 Refresh", callback_data='btn_refresh')]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -45,6 +75,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Note: Removed markdown parse_mode to be safe, or we can use it if we are careful. 
     # Let's keep it simple for now to avoid crash.
 
+@timed_handler
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     user_id = query.from_user.id
@@ -62,7 +93,8 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         keyboard = [
             [InlineKeyboardButton("🛍️ Services", callback_data='btn_services'),
              InlineKeyboardButton("📦 Orders", callback_data='btn_orders')],
-            [InlineKeyboardButton("📢 Channels", callback_data='btn_channels')],
+            [InlineKeyboardButton("📢 Channels", callback_data='btn_channels'),
+             InlineKeyboardButton("🏆 Referrals", callback_data='btn_referrals')],
             [InlineKeyboardButton("🔄 Refresh", callback_data='btn_refresh')]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
@@ -76,9 +108,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     elif data == 'btn_services':
         # List services
-        conn = get_db_connection()
-        services = conn.execute('SELECT * FROM services').fetchall()
-        conn.close()
+        services = await db.list_services()
 
         text = "🛍️ **Manage Services**\n\n"
         if not services:
@@ -93,27 +123,52 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup = InlineKeyboardMarkup(keyboard)
         await query.edit_message_text(text=text, reply_markup=reply_markup)
 
-    elif data == 'btn_orders':
-        conn = get_db_connection()
-        # Fetch last 5 orders
-        orders = conn.execute('SELECT * FROM orders ORDER BY timestamp DESC LIMIT 5').fetchall()
-        conn.close()
+    elif data == 'btn_orders' or data.startswith('ord:'):
+        if data == 'btn_orders':
+            text, reply_markup = await order_browser.render_page()
+        else:
+            text, reply_markup = await order_browser.render_page(*order_browser.parse_callback(data))
+        try:
+            await query.edit_message_text(text=text, reply_markup=reply_markup)
+        except:
+            pass # Same page/filter tapped again
 
-        text = "📦 **Recent Orders**\n\n"
-        if not orders:
-            text += "No pending orders."
+    elif data.startswith('dig:'):
+        # Approve/reject a whole new-order digest
+        parsed = order_queue.parse_callback(data)
+        if parsed is None:
+            return
+        status, digest_id = parsed
+        changed = await order_queue.resolve(digest_id, status)
+        if changed is None:
+            note = "ℹ️ This batch was already handled."
         else:
-            for o in orders:
-                text += f"🆔 Order #{o['id']}\n👤 User: {o['user_id']}\n🛠 Svc ID: {o['service_id']}\nscStatus: {o['status']}\n\n"
-        
+            note = f"{order_queue.ACTION_LABELS[status]} {changed} order{'s' if changed != 1 else ''}."
+        try:
+            original = query.message.text if query.message else ""
+            await query.edit_message_text(text=f"{original}\n\n{note}".strip(),
+                                          reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(
+                                              "📋 Review pending", callback_data=order_browser.callback_data('p'))]]))
+        except:
+            pass # Same text, e.g. a double tap
+
+    elif data == 'btn_referrals':
+        top = await referrals.leaderboard(10)
+
+        text = "🏆 **Top Referrers**\n\n"
+        if not top:
+            text += "No referrals yet."
+        else:
+            for i, r in enumerate(top, 1):
+                name = f"@{r['username']}" if r['username'] else (r['first_name'] or r['referrer_id'])
+                text += f"{i}. {name} ({r['referrer_id']}) - {r['referrals']} referrals, {ledger.format_minor(r['bonus_minor'])} bonus\n"
+
         keyboard = [back_btn]
         reply_markup = InlineKeyboardMarkup(keyboard)
         await query.edit_message_text(text=text, reply_markup=reply_markup)
 
     elif data == 'btn_channels':
-        conn = get_db_connection()
-        channels = conn.execute('SELECT * FROM channels').fetchall()
-        conn.close()
+        channels = await db.list_channels()
 
         text = "📢 **Verification Channels**\n\n"
         if not channels:
@@ -132,6 +187,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text(text=text, reply_markup=reply_markup)
 
 # Keep command handlers for adding data as they require arguments
+@timed_handler
 async def add_service(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.effective_user.id): return
     args = context.args
@@ -140,14 +196,12 @@ async def add_service(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     try:
         name, price, description = args[0], float(args[1]), " ".join(args[2:])
-        conn = get_db_connection()
-        conn.execute('INSERT INTO services (name, price, description) VALUES (?, ?, ?)', (name, price, description))
-        conn.commit()
-        conn.close()
+        await db.insert_service(name, price, description)
         await update.message.reply_text(f"✅ Service '{name}' added!")
     except Exception as e:
         await update.message.reply_text("❌ Error adding service.")
 
+@timed_handler
 async def add_channel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.effective_user.id): return
     args = context.args
@@ -201,14 +255,13 @@ async def add_channel(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return
 
         # Save to DB
-        conn = get_db_connection()
         # Check if exists
-        curr = conn.execute('SELECT * FROM channels WHERE chat_id = ?', (str(chat_id),)).fetchone()
+        curr = await db.get_channel(chat_id)
         if curr:
             await update.message.reply_text("⚠️ Channel already exists in list.")
         else:
-            conn.execute('INSERT INTO channels (chat_id, invite_link) VALUES (?, ?)', (str(chat_id), invite_link))
-            conn.commit()
+            await db.insert_channel(chat_id, invite_link)
+            invalidate_channels()
             await update.message.reply_text(
                 f"✅ **Channel Added!**\n\n"
                 f"📌 Title: {chat.title if 'chat' in locals() else 'Unknown'}\n"
@@ -216,12 +269,12 @@ async def add_channel(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 f"🔗 Link: {invite_link}",
                 parse_mode='Markdown'
             )
-        conn.close()
 
     except Exception as e:
         traceback.print_exc()
         await update.message.reply_text("❌ Error processing request. Ensure Bot is Admin in that channel.")
 
+@timed_handler
 async def del_channel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.effective_user.id): return
     args = context.args
@@ -230,59 +283,144 @@ async def del_channel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     try:
         chat_id = args[0]
-        conn = get_db_connection()
-        conn.execute('DELETE FROM channels WHERE chat_id = ?', (chat_id,))
-        conn.commit()
-        conn.close()
+        await db.delete_channel(chat_id)
+        invalidate_channels()
         await update.message.reply_text(f"✅ Channel {chat_id} deleted!")
     except:
         await update.message.reply_text("❌ Error deleting channel.")
 
+BROADCAST_USAGE = (
+    "Usage:\n1. Reply to a message with /broadcast\n2. Or type /broadcast <message>\n\n"
+    "Optional filters before the message:\n"
+    "joined_from=YYYY-MM-DD joined_to=YYYY-MM-DD\n"
+    "balance=yes|no ref=yes|no|<user_id> ordered=yes|no\n"
+    "Check the size first with /audience <filters>"
+)
+
 # Fallback for list commands if user types them manually, redirect to text response
+@timed_handler
 async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.effective_user.id): return
 
+    # Leading key=value args pick the audience, e.g. /broadcast balance=no ordered=yes Hi!
+    try:
+        segment, args = segments.parse_args(context.args or [])
+    except segments.InvalidSegment as e:
+        await update.message.reply_text(f"❌ {e}\n\n{BROADCAST_USAGE}")
+        return
+
     # Check if message is a reply or has args
     msg = None
     if update.message.reply_to_message:
         msg = update.message.reply_to_message
     else:
-        args = context.args
         if not args:
-            await update.message.reply_text("Usage:\n1. Reply to a message with /broadcast\n2. Or type /broadcast <message>")
+            await update.message.reply_text(BROADCAST_USAGE)
             return
         msg = " ".join(args)
 
-    conn = get_db_connection()
-    users = conn.execute('SELECT user_id FROM users').fetchall()
-    conn.close()
+    admin_chat_id = update.effective_chat.id
+    if isinstance(msg, str):
+        job_id = await create_job(admin_chat_id, text=msg, segment=segment)
+    else:
+        job_id = await create_job(admin_chat_id, from_chat_id=msg.chat_id, message_id=msg.message_id, segment=segment)
 
-    total = len(users)
-    sent = 0
-    failed = 0
+    job = await load_job(job_id)
+    status_msg = await update.message.reply_text(
+        f"📢 Starting broadcast #{job_id} to {job['total']} users ({segments.describe(segment)})...")
+    await set_status_message(job_id, status_msg.message_id)
 
-    status_msg = await update.message.reply_text(f"📢 Starting broadcast to {total} users...")
+    # Run in the background so the dispatcher stays free while we send
+    start_job(context.application, job_id)
 
-    for user in users:
-        try:
-            if isinstance(msg, str):
-                await context.bot.send_message(chat_id=user['user_id'], text=msg)
-            else:
-                await msg.copy(chat_id=user['user_id'])
-            sent += 1
-        except Exception:
-            failed += 1
-        
-        # Avoid flood limits
-        if sent % 20 == 0:
-            await asyncio.sleep(1)
+@timed_handler
+async def audience(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id): return
+    try:
+        segment, rest = segments.parse_args(context.args or [])
+        if rest:
+            raise segments.InvalidSegment(f"Expected key=value, got '{rest[0]}'")
+    except segments.InvalidSegment as e:
+        await update.message.reply_text(f"❌ {e}\n\n{BROADCAST_USAGE}")
+        return
+    size = await audience_size(segment)
+    await update.message.reply_text(f"👥 {size} users match: {segments.describe(segment)}")
 
-    await status_msg.edit_text(f"✅ Broadcast Complete!\n\nSent: {sent}\nFailed: {failed}")
+@timed_handler
+async def list_channels(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id): return
+    channels = await db.list_channels()
 
+    text = "📢 Verification Channels\n\n"
+    if not channels:
+        text += "No channels configured.\n"
+    else:
+        for ch in channels:
+            text += f"ID: {ch['chat_id']}\nLink: {ch['invite_link']}\n\n"
+    await update.message.reply_text(text)
+
+@timed_handler
 async def list_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    # Reuse button logic or just simple text
-    await update.message.reply_text("Please use the dashboard buttons.")
+    if not is_admin(update.effective_user.id): return
+    # /orders [status] [service_id]
+    status_code, service_id = 'a', 0
+    for arg in context.args or []:
+        if arg.isdigit():
+            service_id = int(arg)
+        elif arg.lower() in order_browser.CODE_FOR_STATUS:
+            status_code = order_browser.CODE_FOR_STATUS[arg.lower()]
+        elif arg.lower() != 'all':
+            await update.message.reply_text("Usage: /orders [pending|approved|rejected|completed|all] [service_id]")
+            return
+    text, reply_markup = await order_browser.render_page(status_code, service_id)
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
+@timed_handler
+async def credit(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id): return
+    # /credit <user_id> <amount>, a negative amount takes credits back
+    args = context.args or []
+    try:
+        user_id, amount = int(args[0]), ledger.to_minor(args[1])
+    except (IndexError, ValueError):
+        await update.message.reply_text("Usage: /credit <user_id> <amount>")
+        return
+    if amount == 0:
+        await update.message.reply_text("Usage: /credit <user_id> <amount>")
+        return
+    try:
+        balance = await ledger.adjust(user_id, amount)
+    except ledger.InsufficientFunds:
+        await update.message.reply_text("❌ The user doesn't have that many credits.")
+        return
+    if balance is None:
+        await update.message.reply_text(f"❌ Unknown user {user_id}.")
+        return
+    await update.message.reply_text(f"✅ {ledger.format_minor(amount)} credits for {user_id}, "
+                                    f"balance now {ledger.format_minor(balance)}.")
 
+@timed_handler
+async def export_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id): return
+    try:
+        table, fmt, status = export.parse_args(context.args or [])
+    except export.InvalidExport as e:
+        await update.message.reply_text(f"❌ {e}")
+        return
+    await update.message.reply_text(f"⏳ Exporting {table}...")
+    path, count = await export.export(table, fmt, status)
+    try:
+        if os.path.getsize(path) > export.MAX_DOCUMENT_SIZE:
+            await update.message.reply_text(f"❌ {count} rows is too large to send, narrow it down with a status.")
+            return
+        name = f"{table}{'-' + status if status else ''}-{time.strftime('%Y%m%d')}.{fmt}.gz"
+        with open(path, 'rb') as f:
+            await context.bot.send_document(chat_id=update.effective_chat.id, document=f, filename=name,
+                                            caption=f"📤 {count} rows", write_timeout=120)
+    finally:
+        os.remove(path)
+
+@timed_handler
 async def get_channel_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.effective_user.id): return
     
@@ -299,15 +437,24 @@ async def get_channel_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 if __name__ == '__main__':
     if not ADMIN_BOT_TOKEN: exit(1)
-    application = ApplicationBuilder().token(ADMIN_BOT_TOKEN).build()
+    application = (ApplicationBuilder().token(ADMIN_BOT_TOKEN).post_init(post_init).post_shutdown(post_shutdown)
+                   .concurrent_updates(PerUserUpdateProcessor(UPDATE_CONCURRENCY))
+                   .request(InstrumentedRequest(connection_pool_size=256))
+                   .get_updates_request(InstrumentedRequest())
+                   .rate_limiter(outbound.scheduler).build())
     
     application.add_handler(CommandHandler('start', start))
     application.add_handler(CallbackQueryHandler(button_handler))
     
     application.add_handler(CommandHandler('add_service', add_service))
+    application.add_handler(CommandHandler('orders', list_orders))
+    application.add_handler(CommandHandler('credit', credit))
+    application.add_handler(CommandHandler('export', export_data))
     application.add_handler(CommandHandler('add_channel', add_channel))
     application.add_handler(CommandHandler('del_channel', del_channel))
+    application.add_handler(CommandHandler('channels', list_channels))
     application.add_handler(CommandHandler('broadcast', broadcast))
+    application.add_handler(CommandHandler('audience', audience))
     
     # Add handler for forwarded messages to get ID
     application.add_handler(MessageHandler(filters.FORWARDED & filters.ChatType.PRIVATE, get_channel_id))
@@ -1,32 +1,94 @@
-from flask import Flask, render_template, request, jsonify
-from database import get_db_connection
+from flask import Flask, render_template, request, jsonify, Response, g, abort, send_file
+import assets
+import catalog
+import ledger
+import orders
+import metrics
+import webapp_auth
+from webapp_auth import webapp_user_required
 import os
 
 app = Flask(__name__)
+metrics.init_flask(app)
+app.jinja_env.globals.update(asset_url=assets.url, critical_css=assets.critical_css)
+
+def render_index(services):
+    return render_template('index.html', services=services)
+
+def index_response(render=render_index):
+    # Rendered once per catalog version, see catalog.py. Shared with asgi.py,
+    # which makes it conditional against its own request the same way.
+    html, etag, last_modified = catalog.cache.page(render)
+    resp = Response(html, mimetype='text/html')
+    resp.set_etag(etag)
+    resp.last_modified = last_modified
+    resp.cache_control.no_cache = True
+    return resp
 
 @app.route('/')
 def index():
-    conn = get_db_connection()
-    services = conn.execute('SELECT * FROM services').fetchall()
-    conn.close()
-    return render_template('index.html', services=services)
+    return index_response().make_conditional(request)
+
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    # Fingerprinted files from `python assets.py`, precompressed variant by Accept-Encoding
+    found = assets.lookup(filename, request.headers.get('Accept-Encoding'))
+    if found is None:
+        abort(404)
+    path, mimetype, encoding = found
+    resp = send_file(path, mimetype=mimetype, etag=False, last_modified=None)
+    resp.headers['Cache-Control'] = assets.CACHE_CONTROL
+    resp.headers['Vary'] = 'Accept-Encoding'
+    if encoding:
+        resp.headers['Content-Encoding'] = encoding
+    return resp
+
+# /buy, shared with asgi.py: buy_params() validates the request, the caller
+# places the order (sync here, async there) and buy_result() maps the outcome
+# to the JSON payload and status.
+
+class InvalidPurchase(ValueError):
+    pass
+
+BUY_ERRORS = (
+    (webapp_auth.InvalidInitData, 401),
+    (InvalidPurchase, 400),
+    (orders.InvalidIdempotencyKey, 400),
+    (ledger.InsufficientFunds, 402),
+)
+
+def buy_params(req):
+    # -> (service_id, idempotency_key)
+    data = req.get_json(silent=True)
+    if not isinstance(data, dict) or not data.get('service_id'):
+        raise InvalidPurchase('Missing data')
+    # Validated against the cached catalog, no extra query
+    service = catalog.cache.get_service(data['service_id'])
+    if not service:
+        raise InvalidPurchase('Unknown service')
+    return service['id'], req.headers.get('Idempotency-Key') or data.get('idempotency_key')
+
+def buy_result(order_id=None, created=False, error=None):
+    # -> (payload, status)
+    if error is None:
+        return {'success': True, 'message': 'Order placed successfully!', 'order_id': order_id,
+                'duplicate': not created}, 200
+    for cls, status in BUY_ERRORS:
+        if isinstance(error, cls):
+            return {'success': False, 'message': str(error)}, status
+    app.logger.error("Error placing order", exc_info=error)
+    return {'success': False, 'message': 'Could not place order'}, 500
 
 @app.route('/buy', methods=['POST'])
+@webapp_user_required
 def buy():
-    data = request.json
-    service_id = data.get('service_id')
-    user_id = data.get('user_id') # In a real app, get this from Telegram Web App data validation
-    
-    if not service_id or not user_id:
-        return jsonify({'success': False, 'message': 'Missing data'}), 400
-
-    conn = get_db_connection()
-    conn.execute('INSERT INTO orders (user_id, service_id, status) VALUES (?, ?, ?)',
-                 (user_id, service_id, 'pending'))
-    conn.commit()
-    conn.close()
-
-    return jsonify({'success': True, 'message': 'Order placed successfully!'})
+    user_id = g.webapp_user['id']  # from the signed initData, never from the body
+    try:
+        service_id, idempotency_key = buy_params(request)
+        payload, status = buy_result(*orders.place_order(user_id, service_id, idempotency_key))
+    except Exception as e:
+        payload, status = buy_result(error=e)
+    return jsonify(payload), status
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
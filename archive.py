@@ -0,0 +1,165 @@
+import asyncio
+import glob
+import gzip
+import json
+import logging
+import os
+import time
+from config import ORDER_ARCHIVE_DAYS, ORDER_ARCHIVE_DIR, ORDER_ARCHIVE_BATCH, ORDER_ARCHIVE_INTERVAL
+import async_db as db
+import export
+import order_browser
+from periodic import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+# Cold storage for finished orders. Orders in a final status (approved or
+# rejected from a digest, completed) older than ORDER_ARCHIVE_DAYS are moved
+# out of `orders` in batches, oldest first along the timestamp index, into
+# gzipped NDJSON files partitioned by the month the order was placed:
+#
+#   archive/orders/2026-09/0000001234-0000002233.ndjson.gz
+#
+# A batch is read on a reader connection and written to disk (fsynced) as
+# .pending files before a short writer transaction deletes those ids, so bot
+# writes never wait on compression or disk I/O. The pending files are then
+# renamed into place keeping only the rows the delete removed. Pending files
+# left by a failed delete or a crash are reconciled against `orders` at the
+# start of the next run, so no order ends up in both or in neither. Only one
+# archiver (the admin bot) may run against a directory. The hot table keeps
+# only what the bots and /orders still need; SQLite reuses the freed pages
+# for new orders.
+
+COLUMNS = export.TABLES['orders'][1]
+STATUSES = ('approved', 'rejected', 'completed')  # pending orders are never archived
+PENDING = '.pending'
+
+
+def _select_batch(conn, cutoff, batch):
+    marks = ','.join('?' * len(STATUSES))
+    rows = conn.execute(f'SELECT {", ".join(COLUMNS)} FROM orders WHERE timestamp < ? AND status IN ({marks}) '
+                        'ORDER BY timestamp, id LIMIT ?', (cutoff, *STATUSES, batch)).fetchall()
+    return sorted((tuple(r) for r in rows), key=lambda r: r[0])
+
+
+def _delete_batch(conn, ids):
+    # -> ids deleted; the status check keeps an order that isn't final any more
+    marks = ','.join('?' * len(ids))
+    deleted = [r[0] for r in conn.execute(
+        f'DELETE FROM orders WHERE id IN ({marks}) AND status IN ({",".join("?" * len(STATUSES))}) RETURNING id',
+        (*ids, *STATUSES)).fetchall()]
+    if deleted:
+        conn.execute(f'DELETE FROM order_queue WHERE order_id IN ({",".join("?" * len(deleted))})', deleted)
+    return deleted
+
+
+def _existing(conn, ids):
+    marks = ','.join('?' * len(ids))
+    return {r[0] for r in conn.execute(f'SELECT id FROM orders WHERE id IN ({marks})', ids).fetchall()}
+
+
+def _file_name(rows):
+    return f"{rows[0][0]:010d}-{rows[-1][0]:010d}.ndjson.gz"
+
+
+def _write_file(path, rows):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    export.write_gzip(tmp, [rows], 'ndjson', COLUMNS)
+    with open(tmp, 'rb') as f:
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _read_file(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return [tuple(row[c] for c in COLUMNS) for row in map(json.loads, f)]
+
+
+def _stage(directory, rows):
+    # -> pending files, one per month the orders were placed in
+    months = {}
+    for r in rows:
+        months.setdefault(r[COLUMNS.index('timestamp')][:7], []).append(r)
+    paths = []
+    for month, part in months.items():
+        path = os.path.join(directory, 'orders', month, _file_name(part)) + PENDING
+        _write_file(path, part)
+        paths.append(path)
+    return paths
+
+
+def _finish(path, archived):
+    # Renames a pending file into place keeping only the rows in `archived`; -> rows kept
+    rows = _read_file(path)
+    kept = [r for r in rows if r[0] in archived]
+    if len(kept) == len(rows):
+        os.replace(path, path[:-len(PENDING)])
+    else:
+        if kept:
+            _write_file(os.path.join(os.path.dirname(path), _file_name(kept)), kept)
+        os.remove(path)
+    return len(kept)
+
+
+def _pending_files(directory):
+    return sorted(glob.glob(os.path.join(directory, 'orders', '*', '*' + PENDING)))
+
+
+class OrderArchiver(PeriodicTask):
+    label = 'Order archival'
+
+    def __init__(self, days=ORDER_ARCHIVE_DAYS, directory=ORDER_ARCHIVE_DIR, batch=ORDER_ARCHIVE_BATCH,
+                 interval=ORDER_ARCHIVE_INTERVAL):
+        super().__init__()
+        self.days = days
+        self.directory = directory
+        self.batch = batch
+        self.interval = interval
+
+    def start(self):
+        if self.days > 0:
+            super().start()
+
+    def retry_delay(self):
+        return self.interval
+
+    async def tick(self):
+        await self.run_once()
+        return self.interval
+
+    async def _recover(self):
+        # Pending files from a delete that failed or a run that died: the rows
+        # already gone from `orders` are archived, the rest stay in the table
+        loop = asyncio.get_running_loop()
+        for path in _pending_files(self.directory):
+            ids = [r[0] for r in await loop.run_in_executor(None, _read_file, path)]
+            remaining = await db.read(_existing, ids) if ids else set()
+            n = await loop.run_in_executor(None, _finish, path, set(ids) - remaining)
+            logger.warning(f"Recovered {path}: {n} archived, {len(ids) - n} still in orders")
+
+    async def run_once(self, now=None):
+        # -> orders moved
+        now = time.time() if now is None else now
+        cutoff = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(now - self.days * 86400))
+        loop = asyncio.get_running_loop()
+        await self._recover()
+        moved = 0
+        while True:
+            rows = await db.read(_select_batch, cutoff, self.batch)
+            if not rows:
+                break
+            paths = await loop.run_in_executor(None, _stage, self.directory, rows)
+            archived = set(await db.write(_delete_batch, [r[0] for r in rows]))
+            for path in paths:
+                await loop.run_in_executor(None, _finish, path, archived)
+            moved += len(archived)
+            if len(rows) < self.batch:
+                break
+        if moved:
+            order_browser.invalidate_counts()
+            logger.info(f"Archived {moved} finished orders to {self.directory}")
+        return moved
+
+
+archiver = OrderArchiver()
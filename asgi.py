@@ -0,0 +1,152 @@
+import asyncio
+import contextlib
+import io
+import time
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.wrappers import Request
+import app as web
+import catalog
+import metrics
+import orders
+import webapp_auth
+from config import WEB_KEEPALIVE
+
+# Async serving mode for the Mini App: `uvicorn asgi:app`, or hosted on the
+# bots' event loop by main.py (WEB_SERVER=bots). The two hot routes run
+# natively on the loop: the page comes from the catalog cache (its periodic
+# version check runs on a thread) and orders go through the async_db writer,
+# so idle or slow keep-alive connections cost a socket instead of a worker
+# thread. They build their responses with the same helpers as the Flask
+# views in app.py. Every other route (/static, /assets, /metrics, error
+# pages) is the Flask app itself behind asgiref's WSGI adapter.
+
+MAX_BODY = 64 * 1024
+
+_flask = WsgiToAsgi(web.app)
+
+
+def _render_index(services):
+    # url_for() in the template needs a request context
+    with web.app.test_request_context('/'):
+        return web.render_index(services)
+
+
+def _environ(scope, body=b''):
+    # Enough of a WSGI environ for werkzeug's request parsing and conditional responses
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+    }
+    for key, value in scope['headers']:
+        name = key.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        value = value.decode('latin-1')
+        environ[name] = f"{environ[name]},{value}" if name in environ else value
+    # The body is already read in full (also when it came chunked)
+    environ['CONTENT_LENGTH'] = str(len(body))
+    return environ
+
+
+async def _send_response(send, resp, environ):
+    # -> status; HEAD and 304 drop the body like under WSGI
+    app_iter, status, headers = resp.get_wsgi_response(environ)
+    await send({'type': 'http.response.start', 'status': int(status.split(' ', 1)[0]),
+                'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]})
+    await send({'type': 'http.response.body', 'body': b''.join(app_iter)})
+    return resp.status_code
+
+
+async def _read_body(receive):
+    # None when the client went away or sent more than MAX_BODY
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if len(body) > MAX_BODY:
+            return None
+        if not message.get('more_body'):
+            return body
+
+
+async def index(scope, receive, send):
+    await catalog.cache.refresh_async()
+    environ = _environ(scope)
+    return await _send_response(send, web.index_response(_render_index).make_conditional(environ), environ)
+
+
+async def buy(scope, receive, send):
+    environ = _environ(scope, await _read_body(receive) or b'')
+    req = Request(environ)
+    try:
+        user = webapp_auth.verifier.verify(req.headers.get(webapp_auth.HEADER))
+        await catalog.cache.refresh_async()
+        service_id, idempotency_key = web.buy_params(req)
+        payload, status = web.buy_result(*await orders.place_order_async(user['id'], service_id, idempotency_key))
+    except Exception as e:
+        payload, status = web.buy_result(error=e)
+    resp = web.app.json.response(payload)
+    resp.status_code = status
+    return await _send_response(send, resp, environ)
+
+
+ROUTES = {
+    ('GET', '/'): ('index', index),
+    ('HEAD', '/'): ('index', index),
+    ('POST', '/buy'): ('buy', buy),
+}
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while (await receive())['type'] != 'lifespan.shutdown':
+            await send({'type': 'lifespan.startup.complete'})
+        await send({'type': 'lifespan.shutdown.complete'})
+        return
+    if scope['type'] != 'http':
+        return
+
+    endpoint, handler = ROUTES.get((scope['method'], scope['path']), (None, None))
+    if handler is None:
+        # Flask records its own web_request_seconds
+        await _flask(scope, receive, send)
+        return
+    start = time.perf_counter()
+    status = await handler(scope, receive, send)
+    if metrics.enabled:
+        metrics.observe('web_request_seconds', (endpoint, str(status)), time.perf_counter() - start)
+
+
+# --- Hosting on an existing event loop (main.py) ---
+
+async def start_server(host, port):
+    import uvicorn
+
+    class EmbeddedServer(uvicorn.Server):
+        # The host process owns SIGINT/SIGTERM and stops us from its shutdown path
+        def install_signal_handlers(self):
+            pass
+
+        def capture_signals(self):
+            return contextlib.nullcontext()
+
+    server = EmbeddedServer(uvicorn.Config(app, host=host, port=port, lifespan='off', access_log=False,
+                                           timeout_keep_alive=WEB_KEEPALIVE, log_level='warning'))
+    task = asyncio.get_running_loop().create_task(server.serve())
+    while not server.started and not task.done():
+        await asyncio.sleep(0.05)
+    if task.done():
+        task.result()  # bind failed: raise it here
+        raise RuntimeError(f"Web server on {host}:{port} exited during startup")
+    return server, task
+
+
+async def stop_server(server, task):
+    server.should_exit = True
+    await task
@@ -0,0 +1,239 @@
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import shutil
+import urllib.request
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Static asset pipeline for the Mini App. `python assets.py` (run by start.sh)
+# copies every file under static/ to static/dist/ under a content-hashed name
+# (css/style.3f2a91c0d4.css), writes .gz and .br copies next to it and records
+# the mapping in static/dist/manifest.json. A fingerprinted file never
+# changes, so /assets/ serves it with a one-year immutable Cache-Control, in
+# the precompressed encoding the client accepts. The part of a stylesheet
+# above a `/* critical:end */` line is inlined into the page, the full sheet
+# loads without blocking first paint.
+#
+# --vendor first fetches telegram-web-app.js and the Google Fonts into
+# static/vendor/, so a cold open only talks to our origin. It needs the
+# network, so it runs once at build time (Dockerfile, render.yaml
+# buildCommand) and the image ships that copy; start.sh only runs the offline
+# build. Without a build the page falls back to plain /static/ and the remote
+# URLs.
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(ROOT, 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+VENDOR_DIR = os.path.join(STATIC_DIR, 'vendor')
+MANIFEST = os.path.join(DIST_DIR, 'manifest.json')
+
+URL_PREFIX = '/assets/'
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+CRITICAL_MARKER = '/* critical:end */'
+COMPRESSIBLE = ('.css', '.js', '.json', '.svg', '.txt', '.map', '.ico', '.ttf', '.otf')  # woff2/png/jpg already are
+MIN_COMPRESS_SIZE = 256
+
+TELEGRAM_JS_URL = 'https://telegram.org/js/telegram-web-app.js'
+FONTS_URL = ('https://fonts.googleapis.com/css2?family=Cinzel:wght@400;700'
+             '&family=Montserrat:wght@300;400;600&display=swap')
+# Google Fonts picks the font format by User-Agent; this one gets woff2
+FONTS_USER_AGENT = ('Mozilla/5.0 (Linux; Android 13) AppleWebKit/537.36 (KHTML, like Gecko) '
+                    'Chrome/120.0 Mobile Safari/537.36')
+
+_css_url_re = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+_css_comment_re = re.compile(r'/\*.*?\*/', re.S)
+_css_space_re = re.compile(r'\s+')
+_css_punct_re = re.compile(r'\s*([{};,])\s*')
+
+
+# --- Build ---
+
+def _fingerprint(rel, data):
+    base, ext = os.path.splitext(rel)
+    return f"{base}.{hashlib.sha256(data).hexdigest()[:10]}{ext}"
+
+
+def _is_local(url):
+    return not url.startswith(('data:', 'http:', 'https:', '//', '#', '/'))
+
+
+def _rewrite_css(rel, text, files, absolute=False):
+    # url(...) to other static files -> their fingerprinted names, relative to
+    # the stylesheet, or absolute for CSS that ends up inlined in the page
+    def sub(m):
+        quote, url = m.groups()
+        if not _is_local(url):
+            return m.group(0)
+        target = os.path.normpath(os.path.join(os.path.dirname(rel), url.split('#')[0].split('?')[0]))
+        entry = files.get(target.replace(os.sep, '/'))
+        if entry is None:
+            return m.group(0)
+        if absolute:
+            new = URL_PREFIX + entry['file']
+        else:
+            new = os.path.relpath(entry['file'], os.path.dirname(rel) or '.').replace(os.sep, '/')
+        return f"url({quote}{new}{quote})"
+    return _css_url_re.sub(sub, text)
+
+
+def _minify_css(text):
+    text = _css_comment_re.sub('', text)
+    text = _css_punct_re.sub(r'\1', _css_space_re.sub(' ', text))
+    # A space before ':' can be a descendant selector (`a :hover`), after it never matters
+    return text.replace(': ', ':').replace(';}', '}').strip()
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def _sources():
+    for dirpath, dirnames, filenames in os.walk(STATIC_DIR):
+        if os.path.abspath(dirpath) == STATIC_DIR and 'dist' in dirnames:
+            dirnames.remove('dist')
+        for name in filenames:
+            if not name.startswith('.'):
+                path = os.path.join(dirpath, name)
+                yield os.path.relpath(path, STATIC_DIR).replace(os.sep, '/'), path
+
+
+def build():
+    if os.path.isdir(DIST_DIR):
+        shutil.rmtree(DIST_DIR)
+    files = {}
+    # Stylesheets last, so the files they reference already have their names
+    for rel, path in sorted(_sources(), key=lambda s: (s[0].endswith('.css'), s[0])):
+        with open(path, 'rb') as f:
+            data = f.read()
+        entry = {}
+        if rel.endswith('.css'):
+            text = _rewrite_css(rel, data.decode('utf-8'), files)
+            if CRITICAL_MARKER in text:
+                critical = text.split(CRITICAL_MARKER, 1)[0]
+                entry['critical'] = _minify_css(_rewrite_css(rel, critical, files, absolute=True))
+            data = text.encode('utf-8')
+        name = _fingerprint(rel, data)
+        dest = os.path.join(DIST_DIR, name)
+        _write(dest, data)
+        entry.update({'file': name, 'size': len(data)})
+        if rel.endswith(COMPRESSIBLE) and len(data) >= MIN_COMPRESS_SIZE:
+            gz = gzip.compress(data, 9, mtime=0)
+            if len(gz) < len(data):
+                _write(dest + '.gz', gz)
+                entry['gzip'] = len(gz)
+            if brotli is not None:
+                br = brotli.compress(data, quality=11)
+                if len(br) < len(data):
+                    _write(dest + '.br', br)
+                    entry['br'] = len(br)
+        files[rel] = entry
+    _write(MANIFEST, json.dumps({'files': files}, indent=1, sort_keys=True).encode('utf-8'))
+    return files
+
+
+def _fetch(url, user_agent=None):
+    req = urllib.request.Request(url, headers={'User-Agent': user_agent or 'Mozilla/5.0'})
+    with urllib.request.urlopen(req, timeout=20) as resp:
+        return resp.read()
+
+
+def vendor():
+    # Best effort: on any failure the previous copy (or the remote URL) stays in use
+    try:
+        _write(os.path.join(VENDOR_DIR, 'telegram-web-app.js'), _fetch(TELEGRAM_JS_URL))
+    except OSError as e:
+        logger.warning(f"Could not vendor telegram-web-app.js: {e}")
+    try:
+        css = _fetch(FONTS_URL, FONTS_USER_AGENT).decode('utf-8')
+        fonts = {}
+        for url in set(m.group(2) for m in _css_url_re.finditer(css)):
+            if url.startswith('https://'):
+                fonts[url] = 'fonts/' + hashlib.sha256(url.encode()).hexdigest()[:16] + os.path.splitext(url)[1]
+                _write(os.path.join(VENDOR_DIR, fonts[url]), _fetch(url, FONTS_USER_AGENT))
+        css = _css_url_re.sub(lambda m: f"url({fonts.get(m.group(2), m.group(2))})", css)
+        _write(os.path.join(VENDOR_DIR, 'fonts.css'), css.encode('utf-8'))
+    except (OSError, UnicodeDecodeError) as e:
+        logger.warning(f"Could not vendor Google Fonts: {e}")
+
+
+# --- Runtime ---
+
+_manifest = None
+_by_file = None
+
+
+def manifest():
+    global _manifest, _by_file
+    if _manifest is None:
+        try:
+            with open(MANIFEST) as f:
+                _manifest = json.load(f)['files']
+        except (OSError, ValueError, KeyError):
+            _manifest = {}
+        _by_file = {entry['file']: entry for entry in _manifest.values()}
+    return _manifest
+
+
+def url(rel, fallback=None):
+    # Fingerprinted URL of static/<rel>, else `fallback`, else the plain /static/ URL
+    entry = manifest().get(rel)
+    if entry is not None:
+        return URL_PREFIX + entry['file']
+    return fallback or '/static/' + rel
+
+
+def critical_css(rel):
+    entry = manifest().get(rel)
+    return entry.get('critical', '') if entry else ''
+
+
+def _accepted(accept_encoding):
+    codings = set()
+    for part in (accept_encoding or '').lower().split(','):
+        coding, _, params = part.partition(';')
+        q = params.strip()
+        if q.startswith('q=') and q[2:].strip() in ('0', '0.0', '0.00', '0.000'):
+            continue
+        codings.add(coding.strip())
+    return codings
+
+
+def lookup(name, accept_encoding):
+    # /assets/<name> -> (file on disk, content type, Content-Encoding or None), or None
+    manifest()
+    entry = _by_file.get(name)
+    if entry is None:
+        return None
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    path = os.path.join(DIST_DIR, name)
+    accepted = _accepted(accept_encoding)
+    if entry.get('br') and 'br' in accepted:
+        return path + '.br', content_type, 'br'
+    if entry.get('gzip') and 'gzip' in accepted:
+        return path + '.gz', content_type, 'gzip'
+    return path, content_type, None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fingerprint and precompress static/ into static/dist/')
+    parser.add_argument('--vendor', action='store_true', help='fetch telegram-web-app.js and Google Fonts first')
+    args = parser.parse_args()
+    logging.basicConfig(format='%(levelname)s - %(message)s', level=logging.INFO)
+    if args.vendor:
+        vendor()
+    built = build()
+    total = sum(e['size'] for e in built.values())
+    logger.info(f"Built {len(built)} assets ({total} bytes, brotli {'on' if brotli else 'off'}) into {DIST_DIR}")
@@ -0,0 +1,248 @@
+import asyncio
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
+from sqlite3 import Row
+from config import DB_READ_THREADS, WRITER_BATCH_MAX
+from database import get_db_connection, is_connection_error
+import catalog
+import metrics
+
+# Async data access for the bots. Reads run on a small thread pool with
+# pooled connections, writes are serialized through one writer thread that
+# owns its own connection, so the event loop never blocks on SQLite. The web
+# app submits its writes to the same thread with write_sync().
+#
+# Query functions take the connection as their first argument; use
+# `await read(fn, ...)` / `await write(fn, ...)` for one-off queries or the
+# typed helpers at the bottom of this module.
+
+_readers = ThreadPoolExecutor(max_workers=DB_READ_THREADS, thread_name_prefix='db-read')
+
+
+def _run_read(fn, args):
+    conn = get_db_connection()
+    try:
+        return fn(conn, *args)
+    finally:
+        conn.close()
+
+
+class Writer(threading.Thread):
+    # Group commit: everything queued while the previous batch was committing
+    # goes into one transaction. Each item runs inside its own SAVEPOINT, so a
+    # failing item is rolled back and reported alone while the rest commit.
+    # A connection that breaks is replaced: a batch that found it dead before
+    # running anything is retried on the new one, any other batch fails alone
+    # (a lost COMMIT may or may not have been applied, so it is never replayed).
+    def __init__(self, batch_max=WRITER_BATCH_MAX):
+        super().__init__(name='db-writer', daemon=True)
+        self.queue = queue.Queue()
+        self.batch_max = batch_max
+        self.conn = None
+
+    def submit(self, fn, args) -> Future:
+        fut = Future()
+        self.queue.put((fn, args, fut))
+        return fut
+
+    def run(self):
+        try:
+            stop = False
+            while not stop:
+                item = self.queue.get()
+                if item is None:
+                    break
+                batch = [item]
+                while len(batch) < self.batch_max:
+                    try:
+                        item = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stop = True
+                        break
+                    batch.append(item)
+                self._commit_batch(batch)
+        finally:
+            if self.conn is not None:
+                self.conn.close()
+
+    def _discard(self):
+        conn, self.conn = self.conn, None
+        if conn is not None:
+            try:
+                conn.really_close()
+            except Exception:
+                pass
+
+    def _begin(self):
+        # -> connection inside the write transaction
+        for attempt in range(2):
+            try:
+                if self.conn is None:
+                    self.conn = get_db_connection()
+                if not self.conn.in_transaction:
+                    # Take the write lock up front: a deferred transaction that reads
+                    # first gets SQLITE_BUSY without a busy_timeout retry when another
+                    # process writes before it does (an advisory lock on PostgreSQL)
+                    self.conn.execute('BEGIN IMMEDIATE')
+                return self.conn
+            except Exception as e:
+                if attempt or not is_connection_error(e):
+                    raise
+                # Died while idle; nothing ran yet, so go again on a fresh one
+                self._discard()
+
+    def _commit_batch(self, batch):
+        done = []
+        try:
+            conn = self._begin()
+            for fn, args, fut in batch:
+                if not fut.set_running_or_notify_cancel():
+                    continue
+                conn.execute('SAVEPOINT write_item')
+                try:
+                    result = fn(conn, *args)
+                except Exception as e:
+                    conn.execute('ROLLBACK TO write_item')
+                    conn.execute('RELEASE write_item')
+                    fut.set_exception(e)
+                    continue
+                conn.execute('RELEASE write_item')
+                done.append((fut, result))
+            conn.commit()
+        except BaseException as e:
+            # Commit (or a rollback to a savepoint) failed, nothing in this batch was written
+            if is_connection_error(e):
+                self._discard()
+            elif self.conn is not None:
+                try:
+                    self.conn.rollback()
+                except Exception:
+                    self._discard()
+            for fut, _ in done:
+                fut.set_exception(e)
+            for _, _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for fut, result in done:
+            fut.set_result(result)
+
+    def stop(self):
+        self.queue.put(None)
+        self.join()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def _get_writer() -> Writer:
+    global _writer
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = Writer()
+            _writer.start()
+        return _writer
+
+
+async def read(fn: Callable[..., Any], *args) -> Any:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_readers, _run_read, fn, args)
+
+
+async def write(fn: Callable[..., Any], *args) -> Any:
+    return await asyncio.wrap_future(_get_writer().submit(fn, args))
+
+
+def write_sync(fn: Callable[..., Any], *args, timeout: Optional[float] = None) -> Any:
+    # For sync callers (Flask views): concurrent requests share one commit
+    return _get_writer().submit(fn, args).result(timeout)
+
+
+def writer_queue_depth() -> int:
+    return _writer.queue.qsize() if _writer is not None else 0
+
+
+metrics.register_gauge('db_writer_queue_depth', 'Writes waiting for the writer thread', (),
+                       lambda: {(): writer_queue_depth()})
+metrics.register_gauge('db_read_queue_depth', 'Reads waiting for a reader thread', (),
+                       lambda: {(): _readers._work_queue.qsize()})
+
+
+def shutdown():
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None and writer.is_alive():
+        writer.stop()
+
+
+# --- Users ---
+
+def _get_user(conn, user_id):
+    return conn.execute('SELECT * FROM users WHERE user_id = ?', (user_id,)).fetchone()
+
+
+async def get_user(user_id: int) -> Optional[Row]:
+    return await read(_get_user, user_id)
+
+
+# --- Services ---
+
+def _list_services(conn):
+    return conn.execute('SELECT * FROM services').fetchall()
+
+
+def _insert_service(conn, name, price, description):
+    service_id = conn.execute('INSERT INTO services (name, price, description) VALUES (?, ?, ?) RETURNING id',
+                              (name, price, description)).fetchone()[0]
+    # Same transaction, so web workers never see the new version without the row
+    catalog.bump_version(conn)
+    return service_id
+
+
+async def list_services() -> List[Row]:
+    return await read(_list_services)
+
+
+async def insert_service(name: str, price: float, description: str) -> int:
+    return await write(_insert_service, name, price, description)
+
+
+# --- Channels ---
+
+def _list_channels(conn):
+    return conn.execute('SELECT * FROM channels').fetchall()
+
+
+def _get_channel(conn, chat_id):
+    return conn.execute('SELECT * FROM channels WHERE chat_id = ?', (str(chat_id),)).fetchone()
+
+
+def _insert_channel(conn, chat_id, invite_link):
+    return conn.execute('INSERT INTO channels (chat_id, invite_link) VALUES (?, ?) RETURNING id',
+                        (str(chat_id), invite_link)).fetchone()[0]
+
+
+def _delete_channel(conn, chat_id):
+    return conn.execute('DELETE FROM channels WHERE chat_id = ?', (str(chat_id),)).rowcount
+
+
+async def list_channels() -> List[Row]:
+    return await read(_list_channels)
+
+
+async def get_channel(chat_id) -> Optional[Row]:
+    return await read(_get_channel, chat_id)
+
+
+async def insert_channel(chat_id, invite_link: str) -> int:
+    return await write(_insert_channel, chat_id, invite_link)
+
+
+async def delete_channel(chat_id) -> int:
+    return await write(_delete_channel, chat_id)
@@ -0,0 +1,480 @@
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# Benchmark suite for the data layer and the web endpoints.
+#
+#   python bench.py --users 100000 --orders 200000 --out run.json
+#   python bench.py --compare run.json          # fail on p95 regressions
+#
+# Seeds a synthetic SQLite database (a temp file unless --db is given), then
+# runs micro-benchmarks of the hot queries, drives / and /buy through the
+# Flask test client and, unless --no-gunicorn / --no-asgi, through a local
+# gunicorn and the ASGI app under uvicorn, also with stalled clients holding
+# connections open.
+# Results are latency percentiles (ms) and throughput, printed as JSON.
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BOT_TOKEN = '1000:bench'  # signs the benchmark's Mini App initData
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def summarize(latencies, wall, errors=0):
+    values = sorted(latencies)
+    n = len(values)
+    return {
+        'n': n,
+        'errors': errors,
+        'p50_ms': round(percentile(values, 50) * 1000, 4),
+        'p95_ms': round(percentile(values, 95) * 1000, 4),
+        'p99_ms': round(percentile(values, 99) * 1000, 4),
+        'mean_ms': round(sum(values) / n * 1000, 4) if n else 0.0,
+        'throughput_per_s': round(n / wall, 1) if wall else 0.0,
+    }
+
+
+def ok(status):
+    # HTTP status -> whether the request counts as a sample (None: no response at all)
+    return status is not None and 200 <= status < 400
+
+
+def run(fn, iterations, concurrency=1, warmup=0):
+    # Calls fn(i) `iterations` times across `concurrency` threads. A call that
+    # raises or returns False is an error: counted, and left out of the latency
+    # and throughput figures.
+    for i in range(warmup):
+        fn(i)
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    counter = iter(range(iterations))
+
+    def worker():
+        local = []
+        failed = 0
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            start = time.perf_counter()
+            try:
+                good = fn(i) is not False
+            except Exception:
+                good = False
+            if good:
+                local.append(time.perf_counter() - start)
+            else:
+                failed += 1
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return summarize(latencies, time.perf_counter() - start, errors[0])
+
+
+# --- Seeding ---
+
+def seed(conn, users, services, orders, channels, rng):
+    conn.execute('BEGIN')
+    conn.executemany('INSERT INTO services (name, price, description) VALUES (?, ?, ?)',
+                     [(f"Service{i}", round(rng.uniform(1, 100), 2), f"Synthetic service {i}")
+                      for i in range(services)])
+    conn.executemany('INSERT INTO channels (chat_id, invite_link) VALUES (?, ?)',
+                     [(str(-1000000000000 - i), f"https://t.me/bench{i}") for i in range(channels)])
+    batch = []
+    for uid in range(1, users + 1):
+        referrer = rng.randint(1, uid - 1) if uid > 1 and rng.random() < 0.3 else None
+        batch.append((uid, f"user{uid}", f"User {uid}", referrer))
+        if len(batch) >= 10000:
+            conn.executemany('INSERT INTO users (user_id, username, first_name, referred_by) VALUES (?, ?, ?, ?)', batch)
+            batch = []
+    if batch:
+        conn.executemany('INSERT INTO users (user_id, username, first_name, referred_by) VALUES (?, ?, ?, ?)', batch)
+    conn.execute('''
+        INSERT OR REPLACE INTO referral_stats (referrer_id, referrals)
+        SELECT referred_by, COUNT(*) FROM users WHERE referred_by IS NOT NULL GROUP BY referred_by
+    ''')
+    # Enough credits that /buy never runs out
+    conn.execute('UPDATE users SET balance_minor = 1000000000')
+    conn.execute("INSERT INTO ledger (user_id, amount_minor, kind, created_at) "
+                 "SELECT user_id, balance_minor, 'opening', ? FROM users", (int(time.time()),))
+    statuses = ['pending', 'approved', 'rejected', 'completed']
+    batch = []
+    for _ in range(orders):
+        batch.append((rng.randint(1, max(users, 1)), rng.randint(1, max(services, 1)), rng.choice(statuses)))
+        if len(batch) >= 10000:
+            conn.executemany('INSERT INTO orders (user_id, service_id, status) VALUES (?, ?, ?)', batch)
+            batch = []
+    if batch:
+        conn.executemany('INSERT INTO orders (user_id, service_id, status) VALUES (?, ?, ?)', batch)
+    conn.commit()
+    conn.execute('ANALYZE')
+
+
+# --- Micro-benchmarks ---
+
+def bench_queries(args, results):
+    import asyncio
+    import database
+    import async_db
+    import catalog
+    import order_browser
+    import orders
+    import referrals
+
+    rng = random.Random(args.seed)
+    n = args.iterations
+    users = max(args.users, 1)
+    services = max(args.services, 1)
+
+    def query(sql, params_fn):
+        def fn(i):
+            conn = database.get_db_connection()
+            try:
+                conn.execute(sql, params_fn(i)).fetchall()
+            finally:
+                conn.close()
+        return fn
+
+    results['db.get_db_connection'] = run(lambda i: database.get_db_connection().close(), n)
+    results['db.get_user'] = run(query('SELECT * FROM users WHERE user_id = ?', lambda i: (rng.randint(1, users),)), n)
+    results['db.list_services'] = run(query('SELECT * FROM services', lambda i: ()), n)
+    results['db.list_channels'] = run(query('SELECT * FROM channels', lambda i: ()), n)
+    results['db.recent_orders'] = run(query('SELECT * FROM orders ORDER BY timestamp DESC LIMIT 5', lambda i: ()), n)
+    results['db.referral_stats'] = run(lambda i: _with_conn(referrals._get_stats, rng.randint(1, users)), n)
+    results['db.leaderboard'] = run(lambda i: _with_conn(referrals._leaderboard, 10), n)
+
+    def deep_page(i):
+        conn = database.get_db_connection()
+        try:
+            cursor = max(args.orders - rng.randint(0, max(args.orders - 1, 0)), 1)
+            order_browser._fetch_page(conn, rng.choice([None, 'pending']), 0, 'n', cursor, 5)
+        finally:
+            conn.close()
+    results['db.order_page_keyset'] = run(deep_page, n)
+
+    results['catalog.refresh_forced'] = run(lambda i: catalog.cache.refresh(force=True), min(n, 200))
+    results['catalog.get_service_cached'] = run(lambda i: catalog.cache.get_service(rng.randint(1, services)), n)
+
+    results['orders.place_order'] = run(
+        lambda i: orders.place_order(rng.randint(1, users), rng.randint(1, services)), n)
+    results['orders.place_order_x16'] = run(
+        lambda i: orders.place_order(rng.randint(1, users), rng.randint(1, services)), n, concurrency=16)
+
+    async def async_reads():
+        async def one(i):
+            start = time.perf_counter()
+            await async_db.get_user(rng.randint(1, users))
+            return time.perf_counter() - start
+        start = time.perf_counter()
+        lat = await asyncio.gather(*(one(i) for i in range(n)))
+        return summarize(lat, time.perf_counter() - start)
+    results['async_db.get_user_gather'] = asyncio.run(async_reads())
+
+
+def bench_webapp_auth(args, results):
+    import webapp_auth
+
+    n = args.iterations
+    user = {'id': 1, 'first_name': 'Bench', 'username': 'bench'}
+    # Every call a new initData string: full parse + HMAC
+    fresh = [webapp_auth.sign(BOT_TOKEN, user, query_id=f"bench{i}") for i in range(n)]
+    results['webapp_auth.verify'] = run(lambda i: webapp_auth.verifier.verify(fresh[i % n]), n)
+    # Same string again: LRU hit
+    results['webapp_auth.verify_cached'] = run(lambda i: webapp_auth.verifier.verify(fresh[0]), n)
+    webapp_auth.verifier.clear()
+
+
+class _InitData:
+    # One signed initData per synthetic user, as each Mini App session has
+    def __init__(self, users):
+        self.users = max(users, 1)
+        self.signed = {}
+
+    def header(self, user_id):
+        value = self.signed.get(user_id)
+        if value is None:
+            import webapp_auth
+            value = self.signed[user_id] = webapp_auth.sign(BOT_TOKEN, {'id': user_id, 'first_name': 'Bench'})
+        return {'X-Telegram-Init-Data': value}
+
+
+def _with_conn(fn, *args):
+    import database
+    conn = database.get_db_connection()
+    try:
+        return fn(conn, *args)
+    finally:
+        conn.close()
+
+
+# --- Web via the Flask test client ---
+
+def bench_flask(args, results):
+    import app as web
+    import catalog
+
+    rng = random.Random(args.seed)
+    services = [s['id'] for s in catalog.cache.get_services()] or [1]
+    local = threading.local()
+
+    def client():
+        c = getattr(local, 'client', None)
+        if c is None:
+            c = local.client = web.app.test_client()
+        return c
+
+    etag = client().get('/').headers.get('ETag')
+    n = args.requests
+    results['flask.index'] = run(lambda i: ok(client().get('/').status_code), n, args.concurrency, warmup=50)
+    results['flask.index_304'] = run(lambda i: ok(client().get('/', headers={'If-None-Match': etag}).status_code),
+                                     n, args.concurrency)
+    init_data = _InitData(args.users)
+    results['flask.buy'] = run(lambda i: ok(client().post('/buy', json={'service_id': rng.choice(services)},
+                                                          headers=init_data.header(rng.randint(1, init_data.users)))
+                                            .status_code), n, args.concurrency)
+    results['flask.buy_replayed_key'] = run(lambda i: ok(client().post('/buy', json={'service_id': services[0]},
+                                                                       headers={'Idempotency-Key': 'bench-replay',
+                                                                                **init_data.header(1)}).status_code),
+                                            n, args.concurrency)
+
+
+# --- Web via local servers (gunicorn / uvicorn) ---
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _hold_slow_clients(port, count):
+    # Connections that sent half a request and stall, like a Mini App on a bad
+    # mobile link; a sync worker thread is stuck on each until it gives up
+    socks = []
+    for _ in range(count):
+        try:
+            s = socket.create_connection(('127.0.0.1', port), timeout=5)
+            s.sendall(b'GET / HTTP/1.1\r\nHost: bench\r\n')
+            socks.append(s)
+        except OSError:
+            break
+    time.sleep(0.5)
+    return socks
+
+
+def bench_server(name, cmd, args, results, env):
+    import catalog
+    port = _free_port()
+    proc = subprocess.Popen(cmd(port), cwd=ROOT, env=env)
+    try:
+        deadline = time.time() + 15
+        while time.time() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        else:
+            results[name] = {'error': f'{name} did not start'}
+            return
+
+        rng = random.Random(args.seed)
+        services = [s['id'] for s in catalog.cache.get_services()] or [1]
+        local = threading.local()
+
+        def request(method, path, body=None, headers=None, timeout=30):
+            # -> ok(status); no response at all is an error too
+            conn = getattr(local, 'conn', None)
+            if conn is None:
+                conn = local.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                resp = conn.getresponse()
+                resp.read()
+                return ok(resp.status)
+            except (http.client.HTTPException, OSError):
+                local.conn = None
+                conn.close()
+                return False
+
+        n = args.requests
+        results[f'{name}.index'] = run(lambda i: request('GET', '/'), n, args.concurrency, warmup=50)
+
+        init_data = _InitData(args.users)
+
+        def buy(i):
+            body = json.dumps({'service_id': rng.choice(services)})
+            return request('POST', '/buy', body, {'Content-Type': 'application/json',
+                                                  **init_data.header(rng.randint(1, init_data.users))})
+        results[f'{name}.buy'] = run(buy, n, args.concurrency)
+
+        if args.slow_clients:
+            socks = _hold_slow_clients(port, args.slow_clients)
+            try:
+                # Fresh connections with a short timeout: a request that can't get a worker counts as an error
+                local.__dict__.clear()
+                result = run(lambda i: request('GET', '/', timeout=2), min(n, 200), args.concurrency)
+                result['slow_clients'] = len(socks)
+                results[f'{name}.index_with_slow_clients'] = result
+            finally:
+                for s in socks:
+                    s.close()
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def gunicorn_cmd(args):
+    return lambda port: [sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f'127.0.0.1:{port}',
+                         '--workers', str(args.gunicorn_workers), '--threads', str(args.gunicorn_threads),
+                         '--log-level', 'warning']
+
+
+def uvicorn_cmd(args):
+    return lambda port: [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(port),
+                         '--no-access-log', '--log-level', 'warning']
+
+
+# --- Compare ---
+
+def compare(old, new, threshold):
+    regressions = []
+    for name, cur in sorted(new['results'].items()):
+        prev = old['results'].get(name)
+        # Failed requests are a regression of their own. Under slow clients the
+        # error count is what's being measured, so only an increase counts there.
+        allowed = (prev or {}).get('errors', 0) if 'slow_clients' in cur else 0
+        if cur.get('errors', 0) > allowed:
+            print(f"{name:36} {cur['errors']} errors REGRESSION", file=sys.stderr)
+            regressions.append(name)
+        if not prev or 'p95_ms' not in prev or 'p95_ms' not in cur or not prev['p95_ms']:
+            continue
+        change = (cur['p95_ms'] - prev['p95_ms']) / prev['p95_ms']
+        flag = ' REGRESSION' if change > threshold else ''
+        print(f"{name:36} p95 {prev['p95_ms']:10.3f} -> {cur['p95_ms']:10.3f} ms ({change:+.1%}){flag}",
+              file=sys.stderr)
+        if flag and name not in regressions:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the data layer and web endpoints')
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--services', type=int, default=20)
+    parser.add_argument('--orders', type=int, default=50000)
+    parser.add_argument('--channels', type=int, default=3)
+    parser.add_argument('--iterations', type=int, default=2000, help='per micro-benchmark')
+    parser.add_argument('--requests', type=int, default=2000, help='per web benchmark')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--gunicorn-workers', type=int, default=2)
+    parser.add_argument('--gunicorn-threads', type=int, default=8)
+    parser.add_argument('--no-gunicorn', action='store_true')
+    parser.add_argument('--no-asgi', action='store_true', help='skip the uvicorn (asgi.py) run')
+    parser.add_argument('--slow-clients', type=int, default=64,
+                        help='stalled connections held open while measuring / on each server (0 = skip)')
+    parser.add_argument('--db', help='database file to seed (default: temp file)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help='write JSON results here as well as stdout')
+    parser.add_argument('--compare', help='previous results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='p95 regression threshold (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    tmpdir = None
+    db_path = args.db
+    if not db_path:
+        tmpdir = tempfile.mkdtemp(prefix='bench-')
+        db_path = os.path.join(tmpdir, 'bench.db')
+
+    # Must be set before any project module reads config
+    os.environ['DATABASE_URL'] = f"sqlite:///{db_path}"
+    os.environ['USER_BOT_TOKEN'] = BOT_TOKEN
+    sys.path.insert(0, ROOT)
+    import database
+
+    database.init_db()
+    conn = database.get_db_connection()
+    try:
+        empty = conn.execute('SELECT COUNT(*) FROM users').fetchone()[0] == 0
+        if empty:
+            start = time.perf_counter()
+            seed(conn, args.users, args.services, args.orders, args.channels, random.Random(args.seed))
+            seed_seconds = round(time.perf_counter() - start, 2)
+        else:
+            seed_seconds = None
+    finally:
+        conn.close()
+
+    try:
+        rev = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                             text=True).stdout.strip()
+    except OSError:
+        rev = ''
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'git_rev': rev,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'scale': {'users': args.users, 'services': args.services, 'orders': args.orders,
+                      'channels': args.channels},
+            'seed_seconds': seed_seconds,
+        },
+        'results': {},
+    }
+
+    bench_queries(args, report['results'])
+    bench_webapp_auth(args, report['results'])
+    bench_flask(args, report['results'])
+    if not args.no_gunicorn:
+        bench_server('gunicorn', gunicorn_cmd(args), args, report['results'], dict(os.environ))
+    if not args.no_asgi:
+        bench_server('uvicorn', uvicorn_cmd(args), args, report['results'], dict(os.environ))
+
+    import async_db
+    async_db.shutdown()
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(output + '\n')
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+import asyncio
+import logging
+import time
+from telegram.error import Forbidden, RetryAfter, BadRequest
+from config import BROADCAST_WORKERS, BROADCAST_RATE, BROADCAST_CHUNK, BROADCAST_PROGRESS_INTERVAL
+import async_db as db
+import metrics
+import outbound
+import segments
+
+logger = logging.getLogger(__name__)
+
+# Broadcast jobs live in the `broadcast_jobs` table. Recipients (everyone, or
+# the job's segment, see segments.py) are walked in user_id order and the
+# cursor (last_user_id) is checkpointed after every chunk, so a restarted
+# process picks up at the first chunk that was not finished.
+# Sends go through the outbound scheduler's bulk lane (see outbound.py), which
+# pauses every lane on a flood wait but leaves the retry to _send_one, so each
+# flood wait is counted once and slows the job's bucket below.
+
+# Keep references to running job tasks so they are not garbage collected
+_running = {}
+
+metrics.register_gauge('broadcast_jobs_running', 'Broadcast jobs running in this process', (),
+                       lambda: {(): len(_running)})
+
+
+class TokenBucket:
+    # Adaptive token bucket: starts at `rate` msgs/sec, halves on flood control
+    # and creeps back up while sends keep succeeding.
+    def __init__(self, rate, min_rate=1.0):
+        self.max_rate = float(rate)
+        self.min_rate = min_rate
+        self.rate = float(rate)
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def on_success(self):
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + 0.05)
+
+    def on_flood(self, retry_after):
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = 0
+        self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+
+def classify_error(e):
+    if isinstance(e, RetryAfter):
+        return 'flood'
+    text = str(e).lower()
+    if isinstance(e, Forbidden):
+        if 'deactivated' in text:
+            return 'deactivated'
+        return 'blocked'
+    if isinstance(e, BadRequest) and 'chat not found' in text:
+        return 'deactivated'
+    return 'failed'
+
+
+def _create_job(conn, admin_chat_id, text, from_chat_id, message_id, segment):
+    total = segments.count(conn, segment)
+    return conn.execute(
+        'INSERT INTO broadcast_jobs (admin_chat_id, text, from_chat_id, message_id, total, segment) '
+        'VALUES (?, ?, ?, ?, ?, ?) RETURNING id',
+        (admin_chat_id, text, from_chat_id, message_id, total, segments.dumps(segment))).fetchone()[0]
+
+
+def _load_job(conn, job_id):
+    job = conn.execute('SELECT * FROM broadcast_jobs WHERE id = ?', (job_id,)).fetchone()
+    return dict(job) if job else None
+
+
+def _set_status_message(conn, job_id, message_id):
+    conn.execute('UPDATE broadcast_jobs SET status_message_id = ? WHERE id = ?', (message_id, job_id))
+
+
+def _next_chunk(conn, segment, after_user_id, size):
+    return segments.next_chunk(conn, segment, after_user_id, size)
+
+
+def _checkpoint(conn, job):
+    conn.execute(
+        'UPDATE broadcast_jobs SET last_user_id = ?, sent = ?, failed = ?, blocked = ?, '
+        'deactivated = ?, flood = ?, status = ?, finished_at = ? WHERE id = ?',
+        (job['last_user_id'], job['sent'], job['failed'], job['blocked'], job['deactivated'],
+         job['flood'], job['status'], job.get('finished_at'), job['id']))
+
+
+def _running_job_ids(conn):
+    return [r['id'] for r in conn.execute("SELECT id FROM broadcast_jobs WHERE status = 'running'").fetchall()]
+
+
+async def create_job(admin_chat_id, text=None, from_chat_id=None, message_id=None, segment=None):
+    return await db.write(_create_job, admin_chat_id, text, from_chat_id, message_id, segment)
+
+
+async def audience_size(segment=None):
+    return await db.read(segments.count, segment)
+
+
+async def load_job(job_id):
+    return await db.read(_load_job, job_id)
+
+
+async def set_status_message(job_id, message_id):
+    await db.write(_set_status_message, job_id, message_id)
+
+
+def _progress_text(job, done=False):
+    processed = job['sent'] + job['failed'] + job['blocked'] + job['deactivated']
+    head = "✅ Broadcast Complete!" if done else f"📢 Broadcasting... {processed}/{job['total']}"
+    return (
+        f"{head}\n"
+        f"Audience: {segments.describe(segments.loads(job.get('segment')))}\n\n"
+        f"Sent: {job['sent']}\n"
+        f"Blocked: {job['blocked']}\n"
+        f"Deactivated: {job['deactivated']}\n"
+        f"Failed: {job['failed']}\n"
+        f"Flood waits: {job['flood']}"
+    )
+
+
+async def _send_one(bot, job, user_id, bucket, max_attempts=3):
+    for attempt in range(max_attempts):
+        await bucket.acquire()
+        try:
+            if job['text'] is not None:
+                await bot.send_message(chat_id=user_id, text=job['text'], **outbound.bulk_kwargs(bot))
+            else:
+                await bot.copy_message(chat_id=user_id, from_chat_id=job['from_chat_id'],
+                                       message_id=job['message_id'], **outbound.bulk_kwargs(bot))
+            bucket.on_success()
+            return 'sent'
+        except RetryAfter as e:
+            job['flood'] += 1
+            bucket.on_flood(e.retry_after)
+        except Exception as e:
+            return classify_error(e)
+    return 'failed'
+
+
+async def _update_progress(bot, job, done=False):
+    if not job.get('status_message_id'):
+        return
+    try:
+        await bot.edit_message_text(chat_id=job['admin_chat_id'], message_id=job['status_message_id'],
+                                    text=_progress_text(job, done))
+    except Exception:
+        pass  # Message unchanged or deleted
+
+
+async def run_job(bot, job_id, workers=BROADCAST_WORKERS, rate=BROADCAST_RATE, chunk_size=BROADCAST_CHUNK):
+    job = await load_job(job_id)
+    if not job or job['status'] != 'running':
+        return
+
+    bucket = TokenBucket(rate)
+    segment = segments.loads(job.get('segment'))
+    last_progress = 0.0
+
+    while True:
+        chunk = await db.read(_next_chunk, segment, job['last_user_id'], chunk_size)
+        if not chunk:
+            break
+
+        queue = asyncio.Queue()
+        for uid in chunk:
+            queue.put_nowait(uid)
+
+        async def worker():
+            while True:
+                try:
+                    uid = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                outcome = await _send_one(bot, job, uid, bucket)
+                job[outcome] += 1
+
+        await asyncio.gather(*(worker() for _ in range(min(workers, len(chunk)))))
+
+        job['last_user_id'] = chunk[-1]
+        await db.write(_checkpoint, dict(job))
+
+        now = time.monotonic()
+        if now - last_progress >= BROADCAST_PROGRESS_INTERVAL:
+            last_progress = now
+            await _update_progress(bot, job)
+
+    job['status'] = 'done'
+    job['finished_at'] = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+    await db.write(_checkpoint, dict(job))
+    await _update_progress(bot, job, done=True)
+    logger.info(f"Broadcast #{job_id} finished: {job['sent']} sent, {job['blocked']} blocked")
+
+
+def start_job(application, job_id):
+    task = application.create_task(run_job(application.bot, job_id))
+    _running[job_id] = task
+    task.add_done_callback(lambda t: _running.pop(job_id, None))
+    return task
+
+
+async def resume_jobs(application):
+    # Called on startup: restart every job that was interrupted mid-run
+    job_ids = await db.read(_running_job_ids)
+    for job_id in job_ids:
+        if job_id not in _running:
+            logger.info(f"Resuming broadcast #{job_id}")
+            start_job(application, job_id)
+    return job_ids
@@ -0,0 +1,93 @@
+import asyncio
+import hashlib
+import threading
+import time
+from datetime import datetime, timezone
+from config import CATALOG_CHECK_INTERVAL
+from database import get_db_connection
+
+# Service catalog cache for the web app. The catalog only changes when an admin
+# adds a service, which bumps `catalog_version` in app_meta. Each process
+# re-reads that counter at most once per CATALOG_CHECK_INTERVAL and rebuilds
+# the service list (and drops the rendered page) only when it moved, so every
+# gunicorn worker picks up changes without a query per request.
+
+
+def bump_version(conn):
+    conn.execute(
+        "INSERT INTO app_meta (key, value, updated_at) VALUES ('catalog_version', 1, ?) "
+        "ON CONFLICT(key) DO UPDATE SET value = app_meta.value + 1, updated_at = excluded.updated_at",
+        (int(time.time()),))
+
+
+def read_version(conn):
+    row = conn.execute("SELECT value, updated_at FROM app_meta WHERE key = 'catalog_version'").fetchone()
+    return (row['value'], row['updated_at']) if row else (0, 0)
+
+
+class CatalogCache:
+    def __init__(self, check_interval):
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.version = None
+        self.updated_at = 0
+        self.services = []
+        self.by_id = {}
+        self.rendered = None  # (html, etag), swapped as one object so readers never see a mix
+        self.checked = 0.0
+
+    def _fresh(self):
+        return self.version is not None and time.monotonic() - self.checked < self.check_interval
+
+    def refresh(self, force=False):
+        if not force and self._fresh():
+            return
+        with self.lock:
+            if not force and self._fresh():
+                return
+            conn = get_db_connection()
+            try:
+                # Version first: a bump racing with the SELECT only causes one extra reload
+                version, updated_at = read_version(conn)
+                if force or version != self.version:
+                    services = [dict(s) for s in conn.execute('SELECT * FROM services ORDER BY id').fetchall()]
+                    self.services = services
+                    self.by_id = {s['id']: s for s in services}
+                    self.rendered = None
+                    self.version = version
+                    self.updated_at = updated_at or int(time.time())
+            finally:
+                conn.close()
+            self.checked = time.monotonic()
+
+    async def refresh_async(self):
+        # For the event loop (asgi.py): the DB read, when one is due, runs on a thread
+        if not self._fresh():
+            await asyncio.get_running_loop().run_in_executor(None, self.refresh)
+
+    def get_services(self):
+        self.refresh()
+        return self.services
+
+    def get_service(self, service_id):
+        self.refresh()
+        try:
+            return self.by_id.get(int(service_id))
+        except (TypeError, ValueError):
+            return None
+
+    def page(self, render):
+        # Returns (html, etag, last_modified); `render` is called once per catalog version
+        self.refresh()
+        rendered = self.rendered
+        if rendered is None:
+            with self.lock:
+                rendered = self.rendered
+                if rendered is None:
+                    html = render(self.services)
+                    rendered = self.rendered = (html, hashlib.sha256(html.encode('utf-8')).hexdigest()[:32])
+        html, etag = rendered
+        return html, etag, datetime.fromtimestamp(self.updated_at, tz=timezone.utc)
+
+
+cache = CatalogCache(CATALOG_CHECK_INTERVAL)
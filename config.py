@@ -12,4 +12,94 @@ ADMIN_ID = os.getenv("ADMIN_ID")
 WEB_APP_URL = os.getenv("WEB_APP_URL", "https://chagpt-free.onrender.com")
 
 # Database
-DATABASE_URL = "sqlite:///service_bot.db"
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///service_bot.db")
+
+# Broadcast
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "16"))
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))  # messages per second
+BROADCAST_CHUNK = int(os.getenv("BROADCAST_CHUNK", "500"))  # users per checkpoint
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))  # seconds
+
+# Channel membership cache
+MEMBERSHIP_CACHE_SIZE = int(os.getenv("MEMBERSHIP_CACHE_SIZE", "50000"))  # (user, channel) entries
+MEMBERSHIP_POSITIVE_TTL = float(os.getenv("MEMBERSHIP_POSITIVE_TTL", "600"))  # seconds
+MEMBERSHIP_NEGATIVE_TTL = float(os.getenv("MEMBERSHIP_NEGATIVE_TTL", "30"))  # seconds
+CHANNELS_CACHE_TTL = float(os.getenv("CHANNELS_CACHE_TTL", "300"))  # seconds
+# Background re-check of the membership index (join/leave events keep it current)
+MEMBERSHIP_RECONCILE_AGE = float(os.getenv("MEMBERSHIP_RECONCILE_AGE", "86400"))  # re-check entries older than this
+MEMBERSHIP_RECONCILE_RATE = float(os.getenv("MEMBERSHIP_RECONCILE_RATE", "1"))  # getChatMember calls/sec
+MEMBERSHIP_RECONCILE_START_DELAY = float(os.getenv("MEMBERSHIP_RECONCILE_START_DELAY", "60"))  # max random delay
+
+# SQLite connection pool
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))  # idle connections kept per process
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+# Async DB access for the bots
+DB_READ_THREADS = int(os.getenv("DB_READ_THREADS", "4"))
+WRITER_BATCH_MAX = int(os.getenv("WRITER_BATCH_MAX", "256"))  # writes per group commit
+
+# Write-behind user registration
+REGISTRATION_BATCH_SIZE = int(os.getenv("REGISTRATION_BATCH_SIZE", "200"))
+REGISTRATION_FLUSH_INTERVAL = float(os.getenv("REGISTRATION_FLUSH_INTERVAL", "1.0"))  # seconds
+REGISTRATION_SEEN_SIZE = int(os.getenv("REGISTRATION_SEEN_SIZE", "100000"))
+
+# Web app catalog cache
+CATALOG_CHECK_INTERVAL = float(os.getenv("CATALOG_CHECK_INTERVAL", "2"))  # seconds between version checks
+
+# Web serving: "wsgi" (gunicorn + Flask, default), "asgi" (uvicorn asgi:app in its own
+# process) or "bots" (asgi.py hosted on main.py's event loop, one process for everything)
+WEB_SERVER = os.getenv("WEB_SERVER", "wsgi")
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.getenv("PORT", "5000"))
+WEB_KEEPALIVE = int(os.getenv("WEB_KEEPALIVE", "30"))  # seconds an idle keep-alive connection stays open (ASGI)
+
+# Mini App authentication (Telegram initData)
+WEBAPP_AUTH_MAX_AGE = int(os.getenv("WEBAPP_AUTH_MAX_AGE", "86400"))  # seconds after auth_date
+WEBAPP_AUTH_CACHE_SIZE = int(os.getenv("WEBAPP_AUTH_CACHE_SIZE", "10000"))  # verified initData strings kept
+
+# Admin order browser
+ORDERS_PAGE_SIZE = int(os.getenv("ORDERS_PAGE_SIZE", "5"))
+ORDER_COUNTS_TTL = float(os.getenv("ORDER_COUNTS_TTL", "30"))  # seconds
+
+# New-order digests for the admin (see order_queue.py)
+ORDER_DIGEST_WINDOW = float(os.getenv("ORDER_DIGEST_WINDOW", "30"))  # seconds the oldest queued order may wait
+ORDER_DIGEST_MAX = int(os.getenv("ORDER_DIGEST_MAX", "25"))  # orders per digest, a full batch goes out at once
+ORDER_DIGEST_POLL = float(os.getenv("ORDER_DIGEST_POLL", "2"))  # seconds between queue checks
+
+# Referrals
+REFERRAL_BONUS = float(os.getenv("REFERRAL_BONUS", "0"))  # credits per referred user, 0 = count only
+
+# Credits ledger (see ledger.py)
+LEDGER_SNAPSHOT_INTERVAL = float(os.getenv("LEDGER_SNAPSHOT_INTERVAL", "300"))  # seconds between snapshot runs
+LEDGER_SNAPSHOT_BATCH = int(os.getenv("LEDGER_SNAPSHOT_BATCH", "1000"))  # ledger entries folded per transaction
+LEDGER_KEEP_DAYS = int(os.getenv("LEDGER_KEEP_DAYS", "0"))  # snapshotted entries older than this are deleted, 0 = keep all
+
+# /export and order archival (see export.py, archive.py)
+EXPORT_CHUNK = int(os.getenv("EXPORT_CHUNK", "5000"))  # rows per read
+ORDER_ARCHIVE_DAYS = int(os.getenv("ORDER_ARCHIVE_DAYS", "0"))  # approved/rejected/completed orders older than this are archived, 0 = off
+ORDER_ARCHIVE_DIR = os.getenv("ORDER_ARCHIVE_DIR", "archive")
+ORDER_ARCHIVE_BATCH = int(os.getenv("ORDER_ARCHIVE_BATCH", "1000"))  # orders moved per transaction
+ORDER_ARCHIVE_INTERVAL = float(os.getenv("ORDER_ARCHIVE_INTERVAL", "3600"))  # seconds between runs
+
+# Update delivery: "polling" (default) or "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # public base URL that forwards to WEBHOOK_HOST:WEBHOOK_PORT
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # optional extra salt for webhook paths/secret tokens
+
+# Concurrent update handling (updates from the same user still run in order)
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "32"))
+
+# Metrics (Prometheus text on /metrics); recording is skipped entirely when off
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0").lower() in ("1", "true", "yes")
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))  # bot process listener
+
+# Outbound scheduler shared by both bots (interactive replies go ahead of broadcasts)
+OUTBOUND_RATE = float(os.getenv("OUTBOUND_RATE", "30"))  # messages/sec across both bots
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", "1"))  # messages/sec per chat
+OUTBOUND_CHAT_BURST = int(os.getenv("OUTBOUND_CHAT_BURST", "3"))
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))  # RetryAfter retries of interactive calls; broadcasts retry their own
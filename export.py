@@ -0,0 +1,110 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+from config import EXPORT_CHUNK
+from database import get_db_connection
+
+# Admin data exports (/export). Rows are read in keyset chunks of
+# EXPORT_CHUNK and written straight into a gzip file, so memory stays the
+# same for ten users or ten million; the file is then sent as a document.
+# Runs on its own thread, off the reader pool the bots use.
+
+TABLES = {
+    'users': ('user_id', ('user_id', 'username', 'first_name', 'referred_by', 'joined_at', 'balance_minor')),
+    'orders': ('id', ('id', 'user_id', 'service_id', 'status', 'timestamp', 'paid_minor')),
+}
+FORMATS = ('csv', 'ndjson')
+MAX_DOCUMENT_SIZE = 50 * 1024 * 1024  # Bot API upload limit
+
+
+class InvalidExport(ValueError):
+    pass
+
+
+def parse_args(args):
+    # /export <users|orders> [csv|ndjson] [status]  ->  (table, fmt, status)
+    args = [a.lower() for a in args]
+    if not args or args[0] not in TABLES:
+        raise InvalidExport("Usage: /export <users|orders> [csv|ndjson] [status]")
+    table, fmt, status = args[0], 'csv', None
+    for arg in args[1:]:
+        if arg in FORMATS:
+            fmt = arg
+        elif table == 'orders' and status is None:
+            status = arg
+        else:
+            raise InvalidExport(f"Unexpected '{arg}'")
+    return table, fmt, status
+
+
+def chunks(conn, table, status=None, size=EXPORT_CHUNK):
+    key, columns = TABLES[table]
+    where, params = f'{key} > ?', []
+    if status:
+        where += ' AND status = ?'
+        params.append(status)
+    last = 0
+    while True:
+        rows = conn.execute(f'SELECT {", ".join(columns)} FROM {table} WHERE {where} ORDER BY {key} LIMIT ?',
+                            [last, *params, size]).fetchall()
+        if not rows:
+            return
+        yield rows
+        if len(rows) < size:
+            return
+        last = rows[-1][0]
+
+
+class RowWriter:
+    # CSV (with a header) or NDJSON lines into a text stream
+    def __init__(self, stream, fmt, columns):
+        self.stream = stream
+        self.fmt = fmt
+        self.columns = columns
+        if fmt == 'csv':
+            self.csv = csv.writer(stream)
+            self.csv.writerow(columns)
+
+    def write(self, rows):
+        if self.fmt == 'csv':
+            self.csv.writerows(tuple(r) for r in rows)
+        else:
+            for r in rows:
+                self.stream.write(json.dumps(dict(zip(self.columns, r)), ensure_ascii=False) + '\n')
+
+
+def write_gzip(path, rows_iter, fmt, columns):
+    # -> rows written
+    count = 0
+    with gzip.open(path, 'wb') as raw:
+        stream = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+        writer = RowWriter(stream, fmt, columns)
+        for rows in rows_iter:
+            writer.write(rows)
+            count += len(rows)
+        stream.flush()
+        stream.detach()
+    return count
+
+
+def _export(table, fmt, status):
+    fd, path = tempfile.mkstemp(prefix=f'{table}-', suffix=f'.{fmt}.gz')
+    os.close(fd)
+    conn = get_db_connection()
+    try:
+        count = write_gzip(path, chunks(conn, table, status), fmt, TABLES[table][1])
+    except BaseException:
+        os.remove(path)
+        raise
+    finally:
+        conn.close()
+    return path, count
+
+
+async def export(table, fmt='csv', status=None):
+    # -> (path of a temporary .gz file, rows); the caller removes the file
+    return await asyncio.get_running_loop().run_in_executor(None, _export, table, fmt, status)
@@ -0,0 +1,267 @@
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter
+from urllib.parse import parse_qsl
+
+# Local stand-in for the Telegram Bot API, for load tests without Telegram.
+# Point a bot at it with ApplicationBuilder().base_url(server.base_url).
+#
+# Implements the methods the bots call (getMe, getUpdates, sendMessage,
+# editMessageText, getChatMember, copyMessage, getChat, answerCallbackQuery,
+# deleteMessage, webhook calls) with configurable latency, injected errors
+# (429 with retry_after, 403 blocked) and scripted update streams fed with
+# push_update(). Every call is counted per token/method/outcome in `stats`.
+
+
+class FakeTelegramServer:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, flood_rate=0.0, retry_after=1,
+                 blocked_rate=0.0, blocked_ids=None, member_rate=1.0, seed=1):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.blocked_rate = blocked_rate
+        self.blocked_ids = set(blocked_ids or ())
+        self.member_rate = member_rate
+        self.rng = random.Random(seed)
+        self.server = None
+        self.updates = {}  # token -> list of pending updates
+        self.update_events = {}
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.stats = Counter()  # (token, method, outcome) -> calls
+        self.sent_to = Counter()  # (token, chat_id) -> messages delivered
+        self.tasks = set()
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/bot"
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            for task in list(self.tasks):
+                task.cancel()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+            await self.server.wait_closed()
+            self.server = None
+
+    # --- Scripted updates ---
+
+    def _event(self, token):
+        if token not in self.update_events:
+            self.update_events[token] = asyncio.Event()
+        return self.update_events[token]
+
+    def push_update(self, token, update):
+        update = dict(update, update_id=next(self.update_ids))
+        self.updates.setdefault(token, []).append(update)
+        self._event(token).set()
+        return update['update_id']
+
+    def count(self, method, token=None, outcome='ok'):
+        return sum(n for (t, m, o), n in self.stats.items()
+                   if m == method and o == outcome and (token is None or t == token))
+
+    # --- Object builders ---
+
+    @staticmethod
+    def user(user_id, first_name=None, username=None, is_bot=False):
+        u = {'id': user_id, 'is_bot': is_bot, 'first_name': first_name or f"User{user_id}"}
+        if username:
+            u['username'] = username
+        return u
+
+    def message(self, chat_id, text=None, from_user=None, chat_type='private'):
+        msg = {'message_id': next(self.message_ids), 'date': int(time.time()),
+               'chat': {'id': int(chat_id), 'type': chat_type}}
+        if from_user:
+            msg['from'] = from_user
+        if text is not None:
+            msg['text'] = text
+            if text.startswith('/'):
+                command = text.split()[0]
+                msg['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+        return msg
+
+    def command_update(self, user_id, text, **user_kwargs):
+        from_user = self.user(user_id, **user_kwargs)
+        return {'message': self.message(user_id, text, from_user)}
+
+    def callback_update(self, user_id, data, bot_id=1):
+        from_user = self.user(user_id)
+        return {'callback_query': {
+            'id': str(next(self.message_ids)),
+            'from': from_user,
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': self.message(user_id, 'menu', self.user(bot_id, 'Bot', is_bot=True)),
+        }}
+
+    def chat_member_update(self, chat_id, user_id, old_status, new_status):
+        # What Telegram sends a channel admin bot when a user joins or leaves
+        member = self.user(user_id)
+        return {'chat_member': {
+            'chat': {'id': int(chat_id), 'type': 'channel', 'title': f"Channel {chat_id}"},
+            'from': member,
+            'date': int(time.time()),
+            'old_chat_member': {'status': old_status, 'user': member},
+            'new_chat_member': {'status': new_status, 'user': member},
+        }}
+
+    # --- API methods ---
+
+    def _bot_id(self, token):
+        return int(token.split(':', 1)[0]) if token.split(':', 1)[0].isdigit() else 1
+
+    def _maybe_fail(self, method, params):
+        chat_id = params.get('chat_id')
+        if method in ('sendMessage', 'copyMessage', 'editMessageText'):
+            if self.flood_rate and self.rng.random() < self.flood_rate:
+                return 429, {'ok': False, 'error_code': 429,
+                             'description': f"Too Many Requests: retry after {self.retry_after}",
+                             'parameters': {'retry_after': self.retry_after}}
+            blocked = chat_id is not None and str(chat_id).lstrip('-').isdigit() and int(chat_id) in self.blocked_ids
+            if blocked or (self.blocked_rate and self.rng.random() < self.blocked_rate):
+                return 403, {'ok': False, 'error_code': 403, 'description': 'Forbidden: bot was blocked by the user'}
+        return None
+
+    async def _get_updates(self, token, params):
+        offset = int(params.get('offset') or 0)
+        timeout = float(params.get('timeout') or 0)
+        limit = int(params.get('limit') or 100)
+        pending = self.updates.setdefault(token, [])
+        # Confirmed updates are dropped, as Telegram does
+        pending[:] = [u for u in pending if u['update_id'] >= offset]
+        if not pending and timeout:
+            event = self._event(token)
+            event.clear()
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return pending[:limit]
+
+    async def call(self, token, method, params):
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + self.rng.random() * self.jitter)
+
+        failure = self._maybe_fail(method, params)
+        if failure:
+            status, body = failure
+            self.stats[(token, method, 'flood' if status == 429 else 'blocked')] += 1
+            return status, body
+
+        chat_id = params.get('chat_id')
+        bot = self.user(self._bot_id(token), 'FakeBot', username=f"fake{self._bot_id(token)}_bot", is_bot=True)
+
+        if method == 'getMe':
+            result = dict(bot, can_join_groups=True, can_read_all_group_messages=False,
+                          supports_inline_queries=False)
+        elif method == 'getUpdates':
+            result = await self._get_updates(token, params)
+        elif method in ('sendMessage', 'copyMessage'):
+            self.sent_to[(token, int(chat_id))] += 1
+            msg = self.message(chat_id, params.get('text', ''), bot)
+            result = msg if method == 'sendMessage' else {'message_id': msg['message_id']}
+        elif method == 'editMessageText':
+            result = self.message(chat_id or 0, params.get('text', ''), bot) if chat_id else True
+        elif method == 'getChatMember':
+            status = 'member' if self.rng.random() < self.member_rate else 'left'
+            result = {'status': status, 'user': self.user(int(params.get('user_id', 0)))}
+            if status == 'member':
+                result['until_date'] = None
+        elif method == 'getChat':
+            cid = params.get('chat_id')
+            result = {'id': int(cid) if str(cid).lstrip('-').isdigit() else -1001000000000,
+                      'type': 'channel', 'title': f"Channel {cid}"}
+        elif method in ('answerCallbackQuery', 'deleteMessage', 'setWebhook', 'deleteWebhook',
+                        'setMyCommands', 'close', 'logOut'):
+            result = True
+        else:
+            self.stats[(token, method, 'unknown')] += 1
+            return 404, {'ok': False, 'error_code': 404, 'description': 'Not Found: method not found'}
+
+        self.stats[(token, method, 'ok')] += 1
+        return 200, {'ok': True, 'result': result}
+
+    # --- HTTP ---
+
+    @staticmethod
+    def _parse_params(headers, body):
+        if not body:
+            return {}
+        ctype = headers.get('content-type', '')
+        if 'application/json' in ctype:
+            return json.loads(body)
+        params = dict(parse_qsl(body.decode('utf-8'), keep_blank_values=True))
+        return params
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self.tasks.add(task)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, path, version = line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b'\r\n', b'\n', b''):
+                        break
+                    k, _, v = h.decode('latin-1').partition(':')
+                    headers[k.strip().lower()] = v.strip()
+                length = int(headers.get('content-length') or 0)
+                body = await reader.readexactly(length) if length else b''
+
+                # /bot<token>/<method>
+                parts = path.split('?', 1)[0].strip('/').split('/')
+                if len(parts) == 2 and parts[0].startswith('bot'):
+                    status, payload = await self.call(parts[0][3:], parts[1], self._parse_params(headers, body))
+                else:
+                    status, payload = 404, {'ok': False, 'error_code': 404, 'description': 'Not Found'}
+
+                data = json.dumps(payload).encode('utf-8')
+                writer.write(f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                             f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                             f"Connection: keep-alive\r\n\r\n".encode('latin-1') + data)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError, asyncio.CancelledError):
+            pass
+        finally:
+            self.tasks.discard(task)
+            writer.close()
+
+
+async def _serve(args):
+    server = FakeTelegramServer(args.host, args.port, latency=args.latency, flood_rate=args.flood_rate,
+                                blocked_rate=args.blocked_rate, member_rate=args.member_rate)
+    await server.start()
+    print(f"Fake Bot API on {server.base_url}<token>/<method>")
+    await asyncio.Event().wait()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Local fake Telegram Bot API server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--flood-rate', type=float, default=0.0)
+    parser.add_argument('--blocked-rate', type=float, default=0.0)
+    parser.add_argument('--member-rate', type=float, default=1.0)
+    try:
+        asyncio.run(_serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,175 @@
+import logging
+import time
+from config import LEDGER_SNAPSHOT_INTERVAL, LEDGER_SNAPSHOT_BATCH, LEDGER_KEEP_DAYS
+import async_db as db
+import metrics
+from periodic import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+# Credits, in integer minor units (cents). Every change is a row in the
+# append-only `ledger` and, in the same transaction, a change to the cached
+# users.balance_minor, so the profile reads the balance with a primary key
+# lookup. A debit is one conditional UPDATE (balance_minor >= amount): two
+# purchases racing for the same credits can't both succeed, and the balance
+# never goes below zero.
+#
+# The snapshotter folds new entries into ledger_snapshots per user and checks
+# that the snapshot plus the entries after it match the cached balance. With
+# LEDGER_KEEP_DAYS set, entries already covered by a snapshot and older than
+# that are deleted, so the table stays bounded however long the history gets.
+#
+# Kinds: opening (migrated balance), referral, order, refund, admin.
+
+MINOR_UNITS = 100
+
+metrics.declare('ledger_drift_total', 'Users whose cached balance disagreed with the ledger', ())
+
+
+class InsufficientFunds(ValueError):
+    pass
+
+
+def to_minor(amount):
+    return int(round(float(amount) * MINOR_UNITS))
+
+
+def format_minor(amount_minor):
+    sign = '-' if amount_minor < 0 else ''
+    units, cents = divmod(abs(int(amount_minor)), MINOR_UNITS)
+    return f"{sign}{units}.{cents:02d}"
+
+
+def _append(conn, user_id, amount_minor, kind, ref):
+    conn.execute('INSERT INTO ledger (user_id, amount_minor, kind, ref, created_at) VALUES (?, ?, ?, ?, ?)',
+                 (user_id, amount_minor, kind, ref, int(time.time())))
+
+
+def credit(conn, user_id, amount_minor, kind, ref=None):
+    # -> new balance, or None for an unknown user
+    row = conn.execute('UPDATE users SET balance_minor = balance_minor + ? WHERE user_id = ? RETURNING balance_minor',
+                       (amount_minor, user_id)).fetchone()
+    if row is None:
+        return None
+    _append(conn, user_id, amount_minor, kind, ref)
+    return row[0]
+
+
+def debit(conn, user_id, amount_minor, kind, ref=None):
+    # -> new balance; raises InsufficientFunds without writing anything
+    row = conn.execute('UPDATE users SET balance_minor = balance_minor - ? '
+                       'WHERE user_id = ? AND balance_minor >= ? RETURNING balance_minor',
+                       (amount_minor, user_id, amount_minor)).fetchone()
+    if row is None:
+        raise InsufficientFunds("Not enough credits")
+    _append(conn, user_id, -amount_minor, kind, ref)
+    return row[0]
+
+
+def _adjust(conn, user_id, amount_minor):
+    if amount_minor < 0:
+        return debit(conn, user_id, -amount_minor, 'admin')
+    return credit(conn, user_id, amount_minor, 'admin')
+
+
+async def adjust(user_id, amount_minor):
+    # Admin top-up (or correction when negative); -> new balance or None
+    return await db.write(_adjust, user_id, amount_minor)
+
+
+# --- Snapshots ---
+
+def _cursor(conn):
+    row = conn.execute("SELECT value FROM app_meta WHERE key = 'ledger_snapshot_id'").fetchone()
+    return row[0] if row else 0
+
+
+def _snapshot(conn, batch):
+    # Folds the next `batch` ledger entries; -> (entries, users, drifted)
+    cursor = _cursor(conn)
+    rows = conn.execute('SELECT id, user_id FROM ledger WHERE id > ? ORDER BY id LIMIT ?', (cursor, batch)).fetchall()
+    if not rows:
+        return 0, 0, 0
+    user_ids = sorted({r['user_id'] for r in rows})
+    marks = ','.join('?' * len(user_ids))
+    # Touching the rows first locks them (PostgreSQL), so no debit or credit
+    # lands between reading the balance and reading the entries behind it
+    balances = dict(conn.execute(f'UPDATE users SET balance_minor = balance_minor WHERE user_id IN ({marks}) '
+                                 'RETURNING user_id, balance_minor', user_ids).fetchall())
+    snapshots = {r['user_id']: (r['balance_minor'], r['last_entry_id']) for r in conn.execute(
+        f'SELECT user_id, balance_minor, last_entry_id FROM ledger_snapshots WHERE user_id IN ({marks})',
+        user_ids).fetchall()}
+    tails = {r['user_id']: (r['amount'], r['last_id']) for r in conn.execute(
+        'SELECT l.user_id, SUM(l.amount_minor) AS amount, MAX(l.id) AS last_id FROM ledger l '
+        'LEFT JOIN ledger_snapshots s ON s.user_id = l.user_id '
+        f'WHERE l.user_id IN ({marks}) AND l.id > COALESCE(s.last_entry_id, 0) GROUP BY l.user_id',
+        user_ids).fetchall()}
+    now = int(time.time())
+    drifted = 0
+    for user_id, (amount, last_id) in tails.items():
+        balance, _ = snapshots.get(user_id, (0, 0))
+        balance += amount
+        if balances.get(user_id) != balance:
+            # Keep the ledger's figure; the cached one is left for the admin to look at
+            drifted += 1
+            logger.error(f"Ledger drift for user {user_id}: cached {balances.get(user_id)}, ledger {balance}")
+        conn.execute('INSERT INTO ledger_snapshots (user_id, balance_minor, last_entry_id, taken_at) '
+                     'VALUES (?, ?, ?, ?) ON CONFLICT(user_id) DO UPDATE SET balance_minor = excluded.balance_minor, '
+                     'last_entry_id = excluded.last_entry_id, taken_at = excluded.taken_at',
+                     (user_id, balance, last_id, now))
+    conn.execute("INSERT INTO app_meta (key, value, updated_at) VALUES ('ledger_snapshot_id', ?, ?) "
+                 "ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at",
+                 (rows[-1]['id'], now))
+    return len(rows), len(tails), drifted
+
+
+def _compact(conn, before, batch):
+    # Deletes up to `batch` entries created before `before` that a snapshot already covers
+    row = conn.execute('SELECT id FROM ledger WHERE created_at >= ? ORDER BY id LIMIT 1', (before,)).fetchone()
+    if row is None:
+        row = conn.execute('SELECT MAX(id) + 1 FROM ledger').fetchone()
+    below = row[0] or 0
+    return conn.execute(
+        'DELETE FROM ledger WHERE id IN (SELECT l.id FROM ledger l JOIN ledger_snapshots s ON s.user_id = l.user_id '
+        'WHERE l.id < ? AND l.id <= s.last_entry_id ORDER BY l.id LIMIT ?)', (below, batch)).rowcount
+
+
+class LedgerSnapshotter(PeriodicTask):
+    label = 'Ledger snapshot'
+
+    def __init__(self, interval=LEDGER_SNAPSHOT_INTERVAL, batch=LEDGER_SNAPSHOT_BATCH, keep_days=LEDGER_KEEP_DAYS):
+        super().__init__()
+        self.interval = interval
+        self.batch = batch
+        self.keep_days = keep_days
+
+    def retry_delay(self):
+        return self.interval
+
+    async def tick(self):
+        await self.run_once()
+        return self.interval
+
+    async def run_once(self, now=None):
+        # Works through everything new in batches; -> (entries folded, entries deleted)
+        folded = deleted = 0
+        while True:
+            entries, users, drifted = await db.write(_snapshot, self.batch)
+            folded += entries
+            if drifted:
+                metrics.inc('ledger_drift_total', (), drifted)
+            if entries < self.batch:
+                break
+        if self.keep_days > 0:
+            before = int((time.time() if now is None else now) - self.keep_days * 86400)
+            while True:
+                n = await db.write(_compact, before, self.batch)
+                deleted += n
+                if n < self.batch:
+                    break
+        if folded or deleted:
+            logger.info(f"Ledger snapshot: {folded} entries folded, {deleted} deleted")
+        return folded, deleted
+
+
+snapshotter = LedgerSnapshotter()
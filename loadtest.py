@@ -0,0 +1,231 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Offline load test for both bots against fake_telegram.py.
+#
+#   python loadtest.py --users 5000 --latency 0.02
+#   python loadtest.py --users 2000 --flood-rate 0.01 --blocked-rate 0.05 --broadcast-rate 500
+#   python loadtest.py --users 1000 --outbound-rate 30    # real Telegram limits
+#
+# Builds the same applications as main.py, points them at a local fake Bot
+# API, replays synthetic users (/start, some with referral links, then menu
+# taps) through the user bot and a /broadcast through the admin bot (with a
+# second round of taps while it runs), and prints handler throughput and
+# per-handler latency as JSON.
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+USER_TOKEN = '1001:loadtest-user'
+ADMIN_TOKEN = '1002:loadtest-admin'
+ADMIN_USER_ID = 1
+TAPS = ('show_profile', 'referral_info', 'back_to_menu', 'add_balance')
+
+
+def _calls(server, token, method):
+    # Handled = the API call the handler ends with, whatever the fake answered
+    return sum(n for (t, m, _), n in server.stats.items() if t == token and m == method)
+
+
+async def _wait_for(predicate, timeout):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(0.01)
+    return True
+
+
+async def _phase(server, token, updates, method, expected, timeout):
+    before = _calls(server, token, method)
+    start = time.perf_counter()
+    for update in updates:
+        server.push_update(token, update)
+    completed = await _wait_for(lambda: _calls(server, token, method) - before >= expected, timeout)
+    wall = time.perf_counter() - start
+    handled = _calls(server, token, method) - before
+    return {
+        'updates': len(updates),
+        'handled': handled,
+        'completed': completed,
+        'wall_s': round(wall, 3),
+        'updates_per_s': round(handled / wall, 1) if wall else 0.0,
+    }
+
+
+def _handler_latency():
+    import metrics
+    report = {}
+    for (handler, callback), (count, total) in sorted(metrics.histogram_totals('bot_handler_seconds').items()):
+        key = f"{handler}[{callback}]" if callback else handler
+        report[key] = {'n': count, 'mean_ms': round(total / count * 1000, 3) if count else 0.0}
+    return report
+
+
+def _lane_waits():
+    import metrics
+    return {lane: {'n': count, 'mean_wait_ms': round(total / count * 1000, 3) if count else 0.0}
+            for (lane,), (count, total) in sorted(metrics.histogram_totals('outbound_wait_seconds').items())}
+
+
+async def run(args):
+    from fake_telegram import FakeTelegramServer
+    import async_db
+    import broadcast
+    import database
+    import main as bots
+    import metrics
+    import registration
+
+    metrics.enabled = True
+    database.init_db()
+    conn = database.get_db_connection()
+    try:
+        conn.executemany('INSERT INTO channels (chat_id, invite_link) VALUES (?, ?) ON CONFLICT DO NOTHING',
+                         [(str(-1001000000000 - i), f"https://t.me/loadtest{i}") for i in range(args.channels)])
+        conn.commit()
+    finally:
+        conn.close()
+
+    rng = random.Random(args.seed)
+    server = FakeTelegramServer(latency=args.latency, jitter=args.jitter, flood_rate=args.flood_rate,
+                                retry_after=args.retry_after, blocked_rate=args.blocked_rate,
+                                member_rate=args.member_rate, seed=args.seed)
+    await server.start()
+
+    user_app = bots.build_user_app(USER_TOKEN, server.base_url)
+    admin_app = bots.build_admin_app(ADMIN_TOKEN, server.base_url)
+    user_ids = list(range(100000, 100000 + args.users))
+    report = {'config': vars(args), 'phases': {}}
+
+    try:
+        async with user_app, admin_app:
+            await user_app.start()
+            await admin_app.start()
+            await user_app.updater.start_polling(timeout=1)
+            await admin_app.updater.start_polling(timeout=1)
+
+            # 1. /start for every user, ~30% arriving through a referral link
+            starts = []
+            for i, uid in enumerate(user_ids):
+                text = '/start'
+                if i and rng.random() < 0.3:
+                    text += f" {user_ids[rng.randrange(i)]}"
+                starts.append(server.command_update(uid, text))
+            report['phases']['start'] = await _phase(server, USER_TOKEN, starts, 'sendMessage',
+                                                     len(starts), args.timeout)
+
+            # 2. Menu taps, interleaved across users like real traffic
+            taps = [server.callback_update(uid, rng.choice(TAPS), bot_id=1001)
+                    for _ in range(args.taps) for uid in user_ids]
+            report['phases']['taps'] = await _phase(server, USER_TOKEN, taps, 'editMessageText',
+                                                    len(taps), args.timeout)
+
+            # 3. Broadcast to everyone who registered
+            if not args.no_broadcast:
+                await registration.buffer.flush()
+                admin_phase = await _phase(server, ADMIN_TOKEN,
+                                           [server.command_update(ADMIN_USER_ID, f"/broadcast {args.segment} Load test message".replace('  ', ' '))],
+                                           'sendMessage', 1, args.timeout)
+                start = time.perf_counter()
+
+                # Interactive traffic while the broadcast holds the bulk lane
+                taps = [server.callback_update(uid, rng.choice(TAPS), bot_id=1001) for uid in user_ids]
+                report['phases']['taps_during_broadcast'] = await _phase(server, USER_TOKEN, taps, 'editMessageText',
+                                                                         len(taps), args.timeout)
+                job = None
+
+                def finished():
+                    return job is not None and job['status'] != 'running'
+
+                deadline = time.monotonic() + args.timeout
+                while not finished() and time.monotonic() < deadline:
+                    await asyncio.sleep(0.1)
+                    job_ids = await async_db.read(
+                        lambda c: [r[0] for r in c.execute('SELECT id FROM broadcast_jobs ORDER BY id DESC LIMIT 1')])
+                    if job_ids:
+                        job = await broadcast.load_job(job_ids[0])
+                wall = time.perf_counter() - start
+                report['phases']['broadcast'] = {
+                    'command': admin_phase,
+                    'completed': finished(),
+                    'recipients': job['total'] if job else 0,
+                    'sent': job['sent'] if job else 0,
+                    'blocked': job['blocked'] if job else 0,
+                    'failed': job['failed'] if job else 0,
+                    'flood_events': job['flood'] if job else 0,
+                    'wall_s': round(wall, 3),
+                    'messages_per_s': round((job['sent'] + job['blocked'] + job['failed']) / wall, 1) if job and wall else 0.0,
+                }
+
+            await user_app.updater.stop()
+            await admin_app.updater.stop()
+            await admin_app.stop()
+            await user_app.stop()
+    finally:
+        await registration.buffer.close()
+        await server.stop()
+        async_db.shutdown()
+        database.close_pool()
+
+    report['handlers'] = _handler_latency()
+    report['outbound_lanes'] = _lane_waits()
+    report['api_calls'] = {f"{'user' if t == USER_TOKEN else 'admin'}.{m}.{o}": n
+                           for (t, m, o), n in sorted(server.stats.items()) if m != 'getUpdates'}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay synthetic users through both bots against a fake Bot API')
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--taps', type=int, default=2, help='menu taps per user')
+    parser.add_argument('--channels', type=int, default=2, help='required channels (membership checks per /start)')
+    parser.add_argument('--latency', type=float, default=0.01, help='seconds added to every API call')
+    parser.add_argument('--jitter', type=float, default=0.01, help='random extra latency, up to this many seconds')
+    parser.add_argument('--flood-rate', type=float, default=0.0, help='fraction of sends answered with 429')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--blocked-rate', type=float, default=0.0, help='fraction of sends answered with 403')
+    parser.add_argument('--member-rate', type=float, default=1.0, help='fraction of getChatMember answers that are members')
+    parser.add_argument('--concurrency', type=int, help='UPDATE_CONCURRENCY for both bots')
+    parser.add_argument('--broadcast-rate', type=int, default=1000, help='BROADCAST_RATE for the run (msgs/sec)')
+    parser.add_argument('--outbound-rate', type=float, default=1000, help='OUTBOUND_RATE for the run (msgs/sec, both bots)')
+    parser.add_argument('--segment', default='', help="broadcast filters, e.g. 'ref=yes ordered=no'")
+    parser.add_argument('--no-broadcast', action='store_true')
+    parser.add_argument('--timeout', type=float, default=300, help='per phase, seconds')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help='write JSON results here as well as stdout')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    # Must be set before any project module reads config
+    tmpdir = tempfile.mkdtemp(prefix='loadtest-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmpdir, 'loadtest.db')}"
+    os.environ['USER_BOT_TOKEN'] = USER_TOKEN
+    os.environ['ADMIN_BOT_TOKEN'] = ADMIN_TOKEN
+    os.environ['ADMIN_ID'] = str(ADMIN_USER_ID)
+    os.environ['BROADCAST_RATE'] = str(args.broadcast_rate)
+    os.environ['OUTBOUND_RATE'] = str(args.outbound_rate)
+    os.environ['BROADCAST_PROGRESS_INTERVAL'] = '3600'
+    if args.concurrency:
+        os.environ['UPDATE_CONCURRENCY'] = str(args.concurrency)
+    sys.path.insert(0, ROOT)
+    # Configured first, so the bot modules' own basicConfig calls are no-ops
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                        level=logging.INFO if args.verbose else logging.WARNING)
+
+    report = asyncio.run(run(args))
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
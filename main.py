@@ -1,10 +1,23 @@
 import asyncio
 import logging
-from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler
-from config import USER_BOT_TOKEN, ADMIN_BOT_TOKEN, WEB_APP_URL, ADMIN_ID
-from user_bot import start as user_start, btn_handler as user_btn_handler, post_init as user_post_init
-from admin_bot import start as admin_start, add_service, list_orders, add_channel, del_channel, list_channels, button_handler, broadcast
-from database import init_db
+from telegram import Update
+from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler, ChatMemberHandler
+from config import USER_BOT_TOKEN, ADMIN_BOT_TOKEN, WEB_APP_URL, ADMIN_ID, BOT_MODE, WEBHOOK_URL, WEBHOOK_HOST, WEBHOOK_PORT, UPDATE_CONCURRENCY, METRICS_HOST, METRICS_PORT, WEB_SERVER, WEB_HOST, WEB_PORT
+from user_bot import start as user_start, btn_handler as user_btn_handler, post_init as user_post_init, chat_member_update
+from admin_bot import start as admin_start, add_service, list_orders, credit, export_data, add_channel, del_channel, list_channels, button_handler, broadcast, audience
+from broadcast import resume_jobs
+from webhook import WebhookServer, set_webhook
+from update_processor import PerUserUpdateProcessor
+import metrics
+from metrics import InstrumentedRequest
+import outbound
+from database import init_db, close_pool
+import async_db
+import registration
+import membership
+import order_queue
+import ledger
+import archive
 import traceback
 
 # Configure logging
@@ -14,52 +27,123 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def _builder(token, base_url=None):
+    builder = (ApplicationBuilder().token(token)
+               .concurrent_updates(PerUserUpdateProcessor(UPDATE_CONCURRENCY))
+               .request(InstrumentedRequest(connection_pool_size=256))
+               .get_updates_request(InstrumentedRequest())
+               .rate_limiter(outbound.scheduler))
+    if base_url:
+        # e.g. the local fake Bot API used by loadtest.py
+        builder = builder.base_url(base_url)
+    return builder
+
+def build_user_app(token, base_url=None):
+    app = _builder(token, base_url).post_init(user_post_init).build()
+    app.add_handler(CommandHandler('start', user_start))
+    app.add_handler(CallbackQueryHandler(user_btn_handler))
+    app.add_handler(ChatMemberHandler(chat_member_update, ChatMemberHandler.CHAT_MEMBER))
+    return app
+
+def build_admin_app(token, base_url=None):
+    app = _builder(token, base_url).build()
+    app.add_handler(CommandHandler('start', admin_start))
+    app.add_handler(CommandHandler('add_service', add_service))
+    app.add_handler(CommandHandler('orders', list_orders))
+    app.add_handler(CommandHandler('credit', credit))
+    app.add_handler(CommandHandler('export', export_data))
+    app.add_handler(CommandHandler('add_channel', add_channel))
+    app.add_handler(CommandHandler('del_channel', del_channel))
+    app.add_handler(CommandHandler('channels', list_channels))
+    app.add_handler(CommandHandler('broadcast', broadcast))
+    app.add_handler(CommandHandler('audience', audience))
+    app.add_handler(CallbackQueryHandler(button_handler))
+    return app
+
 async def main():
     # 1. Initialize Database
     init_db()
     logger.info("Database initialized.")
 
     # 2. Build User Bot Application
-    user_app = ApplicationBuilder().token(USER_BOT_TOKEN).post_init(user_post_init).build()
-    user_app.add_handler(CommandHandler('start', user_start))
-    user_app.add_handler(CallbackQueryHandler(user_btn_handler))
+    user_app = build_user_app(USER_BOT_TOKEN)
 
     # 3. Build Admin Bot Application
-    admin_app = ApplicationBuilder().token(ADMIN_BOT_TOKEN).build()
-    admin_app.add_handler(CommandHandler('start', admin_start))
-    admin_app.add_handler(CommandHandler('add_service', add_service))
-    admin_app.add_handler(CommandHandler('orders', list_orders))
-    admin_app.add_handler(CommandHandler('add_channel', add_channel))
-    admin_app.add_handler(CommandHandler('del_channel', del_channel))
-    admin_app.add_handler(CommandHandler('channels', list_channels))
-    admin_app.add_handler(CommandHandler('broadcast', broadcast))
-    admin_app.add_handler(CallbackQueryHandler(button_handler))
+    admin_app = build_admin_app(ADMIN_BOT_TOKEN)
 
     # 4. Run both bots concurrently
-    logger.info("Starting bots...")
+    logger.info(f"Starting bots ({BOT_MODE} mode)...")
+    webhook_server = None
+    metrics_server = None
+    web_server = None
     
-    # We use update_queue to run them in parallel if needed, but initialize_ and start_ are better for custom loops
-    # However, simpler is to just run_polling in parallel tasks
-    
-    async with user_app:
-        await user_app.start()
-        await user_app.updater.start_polling()
+    try:
+        if metrics.enabled:
+            metrics_server = await metrics.serve(METRICS_HOST, METRICS_PORT)
+            logger.info(f"Metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+        async with user_app:
+            await user_app.start()
         
-        async with admin_app:
-            await admin_app.start()
-            await admin_app.updater.start_polling()
+            async with admin_app:
+                await admin_app.start()
+
+                if BOT_MODE == 'webhook':
+                    # One listener for both bots, updates go straight onto each update_queue
+                    webhook_server = WebhookServer(WEBHOOK_HOST, WEBHOOK_PORT)
+                    webhook_server.add_bot(user_app, USER_BOT_TOKEN)
+                    webhook_server.add_bot(admin_app, ADMIN_BOT_TOKEN)
+                    await webhook_server.start()
+                    if WEBHOOK_URL:
+                        await set_webhook(user_app, USER_BOT_TOKEN, WEBHOOK_URL)
+                        await set_webhook(admin_app, ADMIN_BOT_TOKEN, WEBHOOK_URL)
+                    else:
+                        logger.warning("WEBHOOK_URL not set, webhooks must be registered manually.")
+                else:
+                    # chat_member updates (membership index) are only sent when asked for
+                    await user_app.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+                    await admin_app.updater.start_polling()
+
+                # Resume broadcasts interrupted by a restart
+                await resume_jobs(admin_app)
+                membership.reconciler.start(user_app.bot)
+                order_queue.notifier.start(admin_app.bot)
+                ledger.snapshotter.start()
+                archive.archiver.start()
+
+                if WEB_SERVER == 'bots':
+                    # The Mini App backend shares this loop (and the DB writer) with the bots
+                    import asgi
+                    web_server = await asgi.start_server(WEB_HOST, WEB_PORT)
+                    logger.info(f"Web app on {WEB_HOST}:{WEB_PORT}")
             
-            # Keep the main loop running
-            logger.info("Bots are running. Press Ctrl+C to stop.")
-            # We need a forever loop here that doesn't block
-            stop_signal = asyncio.Event()
-            await stop_signal.wait()
+                # Keep the main loop running
+                logger.info("Bots are running. Press Ctrl+C to stop.")
+                # We need a forever loop here that doesn't block
+                stop_signal = asyncio.Event()
+                await stop_signal.wait()
             
-            await admin_app.updater.stop()
-            await admin_app.stop()
+                if webhook_server:
+                    await webhook_server.stop()
+                else:
+                    await admin_app.updater.stop()
+                    await user_app.updater.stop()
+                await admin_app.stop()
         
-        await user_app.updater.stop()
-        await user_app.stop()
+            await user_app.stop()
+    finally:
+        if web_server:
+            await asgi.stop_server(*web_server)
+        await membership.reconciler.stop()
+        await order_queue.notifier.stop()
+        await ledger.snapshotter.stop()
+        await archive.archiver.stop()
+        if metrics_server:
+            metrics_server.close()
+        # Write out any buffered registrations before the writer thread stops
+        await registration.buffer.close()
+        async_db.shutdown()
+        close_pool()
 
 if __name__ == '__main__':
     try:
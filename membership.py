@@ -0,0 +1,237 @@
+import asyncio
+import logging
+import random
+import time
+from collections import OrderedDict
+from config import (MEMBERSHIP_CACHE_SIZE, MEMBERSHIP_POSITIVE_TTL, MEMBERSHIP_NEGATIVE_TTL, CHANNELS_CACHE_TTL,
+                    MEMBERSHIP_RECONCILE_AGE, MEMBERSHIP_RECONCILE_RATE, MEMBERSHIP_RECONCILE_START_DELAY)
+import async_db as db
+from periodic import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+# Channel gate. Membership lives in the `channel_members` table, kept current
+# by chat_member updates (the user bot is admin in every required channel).
+# A gate check is an in-memory TTL cache hit or one indexed query for the
+# user's rows; only (user, channel) pairs the index has never seen cost a
+# getChatMember call. The Reconciler re-checks the oldest rows at a fixed
+# trickle, in case an event was missed while the bot was down.
+
+NOT_MEMBER_STATUSES = ('left', 'kicked', 'restricted')
+
+
+class TTLCache:
+    # Bounded LRU where every entry carries its own expiry
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+
+    def get(self, key):
+        item = self.data.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires < time.monotonic():
+            del self.data[key]
+            return None
+        self.data.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl):
+        self.data[key] = (value, time.monotonic() + ttl)
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def pop(self, key):
+        self.data.pop(key, None)
+
+    def clear(self):
+        self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
+
+
+# (user_id, chat_id) -> True/False
+_members = TTLCache(MEMBERSHIP_CACHE_SIZE)
+
+# Channel list, refreshed from the DB on invalidation or after CHANNELS_CACHE_TTL
+_channels = None
+_channels_loaded = 0.0
+
+
+async def get_channels():
+    global _channels, _channels_loaded
+    if _channels is None or time.monotonic() - _channels_loaded > CHANNELS_CACHE_TTL:
+        _channels = [dict(ch) for ch in await db.list_channels()]
+        _channels_loaded = time.monotonic()
+    return _channels
+
+
+def invalidate_channels():
+    # Called by the admin bot whenever the channel list changes
+    global _channels
+    _channels = None
+    _members.clear()
+
+
+def remember(user_id, chat_id, is_member):
+    ttl = MEMBERSHIP_POSITIVE_TTL if is_member else MEMBERSHIP_NEGATIVE_TTL
+    _members.set((user_id, str(chat_id)), is_member, ttl)
+
+
+def forget(user_id, chat_id):
+    _members.pop((user_id, str(chat_id)))
+
+
+# --- Membership index ---
+
+def _lookup(conn, user_id, chat_ids):
+    marks = ','.join('?' * len(chat_ids))
+    rows = conn.execute(f'SELECT chat_id, is_member FROM channel_members WHERE user_id = ? AND chat_id IN ({marks})',
+                        [user_id, *chat_ids]).fetchall()
+    return {r['chat_id']: bool(r['is_member']) for r in rows}
+
+
+def _record(conn, user_id, chat_id, is_member, status, changed_at):
+    # Events can arrive out of order, an older one never overwrites a newer state
+    now = int(time.time())
+    return conn.execute('''
+        INSERT INTO channel_members (user_id, chat_id, is_member, status, changed_at, checked_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(user_id, chat_id) DO UPDATE SET
+            is_member = excluded.is_member, status = excluded.status,
+            changed_at = excluded.changed_at, checked_at = excluded.checked_at
+        WHERE excluded.changed_at >= channel_members.changed_at
+    ''', (user_id, str(chat_id), int(is_member), status, int(changed_at), now)).rowcount > 0
+
+
+def _stale(conn, older_than, limit):
+    return conn.execute('SELECT user_id, chat_id FROM channel_members WHERE checked_at < ? '
+                        'ORDER BY checked_at LIMIT ?', (int(older_than), limit)).fetchall()
+
+
+def _touch(conn, user_id, chat_id):
+    conn.execute('UPDATE channel_members SET checked_at = ? WHERE user_id = ? AND chat_id = ?',
+                 (int(time.time()), user_id, str(chat_id)))
+
+
+def _purge_removed(conn, chat_ids):
+    marks = ','.join('?' * len(chat_ids))
+    return conn.execute(f'DELETE FROM channel_members WHERE chat_id NOT IN ({marks})', list(chat_ids)).rowcount
+
+
+def is_member_status(status):
+    return status not in NOT_MEMBER_STATUSES
+
+
+async def record_event(chat_member_update):
+    # ChatMemberUpdated from a chat_member update; ignored unless it's a required channel
+    chat_id = str(chat_member_update.chat.id)
+    if chat_id not in {str(ch['chat_id']) for ch in await get_channels()}:
+        return False
+    new = chat_member_update.new_chat_member
+    is_member = is_member_status(new.status)
+    if await db.write(_record, new.user.id, chat_id, is_member, new.status, chat_member_update.date.timestamp()):
+        remember(new.user.id, chat_id, is_member)
+    return True
+
+
+async def _fetch(bot, user_id, ch):
+    try:
+        member = await bot.get_chat_member(chat_id=ch['chat_id'], user_id=user_id)
+    except Exception:
+        # Don't cache API failures, treat as not joined for now
+        return False
+    is_member = is_member_status(member.status)
+    remember(user_id, ch['chat_id'], is_member)
+    await db.write(_record, user_id, ch['chat_id'], is_member, member.status, time.time())
+    return is_member
+
+
+async def missing_channels(bot, user_id, recheck=False):
+    # recheck=True ignores known negatives (user just tapped "I Joined")
+    channels = await get_channels()
+    known = {}
+    for ch in channels:
+        cached = _members.get((user_id, str(ch['chat_id'])))
+        if cached is not None:
+            known[str(ch['chat_id'])] = cached
+
+    unknown = [str(ch['chat_id']) for ch in channels if str(ch['chat_id']) not in known]
+    if unknown:
+        for chat_id, is_member in (await db.read(_lookup, user_id, unknown)).items():
+            known[chat_id] = is_member
+            remember(user_id, chat_id, is_member)
+
+    missing = []
+    to_fetch = []
+    for ch in channels:
+        state = known.get(str(ch['chat_id']))
+        if state is True:
+            continue
+        if state is False and not recheck:
+            missing.append(ch)
+            continue
+        to_fetch.append(ch)
+
+    if to_fetch:
+        results = await asyncio.gather(*(_fetch(bot, user_id, ch) for ch in to_fetch))
+        missing.extend(ch for ch, ok in zip(to_fetch, results) if not ok)
+
+    # Keep the configured channel order for the join buttons
+    order = {id(ch): i for i, ch in enumerate(channels)}
+    missing.sort(key=lambda ch: order[id(ch)])
+    return missing
+
+
+class Reconciler(PeriodicTask):
+    # Re-checks index rows not confirmed for `max_age` seconds, oldest first,
+    # at `rate` getChatMember calls per second. Starts after a random delay,
+    # so restarts don't line up into a burst.
+    label = 'Membership reconciliation'
+
+    def __init__(self, max_age=MEMBERSHIP_RECONCILE_AGE, rate=MEMBERSHIP_RECONCILE_RATE,
+                 start_delay=MEMBERSHIP_RECONCILE_START_DELAY, batch=100):
+        super().__init__()
+        self.max_age = max_age
+        self.rate = rate
+        self.start_delay = start_delay
+        self.batch = batch
+        self.checked = 0
+
+    def start(self, bot):
+        if self.rate > 0:
+            super().start(bot)
+
+    def initial_delay(self):
+        return random.uniform(0, self.start_delay)
+
+    def retry_delay(self):
+        return min(self.max_age, 300)
+
+    async def tick(self, bot):
+        return self.retry_delay() if await self.run_once(bot) else 0
+
+    async def run_once(self, bot):
+        # One batch of stale rows; returns True when there was nothing to do
+        channels = {str(ch['chat_id']): ch for ch in await get_channels()}
+        if not channels:
+            return True
+        rows = await db.read(_stale, time.time() - self.max_age, self.batch)
+        if any(row['chat_id'] not in channels for row in rows):
+            # Rows of channels that are no longer required would be picked forever
+            await db.write(_purge_removed, tuple(channels))
+            rows = [row for row in rows if row['chat_id'] in channels]
+        for row in rows:
+            ch = channels[row['chat_id']]
+            await asyncio.sleep(1 / self.rate)
+            if not await _fetch(bot, row['user_id'], ch):
+                # API errors write nothing, don't pick the same row again straight away
+                await db.write(_touch, row['user_id'], row['chat_id'])
+            self.checked += 1
+        return False
+
+
+reconciler = Reconciler()
@@ -0,0 +1,241 @@
+import asyncio
+import bisect
+import functools
+import re
+import threading
+import time
+from telegram.request import HTTPXRequest
+from config import METRICS_ENABLED
+
+# In-process metrics in Prometheus text format. Recording is a no-op unless
+# METRICS_ENABLED is set, so the hot paths pay one attribute check when
+# nobody scrapes. Every process (each gunicorn worker, the bot process) keeps
+# its own registry and serves it on /metrics.
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+enabled = METRICS_ENABLED
+_lock = threading.Lock()
+_histograms = {}  # name -> {labels tuple: [bucket counts..., over the last bucket, sum, count]}
+_counters = {}    # name -> {labels tuple: value}
+_gauges = {}      # name -> callable returning {labels tuple: value}
+_help = {}
+_label_names = {}
+
+
+def declare(name, help_text, labels):
+    _help[name] = help_text
+    _label_names[name] = labels
+
+
+def observe(name, labels, seconds):
+    if not enabled:
+        return
+    with _lock:
+        series = _histograms.setdefault(name, {})
+        row = series.get(labels)
+        if row is None:
+            row = series[labels] = [0] * (len(BUCKETS) + 3)
+        # Past the last bound bisect gives len(BUCKETS), the overflow slot (+Inf only)
+        row[bisect.bisect_left(BUCKETS, seconds)] += 1
+        row[-2] += seconds
+        row[-1] += 1
+
+
+def inc(name, labels, value=1):
+    if not enabled:
+        return
+    with _lock:
+        series = _counters.setdefault(name, {})
+        series[labels] = series.get(labels, 0) + value
+
+
+def register_gauge(name, help_text, labels, fn):
+    # fn() -> {labels tuple: value}, evaluated at scrape time only
+    declare(name, help_text, labels)
+    _gauges[name] = fn
+
+
+def _fmt_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs) + '}'
+
+
+def render():
+    lines = []
+    with _lock:
+        histograms = {n: {k: list(v) for k, v in s.items()} for n, s in _histograms.items()}
+        counters = {n: dict(s) for n, s in _counters.items()}
+
+    for name, series in sorted(histograms.items()):
+        names = _label_names.get(name, ())
+        lines.append(f"# HELP {name} {_help.get(name, name)}")
+        lines.append(f"# TYPE {name} histogram")
+        for labels, row in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS, row):
+                cumulative += count
+                lines.append(f"{name}_bucket{_fmt_labels(names, labels, ('le', bound))} {cumulative}")
+            lines.append(f"{name}_bucket{_fmt_labels(names, labels, ('le', '+Inf'))} {row[-1]}")
+            lines.append(f"{name}_sum{_fmt_labels(names, labels)} {row[-2]}")
+            lines.append(f"{name}_count{_fmt_labels(names, labels)} {row[-1]}")
+
+    for name, series in sorted(counters.items()):
+        names = _label_names.get(name, ())
+        lines.append(f"# HELP {name} {_help.get(name, name)}")
+        lines.append(f"# TYPE {name} counter")
+        for labels, value in sorted(series.items()):
+            lines.append(f"{name}{_fmt_labels(names, labels)} {value}")
+
+    for name, fn in sorted(_gauges.items()):
+        try:
+            series = fn()
+        except Exception:
+            continue
+        names = _label_names.get(name, ())
+        lines.append(f"# HELP {name} {_help.get(name, name)}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in sorted(series.items()):
+            lines.append(f"{name}{_fmt_labels(names, labels)} {value}")
+
+    return '\n'.join(lines) + '\n'
+
+
+def histogram_totals(name):
+    # {labels tuple: (count, sum seconds)}, for reports that don't want the text format
+    with _lock:
+        return {labels: (row[-1], row[-2]) for labels, row in _histograms.get(name, {}).items()}
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+# --- Bot handlers ---
+
+declare('bot_handler_seconds', 'Bot handler latency', ('handler', 'callback'))
+
+
+def _callback_label(update):
+    query = getattr(update, 'callback_query', None)
+    if query is None or not query.data:
+        return ''
+    # ord:<status>:<svc>:... style data would explode cardinality, keep the prefix
+    return query.data.split(':', 1)[0]
+
+
+def timed_handler(fn):
+    name = f"{fn.__module__}.{fn.__name__}"
+
+    @functools.wraps(fn)
+    async def wrapper(update, context, *args, **kwargs):
+        if not enabled:
+            return await fn(update, context, *args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return await fn(update, context, *args, **kwargs)
+        finally:
+            observe('bot_handler_seconds', (name, _callback_label(update)), time.perf_counter() - start)
+    return wrapper
+
+
+# --- Database ---
+
+declare('db_query_seconds', 'SQLite statement execution time by fingerprint', ('query',))
+_fingerprints = {}
+_literal_re = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_space_re = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    fp = _fingerprints.get(sql)
+    if fp is None:
+        fp = _space_re.sub(' ', _literal_re.sub('?', sql)).strip()[:200]
+        if len(_fingerprints) < 10000:
+            _fingerprints[sql] = fp
+    return fp
+
+
+def observe_query(sql, seconds):
+    observe('db_query_seconds', (fingerprint(sql),), seconds)
+
+
+# --- Telegram API ---
+
+declare('telegram_api_calls_total', 'Outgoing Telegram Bot API calls', ('method', 'outcome'))
+declare('telegram_api_seconds', 'Telegram Bot API call latency', ('method',))
+
+OUTCOMES = {200: 'ok', 400: 'bad_request', 403: 'forbidden', 404: 'not_found', 409: 'conflict', 429: 'flood'}
+
+
+class InstrumentedRequest(HTTPXRequest):
+    # Pass to ApplicationBuilder().request(...) to count calls per API method
+    async def do_request(self, url, method, *args, **kwargs):
+        if not enabled:
+            return await super().do_request(url, method, *args, **kwargs)
+        api_method = url.rsplit('/', 1)[-1]
+        start = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception:
+            inc('telegram_api_calls_total', (api_method, 'network_error'))
+            raise
+        finally:
+            observe('telegram_api_seconds', (api_method,), time.perf_counter() - start)
+        inc('telegram_api_calls_total', (api_method, OUTCOMES.get(code, 'error' if code >= 400 else 'ok')))
+        return code, payload
+
+
+# --- Web ---
+
+declare('web_request_seconds', 'Web request latency', ('endpoint', 'status'))
+
+
+def init_flask(app):
+    from flask import Response, abort, g, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _record(resp):
+        start = g.pop('metrics_start', None)
+        if enabled and start is not None:
+            observe('web_request_seconds', (request.endpoint or 'unknown', str(resp.status_code)),
+                    time.perf_counter() - start)
+        return resp
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        if not enabled:
+            abort(404)
+        return Response(render(), mimetype=CONTENT_TYPE)
+
+
+# --- Bot process endpoint ---
+
+async def _handle_scrape(reader, writer):
+    try:
+        line = await reader.readline()
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+        parts = line.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?', 1)[0] == '/metrics':
+            body, status = render().encode('utf-8'), '200 OK'
+        else:
+            body, status = b'', '404 Not Found'
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {CONTENT_TYPE}\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body)
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host, port):
+    return await asyncio.start_server(_handle_scrape, host, port)
@@ -0,0 +1,138 @@
+import time
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from config import ORDERS_PAGE_SIZE, ORDER_COUNTS_TTL
+import async_db as db
+
+# Keyset-paginated order browser for the admin bot. Pages are addressed by the
+# last/first order id seen instead of an OFFSET, so every page is one index
+# range scan no matter how deep the admin pages.
+#
+# Callback data: ord:<status>:<service_id>:<n|p>:<cursor id>
+#   status is a short code (see STATUS_CODES), service_id 0 means any service,
+#   n = older than cursor, p = newer than cursor, cursor 0 = first page.
+
+STATUS_CODES = {
+    'a': None,
+    'p': 'pending',
+    'v': 'approved',
+    'r': 'rejected',
+    'c': 'completed',
+}
+STATUS_LABELS = {
+    'a': 'All',
+    'p': '⏳ Pending',
+    'v': '✅ Approved',
+    'r': '❌ Rejected',
+    'c': '📦 Completed',
+}
+CODE_FOR_STATUS = {v: k for k, v in STATUS_CODES.items()}
+
+_counts = None
+_counts_loaded = 0.0
+
+
+def callback_data(status_code='a', service_id=0, direction='n', cursor=0):
+    return f"ord:{status_code}:{service_id}:{direction}:{cursor}"
+
+
+def parse_callback(data):
+    try:
+        _, status_code, service_id, direction, cursor = data.split(':')
+        if status_code not in STATUS_CODES or direction not in ('n', 'p'):
+            raise ValueError(data)
+        return status_code, int(service_id), direction, int(cursor)
+    except ValueError:
+        return 'a', 0, 'n', 0
+
+
+def _fetch_page(conn, status, service_id, direction, cursor, limit):
+    where = []
+    params = []
+    if status:
+        where.append('status = ?')
+        params.append(status)
+    if service_id:
+        where.append('service_id = ?')
+        params.append(service_id)
+    if cursor:
+        where.append('id < ?' if direction == 'n' else 'id > ?')
+        params.append(cursor)
+    sql = 'SELECT * FROM orders'
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY id DESC' if direction == 'n' else ' ORDER BY id ASC'
+    sql += ' LIMIT ?'
+    params.append(limit + 1)  # one extra row tells us whether there is another page
+    rows = conn.execute(sql, params).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if direction == 'p':
+        rows.reverse()
+    return rows, has_more
+
+
+def _status_counts(conn):
+    return {row['status']: row['n'] for row in
+            conn.execute('SELECT status, COUNT(*) AS n FROM orders GROUP BY status').fetchall()}
+
+
+async def status_counts():
+    # The GROUP BY walks the status index; cache it so paging stays cheap
+    global _counts, _counts_loaded
+    if _counts is None or time.monotonic() - _counts_loaded > ORDER_COUNTS_TTL:
+        _counts = await db.read(_status_counts)
+        _counts_loaded = time.monotonic()
+    return _counts
+
+
+def invalidate_counts():
+    global _counts
+    _counts = None
+
+
+async def render_page(status_code='a', service_id=0, direction='n', cursor=0, page_size=ORDERS_PAGE_SIZE):
+    status = STATUS_CODES[status_code]
+    rows, has_more = await db.read(_fetch_page, status, service_id, direction, cursor, page_size)
+    counts = await status_counts()
+
+    total = sum(counts.values())
+    text = "📦 **Orders**\n"
+    text += f"Total: {total} | " + " | ".join(
+        f"{s.capitalize()}: {n}" for s, n in sorted(counts.items(), key=lambda kv: str(kv[0]))) + "\n"
+    text += f"Filter: {STATUS_LABELS[status_code]}"
+    if service_id:
+        text += f", Svc ID {service_id}"
+    text += "\n\n"
+
+    if not rows:
+        text += "No orders found."
+    else:
+        for o in rows:
+            text += (f"🆔 Order #{o['id']}\n👤 User: {o['user_id']}\n🛠 Svc ID: {o['service_id']}\n"
+                     f"📌 Status: {o['status']}\n🕒 {o['timestamp']}\n\n")
+
+    # Older/newer availability depends on which way we came from
+    if direction == 'n':
+        has_older, has_newer = has_more, bool(cursor)
+    else:
+        has_older, has_newer = bool(cursor), has_more
+
+    nav = []
+    if rows and has_newer:
+        nav.append(InlineKeyboardButton("⬅️ Newer", callback_data=callback_data(status_code, service_id, 'p', rows[0]['id'])))
+    if rows and has_older:
+        nav.append(InlineKeyboardButton("Older ➡️", callback_data=callback_data(status_code, service_id, 'n', rows[-1]['id'])))
+
+    filters = [InlineKeyboardButton(("• " if code == status_code else "") + label,
+                                    callback_data=callback_data(code, service_id))
+               for code, label in STATUS_LABELS.items()]
+
+    keyboard = []
+    if nav:
+        keyboard.append(nav)
+    keyboard.append(filters[:3])
+    keyboard.append(filters[3:])
+    if service_id:
+        keyboard.append([InlineKeyboardButton("✖️ Any Service", callback_data=callback_data(status_code, 0))])
+    keyboard.append([InlineKeyboardButton("🔙 Back to Dashboard", callback_data='btn_refresh')])
+    return text, InlineKeyboardMarkup(keyboard)
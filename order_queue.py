@@ -0,0 +1,161 @@
+import logging
+import time
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from config import ADMIN_ID, ORDER_DIGEST_WINDOW, ORDER_DIGEST_MAX, ORDER_DIGEST_POLL
+import async_db as db
+import ledger
+import order_browser
+from periodic import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+# New-order notifications for the admin. Every order is queued in
+# `order_queue` in the transaction that creates it (orders._insert_order), so
+# nothing is lost while the bot process is down. The notifier in the bot
+# process claims queued orders into a digest once the oldest has waited
+# ORDER_DIGEST_WINDOW seconds or ORDER_DIGEST_MAX are waiting, and sends one
+# message per digest. Its buttons approve or reject the whole batch with one
+# UPDATE; orders already handled from /orders keep their status. Rejected
+# orders are refunded to the user in the same transaction.
+#
+# Callback data: dig:<a|r>:<digest id>
+
+ACTIONS = {'a': 'approved', 'r': 'rejected'}
+ACTION_LABELS = {'approved': '✅ Approved', 'rejected': '❌ Rejected'}
+
+
+def enqueue(conn, order_id):
+    conn.execute('INSERT INTO order_queue (order_id, enqueued_at) VALUES (?, ?) ON CONFLICT DO NOTHING',
+                 (order_id, int(time.time())))
+
+
+def _waiting(conn, limit):
+    return conn.execute('SELECT order_id, enqueued_at FROM order_queue WHERE digest_id IS NULL '
+                        'ORDER BY order_id LIMIT ?', (limit,)).fetchall()
+
+
+def _claim(conn, chat_id, limit):
+    ids = [r['order_id'] for r in _waiting(conn, limit)]
+    if not ids:
+        return None
+    digest_id = conn.execute(
+        'INSERT INTO order_digests (chat_id, orders, first_order_id, last_order_id, created_at) '
+        'VALUES (?, ?, ?, ?, ?) RETURNING id',
+        (chat_id, len(ids), ids[0], ids[-1], int(time.time()))).fetchone()[0]
+    marks = ','.join('?' * len(ids))
+    conn.execute(f'UPDATE order_queue SET digest_id = ? WHERE order_id IN ({marks})', [digest_id, *ids])
+    return digest_id
+
+
+def _unsent_digest(conn):
+    # Claimed but never delivered (API error, restart mid-send)
+    row = conn.execute('SELECT id FROM order_digests WHERE message_id IS NULL ORDER BY id LIMIT 1').fetchone()
+    return row['id'] if row else None
+
+
+def _digest_orders(conn, digest_id):
+    return conn.execute(
+        'SELECT o.id, o.user_id, o.status, s.name, s.price FROM order_queue q '
+        'JOIN orders o ON o.id = q.order_id LEFT JOIN services s ON s.id = o.service_id '
+        'WHERE q.digest_id = ? ORDER BY o.id', (digest_id,)).fetchall()
+
+
+def _set_message(conn, digest_id, message_id):
+    conn.execute('UPDATE order_digests SET message_id = ? WHERE id = ?', (message_id, digest_id))
+
+
+def _resolve(conn, digest_id, status):
+    # -> number of orders changed, or None if the digest was already handled
+    cur = conn.execute("UPDATE order_digests SET status = ?, resolved_at = ? WHERE id = ? AND status = 'open'",
+                       (status, int(time.time()), digest_id))
+    if not cur.rowcount:
+        return None
+    if status == 'rejected':
+        for o in conn.execute(
+                "SELECT o.id, o.user_id, o.paid_minor FROM order_queue q JOIN orders o ON o.id = q.order_id "
+                "WHERE q.digest_id = ? AND o.status = 'pending' AND o.paid_minor > 0", (digest_id,)).fetchall():
+            ledger.credit(conn, o['user_id'], o['paid_minor'], 'refund', o['id'])
+    changed = conn.execute(
+        "UPDATE orders SET status = ? WHERE status = 'pending' AND id IN "
+        "(SELECT order_id FROM order_queue WHERE digest_id = ?)", (status, digest_id)).rowcount
+    conn.execute('DELETE FROM order_queue WHERE digest_id = ?', (digest_id,))
+    return changed
+
+
+def render_digest(digest_id, rows):
+    text = f"🧾 {len(rows)} new order{'s' if len(rows) != 1 else ''}"
+    if rows:
+        text += f" (#{rows[0]['id']}–#{rows[-1]['id']})" if len(rows) > 1 else f" (#{rows[0]['id']})"
+    text += "\n\n"
+    for o in rows:
+        service = f"{o['name']} · ${o['price']}" if o['name'] is not None else "unknown service"
+        flag = "" if o['status'] == 'pending' else f" [{o['status']}]"
+        text += f"#{o['id']} · {service} · user {o['user_id']}{flag}\n"
+    keyboard = [
+        [InlineKeyboardButton("✅ Approve all", callback_data=f"dig:a:{digest_id}"),
+         InlineKeyboardButton("❌ Reject all", callback_data=f"dig:r:{digest_id}")],
+        [InlineKeyboardButton("📋 Review pending", callback_data=order_browser.callback_data('p'))],
+    ]
+    return text, InlineKeyboardMarkup(keyboard)
+
+
+def parse_callback(data):
+    # -> (status, digest_id) or None
+    try:
+        _, action, digest_id = data.split(':')
+        return ACTIONS[action], int(digest_id)
+    except (KeyError, ValueError):
+        return None
+
+
+async def resolve(digest_id, status):
+    changed = await db.write(_resolve, digest_id, status)
+    if changed is not None:
+        order_browser.invalidate_counts()
+    return changed
+
+
+class OrderNotifier(PeriodicTask):
+    label = 'Order digest'
+
+    def __init__(self, chat_id=ADMIN_ID, window=ORDER_DIGEST_WINDOW, max_orders=ORDER_DIGEST_MAX,
+                 poll=ORDER_DIGEST_POLL):
+        super().__init__()
+        self.chat_id = int(chat_id) if chat_id else None
+        self.window = window
+        self.max_orders = max_orders
+        self.poll = poll
+        self.sent = 0
+
+    def start(self, bot):
+        if self.chat_id is None:
+            logger.warning("ADMIN_ID not set, new orders won't be announced")
+            return
+        super().start(bot)
+
+    def retry_delay(self):
+        # e.g. the admin blocked the bot; the digest stays unsent and is retried
+        return max(self.poll, 30)
+
+    async def tick(self, bot):
+        return 0 if await self.run_once(bot) else self.poll
+
+    async def run_once(self, bot, now=None):
+        # Sends at most one digest; returns True if it did
+        digest_id = await db.read(_unsent_digest)
+        if digest_id is None:
+            waiting = await db.read(_waiting, self.max_orders)
+            now = time.time() if now is None else now
+            if not waiting or (len(waiting) < self.max_orders and now - waiting[0]['enqueued_at'] < self.window):
+                return False
+            digest_id = await db.write(_claim, self.chat_id, self.max_orders)
+            if digest_id is None:
+                return False
+        text, reply_markup = render_digest(digest_id, await db.read(_digest_orders, digest_id))
+        msg = await bot.send_message(chat_id=self.chat_id, text=text, reply_markup=reply_markup)
+        await db.write(_set_message, digest_id, msg.message_id)
+        self.sent += 1
+        return True
+
+
+notifier = OrderNotifier()
@@ -0,0 +1,60 @@
+import asyncio
+import async_db as db
+import ledger
+import order_queue
+
+# Order ingestion for POST /buy. Inserts go through the shared group-commit
+# writer (async_db.Writer), so concurrent requests in a worker share one
+# transaction and one fsync while each still gets its own result. An
+# Idempotency-Key from the client is stored (scoped to the user) under a
+# unique index, so a double tap returns the original order instead of a copy.
+# A new order is charged to the user's credits (ledger.debit, which refuses
+# to overdraw) and queued for the admin digest in the same transaction, so a
+# failed charge leaves no order behind.
+
+MAX_KEY_LENGTH = 64
+
+
+class InvalidIdempotencyKey(ValueError):
+    pass
+
+
+def _insert_order(conn, user_id, service_id, key):
+    service = conn.execute('SELECT price FROM services WHERE id = ?', (service_id,)).fetchone()
+    if service is None:
+        raise ValueError(f"Unknown service {service_id}")
+    price = ledger.to_minor(service['price'])
+    cur = conn.execute(
+        'INSERT INTO orders (user_id, service_id, status, idempotency_key, paid_minor) VALUES (?, ?, ?, ?, ?) '
+        'ON CONFLICT(idempotency_key) DO NOTHING RETURNING id',
+        (user_id, service_id, 'pending', key, price))
+    row = cur.fetchone()
+    if row is not None:
+        # Raises InsufficientFunds; the writer rolls this item back, order included
+        ledger.debit(conn, user_id, price, 'order', row[0])
+        order_queue.enqueue(conn, row[0])
+        return row[0], True
+    row = conn.execute('SELECT id FROM orders WHERE idempotency_key = ?', (key,)).fetchone()
+    return row['id'], False
+
+
+def scoped_key(user_id, key):
+    if key is None or key == '':
+        return None
+    key = str(key)
+    if len(key) > MAX_KEY_LENGTH:
+        raise InvalidIdempotencyKey(f"Idempotency key longer than {MAX_KEY_LENGTH} characters")
+    return f"{user_id}:{key}"
+
+
+def place_order(user_id, service_id, idempotency_key=None, timeout=10):
+    # Returns (order_id, created); created is False for a replayed key.
+    # Raises ledger.InsufficientFunds when the user can't pay for it.
+    key = scoped_key(user_id, idempotency_key)
+    return db.write_sync(_insert_order, user_id, service_id, key, timeout=timeout)
+
+
+async def place_order_async(user_id, service_id, idempotency_key=None, timeout=10):
+    # Same as place_order, for callers on an event loop (asgi.py)
+    key = scoped_key(user_id, idempotency_key)
+    return await asyncio.wait_for(db.write(_insert_order, user_id, service_id, key), timeout)
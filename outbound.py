@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from config import OUTBOUND_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST, OUTBOUND_MAX_RETRIES
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# One outbound scheduler for both bots, plugged in with
+# ApplicationBuilder().rate_limiter(outbound.scheduler). Message calls
+# (send*/copy*/forward*/edit* with a chat_id) wait for a per-chat slot, then
+# for a global token; waiting interactive calls always get the next token
+# before bulk ones, so a broadcast never delays a user's reply by more than
+# one token. RetryAfter pauses every lane for the requested time; interactive
+# calls are retried here, bulk calls are raised to the broadcast engine, which
+# owns their retries (it counts the flood wait and slows the job down). Other
+# calls (getChatMember, answerCallbackQuery...) go straight through.
+#
+# Broadcast sends opt into the bulk lane with bulk_kwargs(bot); everything
+# else is interactive.
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+LANES = (INTERACTIVE, BULK)
+LIMITED_PREFIXES = ('send', 'copy', 'forward', 'edit')
+
+metrics.declare('outbound_wait_seconds', 'Time a message waited for its rate limit slot', ('lane',))
+metrics.declare('outbound_retry_after_total', 'RetryAfter responses seen by the outbound scheduler', ('lane',))
+
+
+class OutboundScheduler(BaseRateLimiter):
+    def __init__(self, rate=OUTBOUND_RATE, chat_rate=OUTBOUND_CHAT_RATE, chat_burst=OUTBOUND_CHAT_BURST,
+                 max_retries=OUTBOUND_MAX_RETRIES, max_chats=50000):
+        self.rate = float(rate)
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.chat_rate = float(chat_rate)
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self.chats = {}  # chat_id -> (tokens, updated)
+        self.waiters = {lane: deque() for lane in LANES}
+        self.wakeup = asyncio.Event()
+        self.dispatcher = None
+        self.users = 0
+
+    # BaseRateLimiter hooks, called by every bot using this scheduler
+
+    async def initialize(self):
+        self.users += 1
+
+    async def shutdown(self):
+        self.users = max(0, self.users - 1)
+        if self.users == 0 and self.dispatcher is not None:
+            self.dispatcher.cancel()
+            try:
+                await self.dispatcher
+            except asyncio.CancelledError:
+                pass
+            self.dispatcher = None
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get('chat_id')
+        if chat_id is None or not endpoint.startswith(LIMITED_PREFIXES):
+            return await callback(*args, **kwargs)
+
+        lane = rate_limit_args if rate_limit_args in self.waiters else INTERACTIVE
+        max_retries = self.max_retries if lane == INTERACTIVE else 0
+        attempt = 0
+        while True:
+            start = time.monotonic()
+            delay = self._chat_delay(chat_id)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self._acquire(lane)
+            metrics.observe('outbound_wait_seconds', (lane,), time.monotonic() - start)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                metrics.inc('outbound_retry_after_total', (lane,))
+                self._pause(e.retry_after)
+                if attempt >= max_retries:
+                    raise
+                attempt += 1
+                logger.warning(f"Flood control on {endpoint} ({lane}), retrying in {e.retry_after}s")
+
+    # Limits
+
+    def _chat_delay(self, chat_id):
+        # Reserve the chat's next slot; tokens may go negative, which queues later calls behind it
+        now = time.monotonic()
+        tokens, updated = self.chats.get(chat_id, (self.chat_burst, now))
+        tokens = min(self.chat_burst, tokens + (now - updated) * self.chat_rate) - 1
+        if chat_id not in self.chats and len(self.chats) >= self.max_chats:
+            self._prune(now)
+        self.chats[chat_id] = (tokens, now)
+        return -tokens / self.chat_rate if tokens < 0 else 0.0
+
+    def _prune(self, now):
+        # Chats whose bucket has refilled carry no state worth keeping
+        full = (self.chat_burst - 1) / self.chat_rate
+        for chat_id, (tokens, updated) in list(self.chats.items()):
+            if now - updated > full + max(0.0, -tokens) / self.chat_rate:
+                del self.chats[chat_id]
+
+    def _pause(self, retry_after):
+        self.tokens = 0
+        self.paused_until = max(self.paused_until, time.monotonic() + float(retry_after))
+
+    async def _acquire(self, lane):
+        fut = asyncio.get_running_loop().create_future()
+        self.waiters[lane].append(fut)
+        if self.dispatcher is None or self.dispatcher.done():
+            self.dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+        self.wakeup.set()
+        await fut
+
+    def _next_waiter(self):
+        for lane in LANES:
+            waiters = self.waiters[lane]
+            while waiters:
+                fut = waiters.popleft()
+                if not fut.done():  # skip callers that were cancelled while waiting
+                    return fut
+        return None
+
+    async def _dispatch(self):
+        while True:
+            if not any(self.waiters.values()):
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                continue
+            fut = self._next_waiter()
+            if fut is not None:
+                self.tokens -= 1
+                fut.set_result(None)
+
+    def depths(self):
+        return {(lane,): sum(1 for f in self.waiters[lane] if not f.done()) for lane in LANES}
+
+
+scheduler = OutboundScheduler()
+
+metrics.register_gauge('outbound_lane_depth', 'Messages waiting for a rate limit slot', ('lane',),
+                       scheduler.depths)
+
+
+def bulk_kwargs(bot):
+    # rate_limit_args is rejected by bots built without a rate limiter
+    return {'rate_limit_args': BULK} if getattr(bot, 'rate_limiter', None) else {}
@@ -0,0 +1,49 @@
+import asyncio
+import logging
+
+# Background jobs on the running event loop (digest sender, membership
+# reconciler, ledger snapshots, order archival). start() spawns the loop once,
+# stop() cancels it and waits for it. Subclasses implement tick(), one round
+# of work returning the seconds to sleep before the next; a failed round is
+# logged and retried after retry_delay().
+
+
+class PeriodicTask:
+    label = 'Background task'  # for the error log
+
+    def __init__(self):
+        self.task = None
+
+    def start(self, *args):
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self._run(*args))
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def initial_delay(self):
+        return 0
+
+    def retry_delay(self):
+        return 30
+
+    async def tick(self, *args):
+        raise NotImplementedError
+
+    async def _run(self, *args):
+        await asyncio.sleep(self.initial_delay())
+        while True:
+            try:
+                delay = await self.tick(*args)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.getLogger(type(self).__module__).error(f"{self.label} failed: {e}")
+                delay = self.retry_delay()
+            await asyncio.sleep(delay)
@@ -0,0 +1,45 @@
+from config import REFERRAL_BONUS
+import async_db as db
+import ledger
+
+# Referral statistics. referral_stats keeps one row per referrer with the
+# number of users they brought in and the bonus credited for them (minor
+# units, see ledger.py). It is
+# updated inside the registration transaction, so reads are a primary key
+# lookup (profile) or a walk of the (referrals DESC) index (leaderboard)
+# and never a GROUP BY over users.
+
+
+def record_referral(conn, referrer_id):
+    # Only count referrers we know, a /start argument can be any number
+    bonus_minor = ledger.to_minor(REFERRAL_BONUS)
+    cur = conn.execute(
+        'INSERT INTO referral_stats (referrer_id, referrals, bonus_minor) '
+        'SELECT ?, 1, ? WHERE EXISTS (SELECT 1 FROM users WHERE user_id = ?) '
+        'ON CONFLICT(referrer_id) DO UPDATE SET referrals = referral_stats.referrals + 1, '
+        'bonus_minor = referral_stats.bonus_minor + excluded.bonus_minor',
+        (referrer_id, bonus_minor, referrer_id))
+    if cur.rowcount and bonus_minor:
+        ledger.credit(conn, referrer_id, bonus_minor, 'referral')
+    return cur.rowcount > 0
+
+
+def _get_stats(conn, user_id):
+    row = conn.execute('SELECT referrals, bonus_minor FROM referral_stats WHERE referrer_id = ?', (user_id,)).fetchone()
+    return (row['referrals'], row['bonus_minor']) if row else (0, 0)
+
+
+def _leaderboard(conn, limit):
+    return conn.execute(
+        'SELECT r.referrer_id, r.referrals, r.bonus_minor, u.username, u.first_name '
+        'FROM referral_stats r LEFT JOIN users u ON u.user_id = r.referrer_id '
+        'ORDER BY r.referrals DESC, r.referrer_id LIMIT ?', (limit,)).fetchall()
+
+
+async def get_stats(user_id):
+    # Returns (referrals, bonus in minor units)
+    return await db.read(_get_stats, user_id)
+
+
+async def leaderboard(limit=10):
+    return await db.read(_leaderboard, limit)
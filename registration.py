@@ -0,0 +1,104 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from config import REGISTRATION_BATCH_SIZE, REGISTRATION_FLUSH_INTERVAL, REGISTRATION_SEEN_SIZE
+import async_db as db
+import referrals
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Write-behind buffer for /start registrations. New users are collected in
+# memory and written in one transaction when the batch is full or
+# REGISTRATION_FLUSH_INTERVAL has passed, instead of one commit per /start.
+# ON CONFLICT DO NOTHING (and keeping the first entry queued in the buffer)
+# preserves first-referrer-wins, and referral counters are bumped in the same
+# transaction for the users that were actually created.
+
+
+def _insert_users(conn, rows):
+    created = []
+    for row in rows:
+        cur = conn.execute('INSERT INTO users (user_id, username, first_name, referred_by) VALUES (?, ?, ?, ?) '
+                           'ON CONFLICT DO NOTHING', row)
+        if cur.rowcount:
+            created.append(row)
+    # Second pass so a referrer registered in the same batch is already there
+    for user_id, _, _, referred_by in created:
+        if referred_by:
+            referrals.record_referral(conn, referred_by)
+    return len(created)
+
+
+class RegistrationBuffer:
+    def __init__(self, batch_size, flush_interval, seen_size):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.seen_size = seen_size
+        self.pending = {}
+        self.seen = OrderedDict()
+        self.tasks = set()
+        self.timer = None
+
+    def _mark_seen(self, user_id):
+        self.seen[user_id] = True
+        self.seen.move_to_end(user_id)
+        while len(self.seen) > self.seen_size:
+            self.seen.popitem(last=False)
+
+    def _spawn(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def add(self, user_id, username, first_name, referrer_id=None):
+        # Returns False if the user was seen recently and nothing was queued
+        if user_id in self.seen:
+            self.seen.move_to_end(user_id)
+            return False
+        self._mark_seen(user_id)
+        self.pending[user_id] = (user_id, username, first_name, referrer_id)
+
+        if len(self.pending) >= self.batch_size:
+            self._spawn(self.flush())
+        elif self.timer is None:
+            self.timer = self._spawn(self._flush_later())
+        return True
+
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(self.flush_interval)
+        finally:
+            self.timer = None
+        await self.flush()
+
+    async def flush(self):
+        if not self.pending:
+            return 0
+        batch, self.pending = self.pending, {}
+        rows = list(batch.values())
+        try:
+            await db.write(_insert_users, rows)
+        except Exception as e:
+            logger.error(f"Error flushing {len(rows)} registrations: {e}")
+            # Put them back for the next flush, newer entries for the same user lose
+            for user_id, row in batch.items():
+                self.pending.setdefault(user_id, row)
+            if self.timer is None:
+                self.timer = self._spawn(self._flush_later())
+            return 0
+        return len(rows)
+
+    async def close(self):
+        if self.timer is not None:
+            self.timer.cancel()
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+        return await self.flush()
+
+
+buffer = RegistrationBuffer(REGISTRATION_BATCH_SIZE, REGISTRATION_FLUSH_INTERVAL, REGISTRATION_SEEN_SIZE)
+
+metrics.register_gauge('registration_buffer_pending', 'Registrations waiting to be flushed', (),
+                       lambda: {(): len(buffer.pending)})
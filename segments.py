@@ -0,0 +1,121 @@
+import json
+from datetime import datetime, timedelta
+
+# Broadcast audiences. A segment is a small dict of filters on `users`:
+#
+#   joined_from / joined_to   YYYY-MM-DD, inclusive
+#   balance                   yes | no
+#   ref                       yes | no | <referrer user_id>
+#   ordered                   yes | no
+#
+# It is stored as JSON on the broadcast job and turned into a WHERE clause
+# here, from whitelisted keys only. Recipients are read in user_id keyset
+# chunks, so a segment of any size is delivered in constant memory, and the
+# size shown before sending comes from a COUNT(*) over the same clause
+# (joined_at, referred_by and partial balance indexes, orders.user_id for
+# EXISTS).
+
+YES_NO = ('yes', 'no')
+KEYS = ('joined_from', 'joined_to', 'balance', 'ref', 'ordered')
+
+
+class InvalidSegment(ValueError):
+    pass
+
+
+def _date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except ValueError:
+        raise InvalidSegment(f"Bad date '{value}', use YYYY-MM-DD")
+
+
+def parse_args(args):
+    # Leading key=value args are filters, the rest is the message:
+    #   /broadcast balance=no ordered=yes Hello there
+    segment = {}
+    rest = list(args)
+    while rest and '=' in rest[0]:
+        key, _, value = rest.pop(0).partition('=')
+        key, value = key.lower(), value.strip()
+        if key not in KEYS:
+            raise InvalidSegment(f"Unknown filter '{key}'")
+        if key in ('joined_from', 'joined_to'):
+            segment[key] = _date(value)
+        elif key == 'ref':
+            value = value.lower()
+            if value not in YES_NO and not value.isdigit():
+                raise InvalidSegment("ref must be yes, no or a user id")
+            segment[key] = int(value) if value.isdigit() else value
+        else:
+            value = value.lower()
+            if value not in YES_NO:
+                raise InvalidSegment(f"{key} must be yes or no")
+            segment[key] = value
+    return segment, rest
+
+
+def where(segment):
+    # -> (SQL conditions on `users u`, params); always at least one condition
+    conds, params = [], []
+    segment = segment or {}
+    if 'joined_from' in segment:
+        conds.append('u.joined_at >= ?')
+        params.append(segment['joined_from'])
+    if 'joined_to' in segment:
+        conds.append('u.joined_at < ?')
+        day_after = datetime.strptime(segment['joined_to'], '%Y-%m-%d') + timedelta(days=1)
+        params.append(day_after.strftime('%Y-%m-%d'))
+    if segment.get('balance') == 'yes':
+        conds.append('u.balance_minor > 0')
+    elif segment.get('balance') == 'no':
+        conds.append('u.balance_minor <= 0')
+    ref = segment.get('ref')
+    if ref == 'yes':
+        conds.append('u.referred_by IS NOT NULL')
+    elif ref == 'no':
+        conds.append('u.referred_by IS NULL')
+    elif ref is not None:
+        conds.append('u.referred_by = ?')
+        params.append(int(ref))
+    if segment.get('ordered') == 'yes':
+        conds.append('EXISTS (SELECT 1 FROM orders o WHERE o.user_id = u.user_id)')
+    elif segment.get('ordered') == 'no':
+        conds.append('NOT EXISTS (SELECT 1 FROM orders o WHERE o.user_id = u.user_id)')
+    return (' AND '.join(conds) or '1 = 1'), params
+
+
+def count(conn, segment):
+    clause, params = where(segment)
+    return conn.execute(f'SELECT COUNT(*) FROM users u WHERE {clause}', params).fetchone()[0]
+
+
+def next_chunk(conn, segment, after_user_id, size):
+    clause, params = where(segment)
+    rows = conn.execute(f'SELECT u.user_id FROM users u WHERE u.user_id > ? AND {clause} ORDER BY u.user_id LIMIT ?',
+                        [after_user_id, *params, size]).fetchall()
+    return [r[0] for r in rows]
+
+
+def dumps(segment):
+    return json.dumps(segment, sort_keys=True) if segment else None
+
+
+def loads(value):
+    return json.loads(value) if value else {}
+
+
+def describe(segment):
+    if not segment:
+        return "all users"
+    parts = []
+    if 'joined_from' in segment or 'joined_to' in segment:
+        parts.append(f"joined {segment.get('joined_from', '…')} to {segment.get('joined_to', '…')}")
+    if 'balance' in segment:
+        parts.append("with balance" if segment['balance'] == 'yes' else "without balance")
+    ref = segment.get('ref')
+    if ref is not None:
+        parts.append({'yes': "referred", 'no': "not referred"}.get(ref, f"referred by {ref}"))
+    if 'ordered' in segment:
+        parts.append("has ordered" if segment['ordered'] == 'yes' else "never ordered")
+    return ", ".join(parts)
@@ -6,9 +6,29 @@ export PYTHONUNBUFFERED=1
 echo "Initializing Database..."
 python -c "from database import init_db; init_db()"
 
-echo "Starting Bots (User & Admin)..."
-python main.py &
+echo "Building static assets..."
+# Offline; the vendored third-party files come from the build (Dockerfile / render.yaml)
+python assets.py
 
-echo "Starting Web App on 0.0.0.0:$PORT..."
-# Run Gunicorn in foreground
-gunicorn app:app --bind 0.0.0.0:$PORT --log-level info
+case "${WEB_SERVER:-wsgi}" in
+    bots)
+        # Bots and the web app (asgi.py) on one event loop, in one process
+        echo "Starting Bots and Web App on 0.0.0.0:$PORT..."
+        python main.py
+        ;;
+    asgi)
+        echo "Starting Bots (User & Admin)..."
+        python main.py &
+
+        echo "Starting Web App (ASGI) on 0.0.0.0:$PORT..."
+        uvicorn asgi:app --host 0.0.0.0 --port $PORT --timeout-keep-alive ${WEB_KEEPALIVE:-30} --no-access-log
+        ;;
+    *)
+        echo "Starting Bots (User & Admin)..."
+        python main.py &
+
+        echo "Starting Web App on 0.0.0.0:$PORT..."
+        # Run Gunicorn in foreground (threads let concurrent /buy requests share one group commit)
+        gunicorn app:app --bind 0.0.0.0:$PORT --threads ${WEB_THREADS:-8} --log-level info
+        ;;
+esac
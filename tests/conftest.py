@@ -0,0 +1,26 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The modules read their settings at import time; point them at a throwaway
+# database before anything imports config
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db')
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    # A fresh, fully migrated SQLite database per test
+    import async_db
+    import database
+    monkeypatch.setattr(database, 'DB_PATH', str(tmp_path / 'service_bot.db'))
+    database.close_pool()
+    database.init_db()
+    yield database
+    if async_db._writer is not None and async_db._writer.is_alive():
+        async_db._writer.stop()
+    async_db._writer = None
+    database.close_pool()
@@ -0,0 +1,98 @@
+import asyncio
+import glob
+import gzip
+import json
+import os
+
+import pytest
+
+import archive
+import async_db
+
+NOW = 1790000000  # 2026-09-21
+STATUSES = ['approved', 'rejected', 'completed', 'pending']
+
+
+@pytest.fixture
+def orders(db):
+    with db.db_connection() as conn:
+        conn.execute("INSERT INTO services (name, price) VALUES ('Svc', 1)")
+        for i in range(40):
+            # 2020-01 and 2020-02, one status after another; the last two are recent
+            month = '2020-01' if i < 20 else '2020-02'
+            timestamp = '2026-09-20 00:00:00' if i >= 38 else f'{month}-{i % 20 + 1:02d} 12:00:00'
+            conn.execute('INSERT INTO orders (user_id, service_id, status, timestamp) VALUES (?, 1, ?, ?)',
+                         (1000 + i, STATUSES[i % 4], timestamp))
+    return db
+
+
+def remaining(db):
+    with db.db_connection() as conn:
+        return {r[0]: r[1] for r in conn.execute('SELECT id, status FROM orders').fetchall()}
+
+
+def archived(directory):
+    rows = []
+    for path in glob.glob(os.path.join(directory, 'orders', '*', '*.ndjson.gz')):
+        with gzip.open(path, 'rt') as f:
+            rows += [json.loads(line) for line in f]
+    return rows
+
+
+def test_moves_old_finished_orders(orders, tmp_path):
+    archiver = archive.OrderArchiver(days=30, directory=str(tmp_path), batch=7)
+    moved = asyncio.run(archiver.run_once(NOW))
+    rows = archived(str(tmp_path))
+    left = remaining(orders)
+    assert moved == len(rows) == 29
+    assert sorted(os.listdir(tmp_path / 'orders')) == ['2020-01', '2020-02']
+    assert all(r['status'] != 'pending' for r in rows)
+    assert not {r['id'] for r in rows} & set(left)
+    # Recent orders stay whatever their status, old ones only while pending
+    assert {39, 40} <= set(left)
+    assert all(status == 'pending' for id, status in left.items() if id <= 38)
+    assert not glob.glob(str(tmp_path / 'orders' / '*' / '*.pending'))
+
+
+def test_writer_is_free_while_files_are_written(orders, tmp_path, monkeypatch):
+    stage = archive._stage
+
+    def stage_and_write(directory, rows):
+        # Would time out if the batch held the writer transaction
+        async_db.write_sync(lambda conn: conn.execute('SELECT 1').fetchone(), timeout=5)
+        return stage(directory, rows)
+    monkeypatch.setattr(archive, '_stage', stage_and_write)
+    assert asyncio.run(archive.OrderArchiver(days=30, directory=str(tmp_path)).run_once(NOW)) == 29
+
+
+def test_failed_delete_is_reconciled_on_the_next_run(orders, tmp_path, monkeypatch):
+    def fail(conn, ids):
+        raise RuntimeError('commit failed')
+    monkeypatch.setattr(archive, '_delete_batch', fail)
+    archiver = archive.OrderArchiver(days=30, directory=str(tmp_path))
+    with pytest.raises(RuntimeError):
+        asyncio.run(archiver.run_once(NOW))
+    assert len(remaining(orders)) == 40
+    assert archived(str(tmp_path)) == []
+    assert archive._pending_files(str(tmp_path))
+
+    monkeypatch.undo()
+    assert asyncio.run(archiver.run_once(NOW)) == 29
+    ids = [r['id'] for r in archived(str(tmp_path))]
+    assert len(ids) == len(set(ids)) == 29
+    assert not set(ids) & set(remaining(orders))
+    assert archive._pending_files(str(tmp_path)) == []
+
+
+def test_crash_after_delete_is_recovered(orders, tmp_path):
+    with orders.db_connection() as conn:
+        rows = archive._select_batch(conn, '2020-01-10 00:00:00', 100)
+    archive._stage(str(tmp_path), rows)
+    with orders.db_connection() as conn:
+        # One of them is deleted, the process dies before the rename
+        archive._delete_batch(conn, [rows[0][0]])
+    archiver = archive.OrderArchiver(days=30, directory=str(tmp_path))
+    asyncio.run(archiver._recover())
+    assert [r['id'] for r in archived(str(tmp_path))] == [rows[0][0]]
+    assert archive._pending_files(str(tmp_path)) == []
+    assert set(r[0] for r in rows[1:]) <= set(remaining(orders))
@@ -0,0 +1,117 @@
+import asyncio
+import sqlite3
+from concurrent.futures import Future
+
+import pytest
+
+import async_db
+
+
+class StubConnection:
+    # Records statements; `fail` names the statement (or 'COMMIT') that raises
+    def __init__(self, fail=None, error=sqlite3.OperationalError):
+        self.fail = fail
+        self.error = error
+        self.statements = []
+        self.in_transaction = False
+        self.closed = False
+
+    def execute(self, sql, params=()):
+        if sql == self.fail:
+            raise self.error('connection lost')
+        self.statements.append(sql)
+        if sql == 'BEGIN IMMEDIATE':
+            self.in_transaction = True
+        return self
+
+    def commit(self):
+        if self.fail == 'COMMIT':
+            raise self.error('connection lost')
+        self.statements.append('COMMIT')
+        self.in_transaction = False
+
+    def rollback(self):
+        self.statements.append('ROLLBACK')
+        self.in_transaction = False
+
+    def close(self):
+        self.closed = True
+
+    really_close = close
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    # get_db_connection() hands these out in order
+    pending = []
+    monkeypatch.setattr(async_db, 'get_db_connection', lambda: pending.pop(0))
+    return pending
+
+
+def item(fn=lambda conn: 'ok'):
+    return fn, (), Future()
+
+
+def test_connection_dead_while_idle_is_replaced_and_batch_retried(connections):
+    dead, fresh = StubConnection(fail='BEGIN IMMEDIATE'), StubConnection()
+    connections += [dead, fresh]
+    writer = async_db.Writer()
+    batch = [item(), item()]
+    writer._commit_batch(batch)
+    assert [fut.result() for _, _, fut in batch] == ['ok', 'ok']
+    assert dead.closed and writer.conn is fresh
+    assert fresh.statements[0] == 'BEGIN IMMEDIATE' and fresh.statements[-1] == 'COMMIT'
+
+
+def test_lost_commit_fails_only_that_batch(connections):
+    broken, fresh = StubConnection(fail='COMMIT'), StubConnection()
+    connections += [broken, fresh]
+    writer = async_db.Writer()
+    first = [item()]
+    writer._commit_batch(first)
+    with pytest.raises(sqlite3.OperationalError):
+        first[0][2].result()
+    assert broken.closed and writer.conn is None
+    # Never replayed on the new connection: the commit may have gone through
+    assert fresh.statements == []
+    second = [item()]
+    writer._commit_batch(second)
+    assert second[0][2].result() == 'ok'
+    assert writer.conn is fresh
+
+
+def test_other_errors_roll_back_and_keep_the_connection(connections):
+    conn = StubConnection(fail='COMMIT', error=sqlite3.IntegrityError)
+    connections.append(conn)
+    writer = async_db.Writer()
+    batch = [item()]
+    writer._commit_batch(batch)
+    with pytest.raises(sqlite3.IntegrityError):
+        batch[0][2].result()
+    assert conn.statements[-1] == 'ROLLBACK'
+    assert writer.conn is conn and not conn.closed
+
+
+def test_failing_item_is_rolled_back_alone(connections):
+    conn = StubConnection()
+    connections.append(conn)
+    writer = async_db.Writer()
+
+    def boom(conn):
+        raise ValueError('bad item')
+    batch = [item(), item(boom)]
+    writer._commit_batch(batch)
+    assert batch[0][2].result() == 'ok'
+    with pytest.raises(ValueError):
+        batch[1][2].result()
+    assert 'ROLLBACK TO write_item' in conn.statements and conn.statements[-1] == 'COMMIT'
+
+
+def test_writes_go_through_the_writer_thread(db):
+    def insert(conn, name):
+        return conn.execute('INSERT INTO services (name, price) VALUES (?, 1) RETURNING id', (name,)).fetchone()[0]
+
+    async def run():
+        return await asyncio.gather(*(async_db.write(insert, f's{i}') for i in range(20)))
+    ids = asyncio.run(run())
+    assert len(set(ids)) == 20
@@ -0,0 +1,96 @@
+import asyncio
+import threading
+
+import pytest
+
+import ledger
+import orders
+
+
+@pytest.fixture
+def wallet(db):
+    # User 7 holds 10.00 credits, all of it on the ledger
+    with db.db_connection() as conn:
+        conn.execute("INSERT INTO services (name, price) VALUES ('Svc', 2.5)")
+        conn.execute("INSERT INTO users (user_id, username, first_name) VALUES (7, 'u', 'U')")
+        ledger.credit(conn, 7, 1000, 'admin')
+    return db
+
+
+def balances(db, user_id=7):
+    # -> (cached balance, sum of the ledger)
+    with db.db_connection() as conn:
+        cached = conn.execute('SELECT balance_minor FROM users WHERE user_id = ?', (user_id,)).fetchone()[0]
+        total = conn.execute('SELECT COALESCE(SUM(amount_minor), 0) FROM ledger WHERE user_id = ?',
+                             (user_id,)).fetchone()[0]
+    return cached, total
+
+
+def test_minor_units():
+    assert ledger.to_minor(2.5) == 250
+    assert ledger.to_minor('0.1') == 10
+    assert ledger.format_minor(1005) == '10.05'
+    assert ledger.format_minor(-5) == '-0.05'
+
+
+def test_failed_debit_writes_nothing(wallet):
+    with pytest.raises(ledger.InsufficientFunds):
+        with wallet.db_connection() as conn:
+            ledger.debit(conn, 7, 1001, 'order')
+    with pytest.raises(ledger.InsufficientFunds):
+        with wallet.db_connection() as conn:
+            ledger.debit(conn, 8, 1, 'order')  # unknown user
+    assert balances(wallet) == (1000, 1000)
+
+
+def test_concurrent_debits_never_overdraw(wallet):
+    # 30 connections race for 10 debits' worth of credits
+    start = threading.Barrier(30)
+    results = []
+
+    def spend():
+        start.wait()
+        try:
+            with wallet.db_connection() as conn:
+                results.append(ledger.debit(conn, 7, 100, 'order'))
+        except ledger.InsufficientFunds:
+            results.append(None)
+
+    threads = [threading.Thread(target=spend) for _ in range(30)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    paid = [r for r in results if r is not None]
+    assert len(paid) == 10
+    assert sorted(paid) == list(range(0, 1000, 100))
+    assert balances(wallet) == (0, 0)
+
+
+def test_concurrent_orders_never_overdraw(wallet):
+    # Through the group-commit writer: 4 of 20 orders at 2.50 fit in 10.00
+    async def buy_all():
+        return await asyncio.gather(*(orders.place_order_async(7, 1, f'k{i}') for i in range(20)),
+                                    return_exceptions=True)
+
+    results = asyncio.run(buy_all())
+    created = [r for r in results if not isinstance(r, Exception)]
+    refused = [r for r in results if isinstance(r, ledger.InsufficientFunds)]
+    assert len(created) == 4 and len(refused) == 16
+    assert balances(wallet) == (0, 0)
+    with wallet.db_connection() as conn:
+        # A refused charge leaves neither an order nor a queue entry behind
+        assert conn.execute('SELECT COUNT(*) FROM orders').fetchone()[0] == 4
+        assert conn.execute('SELECT COUNT(*) FROM order_queue').fetchone()[0] == 4
+
+
+def test_snapshot_matches_and_compacts(wallet):
+    with wallet.db_connection() as conn:
+        ledger.debit(conn, 7, 250, 'order', 1)
+    snapshotter = ledger.LedgerSnapshotter(interval=60, batch=1, keep_days=1)
+    folded, deleted = asyncio.run(snapshotter.run_once(now=2 ** 40))
+    assert (folded, deleted) == (2, 2)
+    with wallet.db_connection() as conn:
+        snapshot = conn.execute('SELECT balance_minor FROM ledger_snapshots WHERE user_id = 7').fetchone()[0]
+    assert snapshot == 750
+    assert balances(wallet) == (750, 0)  # the history now lives in the snapshot
@@ -0,0 +1,85 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    # An empty, enabled registry; declarations made at import time stay
+    monkeypatch.setattr(metrics, 'enabled', True)
+    monkeypatch.setattr(metrics, '_histograms', {})
+    monkeypatch.setattr(metrics, '_counters', {})
+    monkeypatch.setattr(metrics, '_gauges', {})
+    return metrics
+
+
+def samples(text):
+    # Prometheus text -> {'name{labels}': value}
+    return {line.rsplit(' ', 1)[0]: float(line.rsplit(' ', 1)[1])
+            for line in text.splitlines() if line and not line.startswith('#')}
+
+
+def test_histogram_buckets(registry):
+    registry.declare('t_seconds', 'Test', ('path',))
+    # On a bound, between bounds, below the first and past the last one
+    for seconds in (0.005, 0.007, 0.0001, 10.0, 42.0, 3.0):
+        registry.observe('t_seconds', ('/',), seconds)
+    got = samples(registry.render())
+    expected = {0.001: 1, 0.005: 2, 0.01: 3, 0.025: 3, 2.5: 3, 5.0: 4, 10.0: 5}
+    for bound, count in expected.items():
+        assert got[f't_seconds_bucket{{path="/",le="{bound}"}}'] == count
+    # The 42s observation only shows up in +Inf, _sum and _count
+    assert got['t_seconds_bucket{path="/",le="+Inf"}'] == 6
+    assert got['t_seconds_count{path="/"}'] == 6
+    assert got['t_seconds_sum{path="/"}'] == pytest.approx(55.0121)
+    assert registry.histogram_totals('t_seconds')[('/',)] == (6, pytest.approx(55.0121))
+
+
+def test_buckets_are_cumulative_per_series(registry):
+    registry.declare('t_seconds', 'Test', ('path',))
+    registry.observe('t_seconds', ('/a',), 0.3)
+    registry.observe('t_seconds', ('/b',), 0.03)
+    got = samples(registry.render())
+    buckets = [got[f't_seconds_bucket{{path="/a",le="{b}"}}'] for b in metrics.BUCKETS]
+    assert buckets == sorted(buckets) and buckets[-1] == 1
+    assert got['t_seconds_bucket{path="/a",le="0.25"}'] == 0
+    assert got['t_seconds_bucket{path="/b",le="0.05"}'] == 1
+
+
+def test_disabled_records_nothing(registry, monkeypatch):
+    monkeypatch.setattr(metrics, 'enabled', False)
+    registry.observe('t_seconds', (), 1)
+    registry.inc('t_total', ())
+    assert registry.render() == '\n'
+
+
+def test_counters_gauges_and_escaping(registry):
+    registry.declare('t_total', 'Test counter', ('name',))
+    registry.inc('t_total', ('say "hi"\\',), 2)
+    registry.inc('t_total', ('say "hi"\\',))
+    registry.register_gauge('t_depth', 'Test gauge', (), lambda: {(): 4})
+    registry.register_gauge('t_broken', 'Failing gauge', (), lambda: 1 / 0)
+    text = registry.render()
+    assert '# TYPE t_total counter' in text
+    assert samples(text)['t_total{name="say \\"hi\\"\\\\"}'] == 3
+    assert samples(text)['t_depth'] == 4
+    assert 't_broken' not in text
+
+
+def test_query_fingerprint():
+    assert metrics.fingerprint("SELECT * FROM users  WHERE id = 42 AND name = 'x''y'") == \
+        'SELECT * FROM users WHERE id = ? AND name = ?'
+
+
+def test_timed_handler_labels_by_callback_prefix(registry):
+    @metrics.timed_handler
+    async def handler(update, context):
+        return 'done'
+
+    update = SimpleNamespace(callback_query=SimpleNamespace(data='ord:p:0:n:120'))
+    assert asyncio.run(handler(update, None)) == 'done'
+    (labels, (count, _)), = registry.histogram_totals('bot_handler_seconds').items()
+    assert labels == (f'{__name__}.handler', 'ord') and count == 1
@@ -0,0 +1,79 @@
+import sqlite3
+
+import pytest
+
+import database
+
+# The schema the bot shipped with before versioned migrations
+BASELINE = '''
+CREATE TABLE services (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, price REAL NOT NULL, description TEXT);
+CREATE TABLE orders (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, service_id INTEGER NOT NULL,
+                     status TEXT DEFAULT 'pending', timestamp DATETIME DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE channels (id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id TEXT NOT NULL, invite_link TEXT NOT NULL);
+CREATE TABLE users (user_id INTEGER PRIMARY KEY, username TEXT, first_name TEXT, balance REAL DEFAULT 0.0,
+                    referred_by INTEGER, joined_at DATETIME DEFAULT CURRENT_TIMESTAMP);
+INSERT INTO services (name, price) VALUES ('Svc', 2.5);
+INSERT INTO users (user_id, username, balance, referred_by) VALUES (1, 'a', 12.345, NULL), (2, 'b', 0.1, 1),
+                                                                (3, 'c', 0, 1), (4, 'd', 0.29, 99);
+INSERT INTO orders (user_id, service_id, status) VALUES (2, 1, 'approved'), (3, 1, 'pending');
+'''
+
+
+@pytest.fixture
+def baseline(tmp_path, monkeypatch):
+    path = tmp_path / 'service_bot.db'
+    raw = sqlite3.connect(path)
+    raw.executescript(BASELINE)
+    raw.close()
+    monkeypatch.setattr(database, 'DB_PATH', str(path))
+    database.close_pool()
+    yield database
+    database.close_pool()
+
+
+def columns(conn, table):
+    return {row['name'] for row in conn.execute(f'PRAGMA table_info({table})').fetchall()}
+
+
+def test_baseline_migrates_to_current_version(baseline):
+    baseline.init_db()
+    with baseline.db_connection() as conn:
+        assert baseline.schema_version(conn) == baseline.SCHEMA_VERSION
+        balances = dict(conn.execute('SELECT user_id, balance_minor FROM users').fetchall())
+        assert balances == {1: 1235, 2: 10, 3: 0, 4: 29}
+        opening = conn.execute("SELECT user_id, amount_minor FROM ledger WHERE kind = 'opening' ORDER BY user_id")
+        assert [tuple(r) for r in opening.fetchall()] == [(1, 1235), (2, 10), (4, 29)]
+        # Old processes still read these during a rolling deploy
+        assert 'balance' in columns(conn, 'users')
+        assert 'bonus' in columns(conn, 'referral_stats')
+        stats = conn.execute('SELECT referrer_id, referrals, bonus_minor FROM referral_stats').fetchall()
+        assert [tuple(r) for r in stats] == [(1, 2, 0)]
+        assert conn.execute('SELECT COUNT(*) FROM orders WHERE paid_minor IS NULL').fetchone()[0] == 2
+
+
+def test_init_db_is_idempotent(baseline):
+    baseline.init_db()
+    with baseline.db_connection() as conn:
+        before = conn.execute('SELECT COUNT(*) FROM ledger').fetchone()[0]
+    baseline.init_db()
+    # Also when a second process re-runs the slow path after the first one migrated
+    baseline.SCHEMA_VERSION += 1
+    try:
+        baseline.init_db()
+    finally:
+        baseline.SCHEMA_VERSION -= 1
+    with baseline.db_connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM ledger').fetchone()[0] == before
+        assert baseline.schema_version(conn) == baseline.SCHEMA_VERSION
+
+
+def test_referral_bonus_moves_to_minor_units(baseline):
+    with baseline.db_connection() as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        for version, migrate in baseline.MIGRATIONS[:8]:
+            migrate(conn)
+        conn.execute('UPDATE referral_stats SET bonus = 1.15 WHERE referrer_id = 1')
+        conn.execute('PRAGMA user_version = 8')
+    baseline.init_db()
+    with baseline.db_connection() as conn:
+        assert conn.execute('SELECT bonus_minor FROM referral_stats WHERE referrer_id = 1').fetchone()[0] == 115
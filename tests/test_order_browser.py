@@ -0,0 +1,84 @@
+import asyncio
+import re
+
+import pytest
+
+import order_browser
+
+STATUSES = ['pending', 'approved', 'rejected', 'completed']
+
+
+@pytest.fixture
+def shop(db):
+    # Orders 1..23 cycle through the statuses; odd ids are service 1, even ids service 2
+    with db.db_connection() as conn:
+        conn.execute("INSERT INTO services (name, price) VALUES ('A', 1), ('B', 1)")
+        for i in range(1, 24):
+            conn.execute('INSERT INTO orders (user_id, service_id, status) VALUES (?, ?, ?)',
+                         (100 + i, 2 - i % 2, STATUSES[i % 4]))
+    order_browser.invalidate_counts()
+    yield db
+    order_browser.invalidate_counts()
+
+
+def page(*args, **kwargs):
+    # -> (order ids on the page, {button text: parsed callback})
+    text, markup = asyncio.run(order_browser.render_page(*args, **kwargs))
+    ids = [int(i) for i in re.findall(r'Order #(\d+)', text)]
+    nav = {b.text: order_browser.parse_callback(b.callback_data)
+           for row in markup.inline_keyboard for b in row if b.callback_data.startswith('ord:')}
+    return ids, nav
+
+
+def walk(status_code, service_id):
+    # Follows "Older" to the end, then "Newer" back to the start
+    pages = []
+    ids, nav = page(status_code, service_id, page_size=3)
+    pages.append(ids)
+    while 'Older ➡️' in nav:
+        ids, nav = page(*nav['Older ➡️'], page_size=3)
+        pages.append(ids)
+    back = [ids]
+    while '⬅️ Newer' in nav:
+        ids, nav = page(*nav['⬅️ Newer'], page_size=3)
+        back.append(ids)
+    return pages, back[::-1]
+
+
+@pytest.mark.parametrize('status_code, service_id, expected', [
+    ('a', 0, list(range(23, 0, -1))),
+    ('p', 0, [20, 16, 12, 8, 4]),
+    ('a', 2, list(range(22, 0, -2))),
+    ('v', 1, [21, 17, 13, 9, 5, 1]),
+])
+def test_pages_cover_every_order_once(shop, status_code, service_id, expected):
+    forward, backward = walk(status_code, service_id)
+    assert [i for p in forward for i in p] == expected
+    assert all(len(p) == 3 for p in forward[:-1])
+    assert backward == forward
+
+
+def test_first_and_last_page_buttons(shop):
+    ids, nav = page(page_size=30)
+    assert len(ids) == 23
+    assert '⬅️ Newer' not in nav and 'Older ➡️' not in nav
+    ids, nav = page('r', 0, 'n', 0, page_size=30)
+    assert ids == [22, 18, 14, 10, 6, 2]
+    assert nav['• ❌ Rejected'] == ('r', 0, 'n', 0)
+
+
+def test_empty_filter(shop):
+    ids, nav = page('c', 2, page_size=3)
+    assert ids == []
+    assert 'Older ➡️' not in nav
+
+
+@pytest.mark.parametrize('data', ['ord:x:0:n:0', 'ord:a:0:q:0', 'ord:a:zero:n:0', 'ord:a', 'btn_orders'])
+def test_parse_callback_falls_back_to_first_page(data):
+    assert order_browser.parse_callback(data) == ('a', 0, 'n', 0)
+
+
+def test_callback_round_trip():
+    data = order_browser.callback_data('v', 3, 'p', 120)
+    assert order_browser.parse_callback(data) == ('v', 3, 'p', 120)
+    assert len(data.encode()) <= 64  # Telegram's callback_data limit
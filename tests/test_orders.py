@@ -0,0 +1,83 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import ledger
+import orders
+
+
+@pytest.fixture
+def shop(db):
+    # Users 7 and 8 with 10.00 credits each, one service at 1.00
+    with db.db_connection() as conn:
+        conn.execute("INSERT INTO services (name, price) VALUES ('Svc', 1)")
+        conn.execute("INSERT INTO users (user_id, username, first_name, balance_minor) "
+                     "VALUES (7, 'u', 'U', 1000), (8, 'v', 'V', 1000)")
+    return db
+
+
+def state(db):
+    # -> (orders per user, balance per user)
+    with db.db_connection() as conn:
+        counts = dict(conn.execute('SELECT user_id, COUNT(*) FROM orders GROUP BY user_id').fetchall())
+        balances = dict(conn.execute('SELECT user_id, balance_minor FROM users').fetchall())
+    return counts, balances
+
+
+def test_replayed_key_returns_the_original_order(shop):
+    order_id, created = orders.place_order(7, 1, 'tap-1')
+    assert created
+    assert orders.place_order(7, 1, 'tap-1') == (order_id, False)
+    assert state(shop) == ({7: 1}, {7: 900, 8: 1000})
+
+
+def test_keys_are_scoped_to_the_user(shop):
+    first, _ = orders.place_order(7, 1, 'tap-1')
+    second, created = orders.place_order(8, 1, 'tap-1')
+    assert created and second != first
+    assert state(shop) == ({7: 1, 8: 1}, {7: 900, 8: 900})
+
+
+@pytest.mark.parametrize('key', [None, ''])
+def test_no_key_places_a_new_order_each_time(shop, key):
+    ids = {orders.place_order(7, 1, key)[0] for _ in range(3)}
+    assert len(ids) == 3
+    assert state(shop) == ({7: 3}, {7: 700, 8: 1000})
+
+
+def test_concurrent_double_taps_place_one_order(shop):
+    async def tap():
+        return await asyncio.gather(*(orders.place_order_async(7, 1, 'tap-1') for _ in range(10)))
+
+    results = asyncio.run(tap())
+    assert len({order_id for order_id, _ in results}) == 1
+    assert sum(created for _, created in results) == 1
+    assert state(shop) == ({7: 1}, {7: 900, 8: 1000})
+
+
+def test_double_taps_from_worker_threads(shop):
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(lambda _: orders.place_order(7, 1, 'tap-1'), range(16)))
+    assert len({order_id for order_id, _ in results}) == 1
+    assert sum(created for _, created in results) == 1
+    assert state(shop) == ({7: 1}, {7: 900, 8: 1000})
+
+
+def test_refused_order_can_be_retried_with_the_same_key(shop):
+    with shop.db_connection() as conn:
+        conn.execute('UPDATE users SET balance_minor = 50 WHERE user_id = 7')
+    with pytest.raises(ledger.InsufficientFunds):
+        orders.place_order(7, 1, 'tap-1')
+    assert state(shop)[0] == {}
+    with shop.db_connection() as conn:
+        ledger.credit(conn, 7, 50, 'admin')
+    assert orders.place_order(7, 1, 'tap-1')[1]
+
+
+def test_bad_requests(shop):
+    with pytest.raises(orders.InvalidIdempotencyKey):
+        orders.place_order(7, 1, 'k' * (orders.MAX_KEY_LENGTH + 1))
+    with pytest.raises(ValueError, match='Unknown service'):
+        orders.place_order(7, 99, 'tap-1')
+    assert state(shop) == ({}, {7: 1000, 8: 1000})
@@ -0,0 +1,73 @@
+import asyncio
+
+from telegram.error import RetryAfter
+
+import broadcast
+import outbound
+
+
+def run_request(lane, failures):
+    # -> (callback calls, error raised or None) for a send that floods `failures` times
+    scheduler = outbound.OutboundScheduler(rate=1000, chat_rate=1000, chat_burst=100, max_retries=3)
+    calls = []
+
+    async def callback():
+        calls.append(1)
+        if len(calls) <= failures:
+            raise RetryAfter(0)
+        return True
+
+    async def main():
+        try:
+            await scheduler.process_request(callback, (), {}, 'sendMessage', {'chat_id': 1}, lane)
+        except RetryAfter as e:
+            return e
+        finally:
+            await scheduler.shutdown()
+    error = asyncio.run(main())
+    return len(calls), error
+
+
+def test_interactive_calls_are_retried_by_the_scheduler():
+    assert run_request(None, 2) == (3, None)
+    calls, error = run_request(None, 10)
+    assert calls == 4 and isinstance(error, RetryAfter)
+
+
+def test_bulk_calls_are_left_to_the_broadcast():
+    calls, error = run_request(outbound.BULK, 1)
+    assert calls == 1 and isinstance(error, RetryAfter)
+
+
+class FloodingBot:
+    # Answers the first `floods` sends with RetryAfter, through the real scheduler
+    def __init__(self, floods):
+        self.floods = floods
+        self.calls = 0
+        self.rate_limiter = outbound.OutboundScheduler(rate=1000, chat_rate=1000, chat_burst=100)
+
+    async def send_message(self, chat_id, text, rate_limit_args=None):
+        async def callback():
+            self.calls += 1
+            if self.calls <= self.floods:
+                raise RetryAfter(0)
+            return True
+        return await self.rate_limiter.process_request(callback, (), {}, 'sendMessage', {'chat_id': chat_id},
+                                                       rate_limit_args)
+
+
+def send_one(floods, max_attempts=3):
+    bot = FloodingBot(floods)
+    job = {'text': 'hi', 'flood': 0}
+
+    async def main():
+        try:
+            return await broadcast._send_one(bot, job, 1, broadcast.TokenBucket(1000), max_attempts)
+        finally:
+            await bot.rate_limiter.shutdown()
+    return asyncio.run(main()), job['flood'], bot.calls
+
+
+def test_each_flood_wait_is_one_send_and_one_count():
+    assert send_one(1) == ('sent', 1, 2)
+    assert send_one(5) == ('failed', 3, 3)
@@ -0,0 +1,55 @@
+import asyncio
+
+from telegram import Chat, Message, Update, User
+
+from update_processor import PerUserUpdateProcessor
+
+
+def update(user_id, update_id):
+    return Update(update_id, message=Message(update_id, None, Chat(user_id, 'private'),
+                                             from_user=User(user_id, 'u', False)))
+
+
+def run_updates(limit, updates):
+    # updates: [(user_id, seconds)] -> (finish order, peak concurrency)
+    processor = PerUserUpdateProcessor(limit)
+    finished, running, peak = [], [0], [0]
+
+    async def handle(name, seconds):
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+        await asyncio.sleep(seconds)
+        running[0] -= 1
+        finished.append(name)
+
+    async def main():
+        await asyncio.gather(*(processor.process_update(update(user_id, i), handle((user_id, i), seconds))
+                               for i, (user_id, seconds) in enumerate(updates)))
+    asyncio.run(main())
+    return finished, peak[0]
+
+
+def test_same_user_runs_in_arrival_order():
+    finished, peak = run_updates(4, [(1, 0.03), (1, 0.01), (1, 0)])
+    assert finished == [(1, 0), (1, 1), (1, 2)]
+    assert peak == 1
+
+
+def test_waiting_updates_hold_no_slot():
+    # Eight queued updates from user 1 must not keep user 2 out with a limit of 2
+    finished, _ = run_updates(2, [(1, 0.05)] * 8 + [(2, 0)])
+    assert finished.index((2, 8)) <= 1
+
+
+def test_concurrency_limit_holds():
+    _, peak = run_updates(3, [(user_id, 0.02) for user_id in range(10)])
+    assert peak == 3
+
+
+def test_locks_are_dropped_when_idle():
+    processor = PerUserUpdateProcessor(2)
+
+    async def main():
+        await processor.process_update(update(1, 1), asyncio.sleep(0))
+    asyncio.run(main())
+    assert processor._locks == {}
@@ -0,0 +1,91 @@
+import asyncio
+
+import httpx
+import pytest
+
+import app as web
+import asgi
+import catalog
+import webapp_auth
+
+BOT_TOKEN = '1000:test'
+
+
+@pytest.fixture
+def shop(db, monkeypatch):
+    monkeypatch.setattr(webapp_auth, 'verifier', webapp_auth.InitDataVerifier(BOT_TOKEN, 86400, 100))
+    with db.db_connection() as conn:
+        conn.execute("INSERT INTO services (name, price, description) VALUES ('Cheap', 2.5, 'x'), ('Dear', 500, 'y')")
+        conn.execute("INSERT INTO users (user_id, username, first_name, balance_minor) VALUES (7, 'u', 'U', 1000)")
+    catalog.cache.refresh(force=True)
+    return webapp_auth.sign(BOT_TOKEN, {'id': 7, 'first_name': 'U'})
+
+
+def both(method, path, headers=None, **kwargs):
+    # The same request through Flask (WSGI) and asgi.app -> (flask response, asgi response)
+    flask = web.app.test_client().open(path, method=method, headers=headers, **kwargs)
+
+    async def run():
+        transport = httpx.ASGITransport(app=asgi.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            return await client.request(method, path, headers=headers, **kwargs)
+    return flask, asyncio.run(run())
+
+
+def comparable(headers):
+    return {k.lower(): v for k, v in headers.items() if k.lower() not in ('date', 'content-length')}
+
+
+@pytest.mark.parametrize('method, path, headers', [
+    ('GET', '/', {}),
+    ('HEAD', '/', {}),
+    ('GET', '/', {'If-Modified-Since': 'not a date'}),
+    ('GET', '/buy', {}),
+    ('GET', '/missing', {}),
+    ('GET', '/static/css/style.css', {}),
+])
+def test_pages_match_flask(shop, method, path, headers):
+    flask, native = both(method, path, headers)
+    assert native.status_code == flask.status_code
+    assert comparable(native.headers) == comparable(flask.headers)
+    assert native.content == flask.get_data()
+
+
+def test_conditional_get_matches_flask(shop):
+    first, _ = both('GET', '/')
+    for headers in ({'If-None-Match': first.headers['ETag']},
+                    {'If-None-Match': 'W/' + first.headers['ETag'] + ', "other"'},
+                    {'If-Modified-Since': first.headers['Last-Modified']}):
+        flask, native = both('GET', '/', headers)
+        assert flask.status_code == native.status_code == 304
+        assert comparable(native.headers) == comparable(flask.headers)
+
+
+@pytest.mark.parametrize('body, expected', [
+    ({}, (400, 'Missing data')),
+    ([1], (400, 'Missing data')),
+    ({'service_id': 99}, (400, 'Unknown service')),
+    ({'service_id': 2}, (402, 'Not enough credits')),
+    ({'service_id': 1, 'idempotency_key': 'x' * 500}, (400, None)),
+])
+def test_buy_errors_match_flask(shop, body, expected):
+    flask, native = both('POST', '/buy', {webapp_auth.HEADER: shop}, json=body)
+    assert native.status_code == flask.status_code == expected[0]
+    assert native.json() == flask.get_json()
+    if expected[1]:
+        assert native.json()['message'] == expected[1]
+
+
+def test_buy_rejects_unsigned_requests(shop):
+    for headers in ({}, {webapp_auth.HEADER: 'user=%7B%7D&hash=0'}):
+        flask, native = both('POST', '/buy', headers, json={'service_id': 1})
+        assert native.status_code == flask.status_code == 401
+        assert native.json() == flask.get_json()
+
+
+def test_buy_places_order_once_per_key(shop):
+    headers = {webapp_auth.HEADER: shop, 'Idempotency-Key': 'same-key'}
+    flask, native = both('POST', '/buy', headers, json={'service_id': 1})
+    assert flask.get_json()['duplicate'] is False
+    assert native.json()['duplicate'] is True
+    assert native.json()['order_id'] == flask.get_json()['order_id']
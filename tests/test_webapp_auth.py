@@ -0,0 +1,66 @@
+from urllib.parse import parse_qsl, urlencode
+
+import pytest
+
+from webapp_auth import InitDataVerifier, InvalidInitData, sign
+
+BOT_TOKEN = '1000:test'
+NOW = 1790000000
+USER = {'id': 7, 'first_name': 'U', 'username': 'u'}
+
+
+@pytest.fixture
+def verifier():
+    return InitDataVerifier(BOT_TOKEN, 3600, 2)
+
+
+def tampered(init_data, **changes):
+    fields = dict(parse_qsl(init_data))
+    fields.update(changes)
+    return urlencode(fields)
+
+
+def test_accepts_signed_data(verifier):
+    init_data = sign(BOT_TOKEN, USER, NOW - 60, query_id='AAE')
+    assert verifier.verify(init_data, now=NOW) == USER
+    # Cached now, and the user id is always an int
+    assert verifier.verify(init_data, now=NOW)['id'] == 7
+    assert init_data in verifier.cache
+
+
+@pytest.mark.parametrize('init_data', [
+    None,
+    '',
+    'x' * 5000,
+    sign('1000:other', USER, NOW),                                     # another bot's token
+    tampered(sign(BOT_TOKEN, USER, NOW), user='{"id":8,"first_name":"M"}'),
+    tampered(sign(BOT_TOKEN, USER, NOW), auth_date=str(NOW + 60)),
+    tampered(sign(BOT_TOKEN, USER, NOW), hash='0' * 64),
+    urlencode({k: v for k, v in parse_qsl(sign(BOT_TOKEN, USER, NOW)) if k != 'hash'}),
+    sign(BOT_TOKEN, {'first_name': 'No id'}, NOW),
+])
+def test_rejects_bad_data(verifier, init_data):
+    with pytest.raises(InvalidInitData):
+        verifier.verify(init_data, now=NOW)
+    assert not verifier.cache
+
+
+def test_expiry(verifier):
+    init_data = sign(BOT_TOKEN, USER, NOW)
+    assert verifier.verify(init_data, now=NOW + 3600) == USER
+    with pytest.raises(InvalidInitData, match='expired'):
+        verifier.verify(init_data, now=NOW + 3601)
+    # A cached entry expires with its auth_date too
+    assert init_data not in verifier.cache
+
+
+def test_unconfigured_token_rejects_everything():
+    with pytest.raises(InvalidInitData):
+        InitDataVerifier('', 3600, 2).verify(sign(BOT_TOKEN, USER, NOW), now=NOW)
+
+
+def test_cache_is_bounded(verifier):
+    signed = [sign(BOT_TOKEN, dict(USER, id=i), NOW) for i in range(3)]
+    for init_data in signed:
+        verifier.verify(init_data, now=NOW)
+    assert list(verifier.cache) == signed[1:]
@@ -0,0 +1,59 @@
+import asyncio
+import sys
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# Process updates concurrently (up to max_concurrent_updates at a time) while
+# keeping updates from the same user strictly in arrival order. One slow
+# get_chat_member call then only delays that user, not everyone else, and a
+# user's button presses still run one after another.
+#
+# The limit is this class's own semaphore, taken after the user's lock, so an
+# update waiting for its turn holds no slot and one fast tapper can't fill
+# them all. The base class's semaphore (taken before do_process_update) is
+# sized so it never blocks; PTB only checks that it is above 1.
+
+
+def serialization_key(update):
+    if isinstance(update, Update):
+        if update.effective_user:
+            return ('user', update.effective_user.id)
+        if update.effective_chat:
+            return ('chat', update.effective_chat.id)
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates):
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer!")
+        super().__init__(sys.maxsize)
+        self.limit = max_concurrent_updates
+        self.slots = asyncio.Semaphore(max_concurrent_updates)
+        self._locks = {}  # key -> [lock, number of updates holding/waiting]
+
+    async def do_process_update(self, update, coroutine):
+        key = serialization_key(update)
+        if key is None:
+            async with self.slots:
+                await coroutine
+            return
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # asyncio.Lock is FIFO, so same-user updates run in arrival order
+            async with entry[0], self.slots:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
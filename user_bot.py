@@ -1,8 +1,16 @@
 import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, CallbackQueryHandler
-from config import USER_BOT_TOKEN, ADMIN_ID
-from database import get_db_connection
+from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, CallbackQueryHandler, ChatMemberHandler
+from config import USER_BOT_TOKEN, ADMIN_ID, UPDATE_CONCURRENCY
+from update_processor import PerUserUpdateProcessor
+from metrics import timed_handler, InstrumentedRequest
+import outbound
+import async_db as db
+import registration
+import referrals
+import ledger
+import membership
+from membership import missing_channels
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -10,48 +18,29 @@ logging.basicConfig(
 )
 
 async def post_init(application: ApplicationBuilder):
+    membership.reconciler.start(application.bot)
     try:
         if ADMIN_ID:
             await application.bot.send_message(chat_id=ADMIN_ID, text="🚀 User Bot launched with Referral System!")
     except: pass
 
 async def register_user(user_id, username, first_name, referrer_id=None):
-    conn = get_db_connection()
+    # Queued in the write-behind buffer, written in batches (see registration.py)
     try:
-        # Check if user exists
-        exists = conn.execute('SELECT 1 FROM users WHERE user_id = ?', (user_id,)).fetchone()
-        if not exists:
-            conn.execute('INSERT INTO users (user_id, username, first_name, referred_by) VALUES (?, ?, ?, ?)', 
-                         (user_id, username, first_name, referrer_id))
-            conn.commit()
-            
-            # Bonus logic for referrer could go here
-            if referrer_id:
-                # Notify referrer?
-                pass
+        registration.buffer.add(user_id, username, first_name, referrer_id)
     except Exception as e:
         logging.error(f"Error registering: {e}")
-    finally:
-        conn.close()
 
-async def check_membership(user_id, context):
-    conn = get_db_connection()
+async def post_shutdown(application: ApplicationBuilder):
+    await membership.reconciler.stop()
+    await registration.buffer.close()
+
+async def check_membership(user_id, context, recheck=False):
     try:
-        channels = conn.execute('SELECT * FROM channels').fetchall()
-    except:
+        return await missing_channels(context.bot, user_id, recheck=recheck)
+    except Exception as e:
+        logging.error(f"Error checking membership: {e}")
         return []
-    finally:
-        conn.close()
-
-    missing_channels = []
-    for ch in channels:
-        try:
-            member = await context.bot.get_chat_member(chat_id=ch['chat_id'], user_id=user_id)
-            if member.status in ['left', 'kicked', 'restricted']:
-                missing_channels.append(ch)
-        except:
-            missing_channels.append(ch)
-    return missing_channels
 
 async def show_join_channels(update, context, missing_channels):
     keyboard = []
@@ -66,6 +55,7 @@ async def show_join_channels(update, context, missing_channels):
     else:
         await context.bot.send_message(chat_id=update.effective_chat.id, text=msg, reply_markup=reply_markup, parse_mode='Markdown')
 
+@timed_handler
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     username = update.effective_user.username
@@ -107,13 +97,22 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         await context.bot.send_message(chat_id=update.effective_chat.id, text=text, reply_markup=reply_markup, parse_mode='Markdown')
 
+@timed_handler
+async def chat_member_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Join/leave in a required channel; keeps the membership index current
+    try:
+        await membership.record_event(update.chat_member)
+    except Exception as e:
+        logging.error(f"Error recording membership change: {e}")
+
+@timed_handler
 async def btn_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     user_id = query.from_user.id
     await query.answer()
     
     if query.data == "check_joined":
-        missing = await check_membership(user_id, context)
+        missing = await check_membership(user_id, context, recheck=True)
         if missing:
             await query.answer("❌ Join channels first!", show_alert=True)
         else:
@@ -124,16 +123,16 @@ async def btn_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await start(update, context)
 
     elif query.data == "show_profile":
-        conn = get_db_connection()
-        user = conn.execute('SELECT * FROM users WHERE user_id = ?', (user_id,)).fetchone()
-        conn.close()
-        balance = user['balance'] if user else 0.0
+        user = await db.get_user(user_id)
+        balance = ledger.format_minor(user['balance_minor'] if user else 0)
+        referred, _ = await referrals.get_stats(user_id)
         
         text = (
             f"👤 **My Profile**\n\n"
             f"🆔 ID: `{user_id}`\n"
             f"👤 Name: {query.from_user.full_name}\n"
-            f"💳 Credits: **{balance:.2f}**\n\n"
+            f"💳 Credits: **{balance}**\n"
+            f"👥 You referred **{referred}** friends\n\n"
         )
         keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="back_to_menu")]]
         await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
@@ -152,10 +151,13 @@ async def btn_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif query.data == "referral_info":
         bot_username = context.bot.username
         link = f"https://t.me/{bot_username}?start={user_id}"
+        referred, bonus = await referrals.get_stats(user_id)
         
         text = (
             "🔗 **Refer & Earn**\n\n"
             "Share your link and earn bonus credits!\n\n"
+            f"👥 Friends referred: **{referred}**\n"
+            f"🎁 Bonus earned: **{ledger.format_minor(bonus)}**\n\n"
             f"Your Link:\n`{link}`\n\n"
             "Tap to copy!"
         )
@@ -168,8 +170,14 @@ async def btn_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 if __name__ == '__main__':
     if not USER_BOT_TOKEN: exit(1)
-    application = ApplicationBuilder().token(USER_BOT_TOKEN).post_init(post_init).build()
+    application = (ApplicationBuilder().token(USER_BOT_TOKEN).post_init(post_init).post_shutdown(post_shutdown)
+                   .concurrent_updates(PerUserUpdateProcessor(UPDATE_CONCURRENCY))
+                   .request(InstrumentedRequest(connection_pool_size=256))
+                   .get_updates_request(InstrumentedRequest())
+                   .rate_limiter(outbound.scheduler).build())
     application.add_handler(CommandHandler('start', start))
     application.add_handler(CallbackQueryHandler(btn_handler))
+    application.add_handler(ChatMemberHandler(chat_member_update, ChatMemberHandler.CHAT_MEMBER))
     print("User Bot Running...")
-    application.run_polling()
+    # chat_member updates are only delivered when asked for explicitly
+    application.run_polling(allowed_updates=Update.ALL_TYPES)
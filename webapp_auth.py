@@ -0,0 +1,116 @@
+import functools
+import hashlib
+import hmac
+import json
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode
+from config import USER_BOT_TOKEN, WEBAPP_AUTH_MAX_AGE, WEBAPP_AUTH_CACHE_SIZE
+import metrics
+
+# Telegram Mini App authentication. The web app sends Telegram.WebApp.initData
+# (a signed query string) in the X-Telegram-Init-Data header; we check its
+# HMAC against the user bot's token and take the user from it, never from the
+# request body. The HMAC key is derived from the token once per process, and
+# verified initData strings are kept in a bounded LRU until their auth_date
+# expires, so the rest of a session's requests skip parsing and hashing.
+
+HEADER = 'X-Telegram-Init-Data'
+
+metrics.declare('webapp_auth_total', 'Mini App initData checks', ('result',))
+
+
+class InvalidInitData(ValueError):
+    pass
+
+
+def secret_key(bot_token):
+    return hmac.new(b'WebAppData', bot_token.encode('utf-8'), hashlib.sha256).digest()
+
+
+def _data_check_string(fields):
+    return '\n'.join(f"{k}={v}" for k, v in sorted(fields.items()))
+
+
+def sign(bot_token, user, auth_date=None, **extra):
+    # Builds initData the way Telegram does; for the benchmark and local testing
+    fields = {'user': json.dumps(user, separators=(',', ':')),
+              'auth_date': str(int(time.time() if auth_date is None else auth_date)), **extra}
+    fields['hash'] = hmac.new(secret_key(bot_token), _data_check_string(fields).encode('utf-8'),
+                              hashlib.sha256).hexdigest()
+    return urlencode(fields)
+
+
+class InitDataVerifier:
+    def __init__(self, bot_token, max_age, cache_size):
+        self.secret = secret_key(bot_token) if bot_token else None
+        self.max_age = max_age
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # initData -> (user, expires at)
+        self.lock = threading.Lock()
+
+    def verify(self, init_data, now=None):
+        # -> user dict (id, first_name, username...) or raises InvalidInitData
+        now = time.time() if now is None else now
+        with self.lock:
+            item = self.cache.get(init_data)
+            if item is not None:
+                if item[1] > now:
+                    self.cache.move_to_end(init_data)
+                    metrics.inc('webapp_auth_total', ('hit',))
+                    return item[0]
+                del self.cache[init_data]
+        try:
+            user, auth_date = self._check(init_data, now)
+        except InvalidInitData:
+            metrics.inc('webapp_auth_total', ('invalid',))
+            raise
+        metrics.inc('webapp_auth_total', ('verified',))
+        with self.lock:
+            self.cache[init_data] = (user, auth_date + self.max_age)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return user
+
+    def _check(self, init_data, now):
+        if self.secret is None:
+            raise InvalidInitData("Mini App authentication is not configured")
+        if not init_data or len(init_data) > 4096:
+            raise InvalidInitData("Missing Telegram init data")
+        fields = dict(parse_qsl(init_data, keep_blank_values=True))
+        received = fields.pop('hash', '')
+        expected = hmac.new(self.secret, _data_check_string(fields).encode('utf-8'), hashlib.sha256).hexdigest()
+        if not hmac.compare_digest(expected, received):
+            raise InvalidInitData("Invalid Telegram init data")
+        try:
+            auth_date = int(fields['auth_date'])
+            user = json.loads(fields['user'])
+            user['id'] = int(user['id'])
+        except (KeyError, TypeError, ValueError):
+            raise InvalidInitData("Invalid Telegram init data")
+        if now - auth_date > self.max_age:
+            raise InvalidInitData("Session expired, reopen the app")
+        return user, auth_date
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+
+
+verifier = InitDataVerifier(USER_BOT_TOKEN, WEBAPP_AUTH_MAX_AGE, WEBAPP_AUTH_CACHE_SIZE)
+
+
+def webapp_user_required(view):
+    # Flask views: rejects the request with 401 unless initData checks out,
+    # otherwise the Telegram user is in flask.g.webapp_user
+    from flask import g, jsonify, request
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            g.webapp_user = verifier.verify(request.headers.get(HEADER))
+        except InvalidInitData as e:
+            return jsonify({'success': False, 'message': str(e)}), 401
+        return view(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,133 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+from telegram import Update
+from config import WEBHOOK_SECRET
+
+logger = logging.getLogger(__name__)
+
+# One HTTP listener for both bots in webhook mode. Each bot gets a secret
+# path and a secret token (sent back by Telegram in the
+# X-Telegram-Bot-Api-Secret-Token header), both derived from its token, and
+# incoming updates are put straight onto that Application's update_queue.
+#
+# Local test: POST a recorded update to http://127.0.0.1:<port>/<path> with
+# the matching header (`python webhook.py` prints both for each bot).
+
+MAX_BODY = 1024 * 1024
+REASONS = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+           405: 'Method Not Allowed', 413: 'Payload Too Large'}
+
+
+def _derive(token, purpose):
+    key = (WEBHOOK_SECRET or '').encode() + token.encode()
+    return hmac.new(key, purpose.encode(), hashlib.sha256).hexdigest()
+
+
+def webhook_path(token):
+    return '/tg/' + _derive(token, 'path')[:32]
+
+
+def secret_token(token):
+    return _derive(token, 'secret-token')
+
+
+class WebhookServer:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.routes = {}  # path -> (application, secret token)
+        self.server = None
+        self.connections = set()
+
+    def add_bot(self, application, token):
+        path = webhook_path(token)
+        self.routes[path] = (application, secret_token(token))
+        return path
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"Webhook listener on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            # Idle keep-alive connections would otherwise hold wait_closed() open
+            tasks = list(self.connections)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.server.wait_closed()
+            self.server = None
+
+    async def _dispatch(self, method, path, headers, body):
+        route = self.routes.get(path.split('?', 1)[0])
+        if route is None:
+            return 404
+        if method != 'POST':
+            return 405
+        application, secret = route
+        if not hmac.compare_digest(headers.get('x-telegram-bot-api-secret-token', ''), secret):
+            return 403
+        try:
+            update = Update.de_json(json.loads(body), application.bot)
+        except Exception:
+            return 400
+        await application.update_queue.put(update)
+        return 200
+
+    async def _handle(self, reader, writer):
+        # Minimal HTTP/1.1: Content-Length bodies and keep-alive, which is all Telegram sends
+        task = asyncio.current_task()
+        self.connections.add(task)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, path, version = line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b'\r\n', b'\n', b''):
+                        break
+                    k, _, v = h.decode('latin-1').partition(':')
+                    headers[k.strip().lower()] = v.strip()
+
+                length = int(headers.get('content-length') or 0)
+                if length > MAX_BODY:
+                    status, keep_alive = 413, False
+                else:
+                    body = await reader.readexactly(length) if length else b''
+                    status = await self._dispatch(method, path, headers, body)
+                    keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                    f"Content-Length: 0\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1'))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError, asyncio.CancelledError):
+            pass
+        finally:
+            self.connections.discard(task)
+            writer.close()
+
+
+async def set_webhook(application, token, base_url):
+    await application.bot.set_webhook(
+        url=base_url.rstrip('/') + webhook_path(token),
+        secret_token=secret_token(token),
+        allowed_updates=Update.ALL_TYPES,
+    )
+
+
+if __name__ == '__main__':
+    from config import USER_BOT_TOKEN, ADMIN_BOT_TOKEN
+    for name, token in (('user', USER_BOT_TOKEN), ('admin', ADMIN_BOT_TOKEN)):
+        if token:
+            print(f"{name}: path={webhook_path(token)} X-Telegram-Bot-Api-Secret-Token: {secret_token(token)}")